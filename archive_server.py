@@ -0,0 +1,107 @@
+#! /usr/bin/env python
+"""
+Local stand-in for the squash club web site: serves a mirror of its
+pages from a directory, so that crawls can run without the real site
+(`squash_crawl.py --url http://localhost:8000/`).
+
+The mirror is created from the page cache of earlier crawls with
+`--mirror`.
+"""
+import os
+import sys
+import argparse
+import email.utils
+import BaseHTTPServer
+import SimpleHTTPServer
+import SocketServer
+
+import page_cache
+from squash_io import write_atomic
+
+MIRRORDIR = 'archive_mirror'
+
+def mirror(cachedir, root, site=page_cache.SITEURL):
+    """
+    Write all pages of `site` in the page cache to files under `root`,
+    with the modification times of the original pages where known.
+    Returns the number of pages written.
+    """
+    cache = page_cache.PageCache(cachedir, offline=True)
+    n_pages = 0
+    for url, entry in sorted(cache.index.iteritems()):
+        if not url.startswith(site): continue
+        path = url[len(site):].split('?')[0].split('#')[0]
+        if not path or path.endswith('/'): path += 'index.html'
+        content = cache.get(url)
+        if content is None: continue
+
+        filename = os.path.join(root, *path.split('/'))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        write_atomic(filename, content)
+        modified = email.utils.parsedate_tz(entry.get('last_modified') or '')
+        mtime = email.utils.mktime_tz(modified) if modified else entry['fetched']
+        os.utime(filename, (mtime, mtime))
+        n_pages += 1
+    return n_pages
+
+class ArchiveHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    Serves the files in the current directory, answering requests with an
+    If-Modified-Since header with '304 Not Modified' where possible.
+    """
+    quiet = False
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        since = self.headers.getheader('If-Modified-Since')
+        if since and os.path.isfile(path):
+            since = email.utils.parsedate_tz(since)
+            if since and int(os.stat(path).st_mtime) <= email.utils.mktime_tz(since):
+                self.send_response(304)
+                self.end_headers()
+                return None
+        return SimpleHTTPServer.SimpleHTTPRequestHandler.send_head(self)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            SimpleHTTPServer.SimpleHTTPRequestHandler.log_message(self, format, *args)
+
+class ArchiveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a local mirror of the squash club web site")
+    parser.add_argument('-d', '--directory', help='Mirror directory', default=MIRRORDIR)
+    parser.add_argument('-p', '--port', type=int, default=8000)
+    parser.add_argument('--bind', help='Address to listen on', default='127.0.0.1')
+    parser.add_argument('-q', '--quiet', action="store_true", help="Don't log requests")
+    parser.add_argument('--mirror', action="store_true",
+                        help='Create the mirror from the page cache, then exit')
+    parser.add_argument('--cache-dir', help='Page cache to mirror',
+                        default=page_cache.CACHEDIR)
+    parser.add_argument('--site', help='Root url of the mirrored site',
+                        default=page_cache.SITEURL)
+    args = parser.parse_args()
+
+    if args.mirror:
+        n_pages = mirror(args.cache_dir, args.directory, args.site)
+        print 'Wrote %d pages to %s' % (n_pages, args.directory)
+        return 0
+
+    if not os.path.isdir(args.directory):
+        print 'No mirror in %s, create one with --mirror' % args.directory
+        return -1
+    os.chdir(args.directory)
+    ArchiveHandler.quiet = args.quiet
+    server = ArchiveServer((args.bind, args.port), ArchiveHandler)
+    print 'Serving %s on http://%s:%d/' % (args.directory, args.bind, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
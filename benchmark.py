@@ -0,0 +1,423 @@
+#! /usr/bin/env python
+"""
+Benchmarks of the crawler and the Elo calculation over a frozen corpus
+of archive pages, with a check of the output against golden files.
+
+The corpus is a page cache directory with a selection of season pages
+(and the sub files they link to), frozen from the cache of a crawl with
+`--freeze`, together with the player name dictionary at that time and
+the output of the code at that time (golden.json):
+
+  bench_corpus/pages/            page cache (see page_cache.py)
+  bench_corpus/player_names.txt  name dictionary
+  bench_corpus/golden.json       parsed pages, squash data and ratings
+
+The corpus in the repository is made up (`--generate`, see `generate`),
+in the layouts of the archive pages, as the archive site can't always
+be reached. A corpus frozen from a real crawl can replace it.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+
+import page_cache
+import page_parsers
+import squash_crawl
+from squash_names import clean_name, AliasStore
+from match_table import MatchTable
+from calculate_elo import run_elo
+
+CORPUS = 'bench_corpus'
+BENCHMARKS = ['parse', 'normalize', 'aggregate', 'elo']
+
+def corpus_path(corpus, name):
+    return os.path.join(corpus, name)
+
+def season_of(url):
+    """Season key of a season page url, as in squash_crawl.process_archives"""
+    return url.rsplit('/', 1)[1].rsplit('.')[0]
+
+def freeze(cache_dir, corpus, sites=None):
+    """
+    Copy the season pages (optionally only the ones named in `sites`, e.g.
+    '1409.html') and all sub files from a page cache into the corpus.
+    """
+    source = page_cache.PageCache(cache_dir, offline=True)
+    urls = [u for u in source.index if '/archives/' in u]
+    if sites:
+        urls = [u for u in urls if u.rsplit('/', 1)[1] in sites or
+                                   not u.endswith('.html')]
+    if not any(u.endswith('.html') for u in urls):
+        raise RuntimeError('No season pages found in %s' % cache_dir)
+
+    if os.path.isdir(corpus_path(corpus, 'pages')):
+        shutil.rmtree(corpus_path(corpus, 'pages'))
+    frozen = page_cache.PageCache(corpus_path(corpus, 'pages'), offline=True,
+                                  max_size=None)
+    for url in urls:
+        content = source.get(url)
+        if content is not None:
+            frozen._store(url, {}, content)
+    frozen.save()
+    shutil.copy('player_names.txt', corpus_path(corpus, 'player_names.txt'))
+    return sorted(u for u in frozen.index if u.endswith('.html'))
+
+# Made-up season pages in the layouts found in the archive: (season key,
+# layout, number of divisions, players per division)
+GENERATED_PAGES = [('99_11', 'old', 3, 6),
+                   ('01_05', 'old', 4, 6),
+                   ('05-06', 'excel', 5, 7),
+                   ('0909', 'latin1', 4, 7),
+                   ('1312-1401', 'excel', 8, 8),
+                   ('14-0708', 'summer_groups', 2, 5),
+                   ('1409', 'excel', 6, 8),
+                   ('1410', 'frames', 6, 8),
+                   ('15-0708', 'summer', 3, 5),
+                   ('1504', 'frames', 5, 7),
+                   ('1602', 'excel', 6, 7)]
+RESULTS = ['3-0', '3-1', '3-2', '2-3', '1-3', '0-3', '3', '', '', '&nbsp;']
+ANNOTATIONS = [' (1st to finish)', ' - 2nd to finish', ' 3rd to finish', ' out',
+               ' -', ' unavailable', ' out for summer', ' home 76 71234', ' (4)', ' ?']
+
+def _invert(result):
+    if result == '3': return '0'
+    if '-' in result: return result[::-1]
+    return result
+
+def _division_rows(rng, rank, names, layout):
+    """Rows of one division: the header, and a row for each player"""
+    n = len(names)
+    results = [['X']*n for _ in names]
+    for i in range(n):
+        for j in range(i+1, n):
+            result = rng.choice(RESULTS)
+            if layout.startswith('summer') and rng.random() < 0.4:
+                result = ''
+            if layout == 'old' and result and result[0].isdigit() and rng.random() < 0.2:
+                result = result.replace('-', '-\r\n') # line break in the cell
+            results[i][j], results[j][i] = result, _invert(result)
+
+    header = 'Division %d' % rank
+    if layout == 'summer_groups':
+        header = 'Division %s' % 'ABCDEFGH'[rank-1]
+    if layout == 'old':
+        rows = ['<tr><td colspan=%d><font face=Arial size=3><b>%s</b></font></td></tr>'
+                % (n+3, header)]
+    else:
+        rows = ['<tr height=21><td colspan=%d class=xl25 height=21>%s</td></tr>' % (n+3, header)]
+    for i, name in enumerate(names):
+        if layout == 'old':
+            cells = ['<font size=2>%s</font>' % 'ABCDEFG'[i],
+                     '<font size=2><b>%s</b></font>' % name.upper()]
+        else:
+            cells = ['ABCDEFGH'[i], name]
+        cells.extend(results[i])
+        wins = sum(1 for r in results[i] if r[:1] == '3')
+        cells.append(str(wins)) # total column
+        rows.append('<tr>%s</tr>' % ''.join('<td class=xl%d>%s</td>' % (30+k%3, c)
+                                            for k, c in enumerate(cells)))
+    return rows
+
+def generate_page(rng, season, layout, n_divisions, n_players, names, extra=()):
+    """
+    Html of a made-up season page (and its sub files, for the frames
+    layout), as a dictionary of path -> content. The players are the
+    `extra` names and a random sample of `names`.
+    """
+    pool = list(extra) + rng.sample(names, n_divisions*n_players - len(extra))
+    rng.shuffle(pool)
+    rows = []
+    for d in range(n_divisions):
+        players = pool[d*n_players:(d+1)*n_players]
+        for i in rng.sample(range(len(players)), 2):
+            players[i] += rng.choice(ANNOTATIONS)
+        rows.extend(_division_rows(rng, d+1, players, layout))
+
+    title = 'CERN Squash Club - League %s' % season
+    if layout.startswith('summer'):
+        title = 'Summer League %s' % season
+    table = ('<table border=0 cellpadding=0 cellspacing=0 style="border-collapse:collapse">\n'
+             '<tr><td colspan=10 class=xl24>%s</td></tr>\n%s\n</table>' %
+             (title, '\n'.join(rows)))
+    charset = 'windows-1252' if layout in ('excel', 'latin1', 'frames') else 'iso-8859-1'
+    head = ('<html><head><meta http-equiv=Content-Type content="text/html; charset=%s">'
+            '<title>%s</title></head>' % (charset, title))
+    if layout == 'old':
+        # A title table first, and a table of the rules after the results
+        body = ('<body bgcolor=white><table><tr><td><font size=4><b>CERN SQUASH CLUB</b>'
+                '</font></td></tr><tr><td>%s</td></tr></table>\n%s\n'
+                '<table><tr><td>Rules</td></tr><tr><td>A</td><td>Play your matches '
+                'before the end of the month</td></tr></table></body></html>' % (title, table))
+    else:
+        body = '<body link=blue vlink=purple>\n%s\n</body></html>' % table
+    page = (head + body).encode(charset)
+
+    if layout != 'frames':
+        return {'%s.html' % season: page}
+    frameset = ('<html><head><meta name="Excel Workbook Frameset">'
+                '<link rel=File-List href="%(s)s_files/filelist.xml">'
+                '<link id="shLink" href="%(s)s_files/sheet001.htm"></head>'
+                '<frameset rows="*,39" border=0><frame src="%(s)s_files/sheet001.htm" '
+                'name="frSheet"><noframes><body><p>This page uses frames.</p></body>'
+                '</noframes></frameset></html>' % {'s': season})
+    return {'%s.html' % season: frameset, '%s_files/sheet001.htm' % season: page}
+
+def generate(corpus, seed=1):
+    """
+    Write a corpus of made-up season pages (`GENERATED_PAGES`) with the
+    players of player_names.txt, for when no crawl of the archive is at
+    hand. The pages have the layouts of the archive: old tables with
+    nested markup, a title table before the results and another table
+    after them, Excel exports with a total column, pages that only link
+    to a 'sheetNNN.htm' sub file, latin-1 names, summer leagues (one with
+    divisions that aren't numbered) and names with annotations like
+    '(1st to finish)'.
+    """
+    rng = random.Random(seed)
+    names = []
+    with open('player_names.txt', 'r') as ifile:
+        for line in ifile:
+            if not len(line.strip()): continue
+            name = line.split(',', 1)[1].strip()
+            if not name in names: names.append(name)
+    accented = [u'Jos\xe9 M\xfcller', u'Fran\xe7ois L\xe9vesque', u'\xc5sa Str\xf6m',
+                u'Zo\xeb Dupr\xe9', u'Nu\xf1o Pe\xf1a']
+
+    if os.path.isdir(corpus_path(corpus, 'pages')):
+        shutil.rmtree(corpus_path(corpus, 'pages'))
+    cache = page_cache.PageCache(corpus_path(corpus, 'pages'), offline=True,
+                                 max_size=None)
+    for season, layout, n_divisions, n_players in GENERATED_PAGES:
+        extra = accented if layout == 'latin1' else ()
+        for path, content in generate_page(rng, season, layout, n_divisions,
+                                           n_players, names, extra).iteritems():
+            cache._store(page_cache.SITEURL + 'archives/' + path, {}, content)
+    cache.save()
+    shutil.copy('player_names.txt', corpus_path(corpus, 'player_names.txt'))
+    return sorted(u for u in cache.index if u.endswith('.html'))
+
+class Quiet(object):
+    """Silence the prints of the crawler"""
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+    def __exit__(self, *args):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+
+def reset_names(corpus):
+    """Fresh name dictionary and name cache, so each repetition does the same"""
+    squash_crawl.ALIASES = AliasStore(corpus_path(corpus, 'player_names.txt'))
+    clean_name.cache.clear()
+
+def best_time(func, repeat):
+    """Shortest of `repeat` runs of func(), which returns its own time"""
+    return min(func() for _ in xrange(repeat))
+
+def run(corpus, repeat=5):
+    """
+    Time each stage over the corpus, and return the timings and the output
+    (parsed pages, squash data and ratings) to compare with the golden file.
+    """
+    squash_crawl.PAGE_CACHE = page_cache.PageCache(corpus_path(corpus, 'pages'),
+                                                   offline=True, max_size=None)
+    urls = sorted(u for u in squash_crawl.PAGE_CACHE.index if u.endswith('.html'))
+
+    # Load the pages, and note the texts of the name fields
+    pages, errors = {}, {}
+    raw_names = []
+    get_name = squash_crawl.get_name
+    def recording_get_name(text):
+        raw_names.append(text)
+        return get_name(text)
+    reset_names(corpus)
+    squash_crawl.get_name = recording_get_name
+    try:
+        with Quiet():
+            for url in urls:
+                try:
+                    pages[url] = squash_crawl.load_page(url)
+                    squash_crawl.parse_page(pages[url])
+                except (RuntimeError, AssertionError), e:
+                    errors[url] = '%s: %s' % (type(e).__name__, e)
+                    pages.pop(url, None)
+    finally:
+        squash_crawl.get_name = get_name
+
+    timings, page_timings = {}, {}
+    parsed = {}
+    with Quiet():
+        def parse_all():
+            reset_names(corpus)
+            total = 0
+            for url in sorted(pages):
+                start = time.time()
+                parsed[url] = squash_crawl.parse_page(pages[url])
+                seconds = time.time()-start
+                page_timings[url] = min(seconds, page_timings.get(url, seconds))
+                total += seconds
+            return total
+        timings['parse'] = best_time(parse_all, repeat)
+
+        def normalize_all():
+            reset_names(corpus)
+            start = time.time()
+            for text in raw_names:
+                squash_crawl.get_name(text)
+            return time.time()-start
+        timings['normalize'] = best_time(normalize_all, repeat)
+
+        squash_data = {}
+        def aggregate_all():
+            squash_data.clear()
+            squash_data.update({'players': {}, 'seasons': {}})
+            start = time.time()
+            for url in sorted(pages):
+                divisions, matches = parsed[url]
+                squash_crawl.add_season(squash_data, season_of(url), divisions, matches)
+            return time.time()-start
+        timings['aggregate'] = best_time(aggregate_all, repeat)
+
+        result = [None]
+        def elo_all():
+            # The matches in the order of the data read back from the file,
+            # as in calculate_elo.py
+            data = json.loads(json.dumps(squash_data, sort_keys=True))
+            start = time.time()
+            table = MatchTable.build(data)
+            result[0] = (table, run_elo(table))
+            return time.time()-start
+        timings['elo'] = best_time(elo_all, repeat)
+
+    table, elo = result[0]
+    output = {'pages': dict((url, serialize_page(*parsed[url])) for url in parsed),
+              'errors': errors,
+              'squash_data': squash_data,
+              'ratings': dict(zip(table.player_names.tolist(), elo.ratings.tolist()))}
+    return {'timings': timings, 'pages': page_timings, 'n_pages': len(pages),
+            'n_names': len(raw_names)}, output
+
+def serialize_page(divisions, matches):
+    """Output of parse_page in a json friendly format"""
+    return {'divisions': dict((str(r), names) for r, names in divisions.iteritems()),
+            'matches': sorted([n1, n2, r] for (n1, n2), r in matches.iteritems())}
+
+def check(output, golden, max_reported=10):
+    """List of differences between the output of a run and the golden output"""
+    output = json.loads(json.dumps(output)) # same types as the golden file
+    differences = []
+    for section in ['pages', 'errors', 'squash_data']:
+        keys = set(output[section]) | set(golden[section])
+        for key in sorted(keys):
+            if output[section].get(key) != golden[section].get(key):
+                differences.append('%s: %s differs' % (section, key))
+    for name in sorted(set(output['ratings']) | set(golden['ratings'])):
+        rating, expected = output['ratings'].get(name), golden['ratings'].get(name)
+        if rating is None or expected is None or abs(rating-expected) > 1e-9:
+            differences.append('ratings: %s is %s, expected %s' % (name, rating, expected))
+    if len(differences) > max_reported:
+        differences = (differences[:max_reported] +
+                       ['... and %d more' % (len(differences)-max_reported)])
+    return differences
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Print the timings next to a baseline, and return the names of the
+    benchmarks that are slower by more than `threshold` (a fraction).
+    """
+    regressions = []
+    print '%-10s | %9s | %9s | %7s |' % ('', 'baseline', 'now', 'ratio')
+    for name in BENCHMARKS:
+        before, now = baseline['timings'].get(name), results['timings'][name]
+        if not before:
+            print '%-10s | %9s | %8.4fs | %7s |' % (name, '-', now, '-')
+            continue
+        ratio = now/before
+        flag = ''
+        if ratio > 1.0+threshold:
+            regressions.append(name)
+            flag = ' slower'
+        print '%-10s | %8.4fs | %8.4fs | %6.2fx |%s' % (name, before, now, ratio, flag)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the crawler and elo calculation on a frozen corpus")
+    parser.add_argument('--corpus', help='Corpus directory', default=CORPUS)
+    parser.add_argument('--freeze', action="store_true",
+                        help='Create the corpus from the page cache, and its golden output')
+    parser.add_argument('--cache-dir', help='Page cache to freeze from',
+                        default=page_cache.CACHEDIR)
+    parser.add_argument('--generate', action="store_true",
+                        help='Create a corpus of made-up pages, and its golden output')
+    parser.add_argument('--pages', nargs='+', metavar='PAGE',
+                        help="Only freeze these season pages (e.g. '1409.html')")
+    parser.add_argument('--update-golden', action="store_true",
+                        help='Store the output of this run as the golden output')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='Repetitions of each benchmark (the fastest counts)')
+    parser.add_argument('--parser', help='Parser backend',
+                        choices=sorted(page_parsers.BACKENDS), default='bs4')
+    parser.add_argument('-o', '--output', help='Store the timings in a json file')
+    parser.add_argument('--compare', metavar='RESULTS',
+                        help='Compare with the timings of an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Slowdown counted as a regression (default: 0.1 = 10%%)')
+    args = parser.parse_args()
+
+    squash_crawl.PARSER = page_parsers.get_backend(args.parser)
+    golden_file = corpus_path(args.corpus, 'golden.json')
+    if args.freeze:
+        urls = freeze(args.cache_dir, args.corpus, args.pages)
+        print 'Froze %d season pages in %s' % (len(urls), args.corpus)
+        args.update_golden = True
+    elif args.generate:
+        urls = generate(args.corpus)
+        print 'Generated %d season pages in %s' % (len(urls), args.corpus)
+        args.update_golden = True
+
+    results, output = run(args.corpus, args.repeat)
+    results.update({'time': time.time(), 'python': platform.python_version(),
+                    'parser': args.parser, 'repeat': args.repeat})
+
+    status = 0
+    if args.update_golden:
+        with open(golden_file, 'w') as ofile:
+            json.dump(output, ofile, indent=1, sort_keys=True)
+        print 'Stored the golden output in %s' % golden_file
+    else:
+        with open(golden_file, 'r') as ifile:
+            differences = check(output, json.load(ifile))
+        results['golden_differences'] = differences
+        if differences:
+            print 'Output differs from %s:' % golden_file
+            for difference in differences:
+                print '  ' + difference
+            status = 1
+        else:
+            print 'Output of %d pages matches %s' % (results['n_pages'], golden_file)
+
+    print ('%d pages, %d player names, best of %d:' %
+               (results['n_pages'], results['n_names'], args.repeat))
+    for name in BENCHMARKS:
+        print '  %-10s %8.4fs' % (name, results['timings'][name])
+
+    if args.compare:
+        with open(args.compare, 'r') as ifile:
+            regressions = compare(results, json.load(ifile), args.threshold)
+        if regressions:
+            print 'Slower than the baseline: %s' % ', '.join(regressions)
+            status = 1
+
+    if args.output:
+        with open(args.output, 'w') as ofile:
+            json.dump(results, ofile, indent=2, sort_keys=True)
+    return status
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,17 +1,23 @@
 #! /usr/bin/env python
 import sys
-import json
+import hashlib
+import argparse
 
-from operator import itemgetter
+import numpy as np
 
-from squash_crawl import parse_result
-
-BASEELO = 1200
+from collections import namedtuple
 
-def expected_score(rating_diff):
-    return 1.0 / (1+10**(-1.0*rating_diff/400.))
+from squash_crawl import parse_result
+from match_table import sort_seasons
+from squash_model import SquashModel
+from squash_io import load_data
+from squash_db import SquashDB
+from rating_history import RatingHistory
+from rating_engines import (BASEELO, KFACTOR, ENGINES, EloEngine, expected_score,
+                            match_scores, run_engines, store_engine_ratings,
+                            print_comparison)
 
-def calculate_elo(elo1, elo2, result):
+def calculate_elo(elo1, elo2, result, K=KFACTOR):
     """
     Calculate the change in elo for two players
     `result` is a string that is accepted by `parse_result`,
@@ -22,8 +28,6 @@ def calculate_elo(elo1, elo2, result):
     score = parse_result(result)
     if not score: return elo1, elo2
 
-    K = 40.0
-
     # Scale the score to be within 1 (3-0 win) and 0 (0-3 loss)
     score /= 3.0 # now from 1 to -1
     score -= (score-1.0)/2.0
@@ -38,30 +42,165 @@ def calculate_elo(elo1, elo2, result):
     elo2_new = elo2 + K * ((1.0-score) - expected_score(elo2-elo1))
     return elo1_new, elo2_new
 
-def sort_seasons(sdata):
-    """Sort seasons by date"""
-    seasons = [(k, v['year'], v['month']) for k,v in sdata.iteritems()]
-    seasons.sort(key=itemgetter(1,2))
-    return seasons
+EloResult = namedtuple('EloResult', ['ratings', 'season_ratings', 'season_max',
+                                     'max_elo', 'max_player', 'max_season',
+                                     'match_ratings'])
 
+def run_elo(table, K=KFACTOR, scores=None, checkpoint=None, batch=False):
+    """
+    Calculate the elo ratings for all matches of a `MatchTable`, in order,
+    with the same arithmetic as `calculate_elo`, one season at a time with
+    the `EloEngine` of `run_engines`.
 
-def main():
+    With `batch`, the matches of each season are all rated against the
+    ratings at the start of the season instead, and the changes applied
+    together (`batch_elo_update`), so that the ratings don't depend on the
+    order of the matches. A player only plays in one division per season,
+    so this is the same as rating each division on its own.
+
+    If a `Checkpoint` is given, only the seasons from `checkpoint.season`
+    on are replayed, starting from the ratings stored for the season before.
+
+    Returns the final rating of each player id, the ratings of all players
+    at the end of each season (an array of seasons x players), the highest
+    rating so far at the end of each season, the overall highest rating
+    with the player id and season index where it occurred, and the ratings
+    of both players after each match (an array of matches x 2, NaN for
+    matches that don't count).
     """
-    Go through the squash data dictionary and add elo ratings for each
-    player.
+    result, = run_engines(table, [EloEngine(K, batch)], scores, [checkpoint])
+    return elo_result(table, result, checkpoint)
 
-    Adds a 'last_elo' field for the player data, corresponding to the current
-    rating and an 'elo' field to each season for that seasons rating.
+def elo_result(table, result, checkpoint=None):
+    """
+    The `EloResult` of the `EngineResult` of an `EloEngine`: the highest
+    rating so far is tracked through the ratings after each match of the
+    seasons that were replayed, and taken from the checkpoint before that.
+    """
+    season_max = []
+    max_elo, max_player, max_season = BASEELO, None, None
+    first_season = 0
+    if checkpoint is not None:
+        first_season = checkpoint.season
+        season_max = list(checkpoint.season_max[:first_season])
+        if season_max:
+            max_elo, max_player, max_season = season_max[-1]
 
-    Also prints the highest elo ranking and the player and season where it
-    occurred.
+    offsets = table.season_offsets.tolist()
+    player1, player2 = table.player1.tolist(), table.player2.tolist()
+    after1, after2 = result.match_ratings.T.tolist()
+    for sidx in xrange(first_season, table.n_seasons):
+        for i in xrange(offsets[sidx], offsets[sidx+1]):
+            if after1[i] > max_elo:
+                max_elo, max_player, max_season = after1[i], player1[i], sidx
+            if after2[i] > max_elo:
+                max_elo, max_player, max_season = after2[i], player2[i], sidx
+        season_max.append((max_elo, max_player, max_season))
 
-    Writes the new dictionary back to the original json file.
+    return EloResult(result.ratings, result.season_ratings,
+                     season_max, max_elo, max_player, max_season,
+                     result.match_ratings)
+
+CHECKPOINTS = 'elo_checkpoints.npz'
+Checkpoint = namedtuple('Checkpoint', ['season', 'season_ratings', 'season_max',
+                                       'match_ratings'])
+
+def season_hashes(table):
+    """Hash of the players and the list of matches of each season"""
+    names = [n.encode('utf-8') for n in table.player_names.tolist()]
+    player1, player2 = table.player1.tolist(), table.player2.tolist()
+    games1, games2 = table.games1.tolist(), table.games2.tolist()
+    offsets = table.season_offsets.tolist()
+    hashes = []
+    for sidx, season in enumerate(table.season_keys.tolist()):
+        shash = hashlib.sha1(season.encode('utf-8'))
+        for pid in table.season_players(sidx).tolist():
+            shash.update('%s\n' % names[pid])
+        for i in xrange(offsets[sidx], offsets[sidx+1]):
+            shash.update('%s|%s|%d|%d\n' % (names[player1[i]], names[player2[i]],
+                                             games1[i], games2[i]))
+        hashes.append(shash.hexdigest())
+    return hashes
+
+def players_seen(table):
+    """
+    Number of players that played up to each season. Player ids are given
+    in order of appearance, so these are the ids below that number.
     """
-    squash_data = None
-    with open('squash_data.json', 'r') as ifile:
-        squash_data = json.load(ifile)
+    n_seen, seen = [], 0
+    for sidx in xrange(table.n_seasons):
+        roster = table.season_players(sidx).tolist()
+        seen = max([seen] + [pid+1 for pid in roster])
+        n_seen.append(seen)
+    return n_seen
 
+def save_checkpoints(table, result, hashes, K, batch=False, filename=CHECKPOINTS):
+    """
+    Store the ratings at the end of each season, as a list of the ratings
+    of player ids 0..n-1 for the n players seen up to that season, and the
+    ratings after each match, of a run with the given K factor and mode.
+    """
+    n_seen = players_seen(table)
+    offsets, ratings = [0], []
+    for sidx, n in enumerate(n_seen):
+        ratings.extend(result.season_ratings[sidx].tolist()[:n])
+        offsets.append(len(ratings))
+    max_elo, max_player, max_season = zip(*result.season_max) or ([], [], [])
+    np.savez(filename,
+             season_keys=table.season_keys,
+             season_hashes=np.array(hashes, dtype=np.unicode_),
+             k_factor=np.array([K], dtype=np.float64),
+             batch=np.array([batch], dtype=np.bool_),
+             offsets=np.array(offsets, dtype=np.int32),
+             ratings=np.array(ratings, dtype=np.float64),
+             max_elo=np.array(max_elo, dtype=np.float64),
+             max_player=np.array([-1 if p is None else p for p in max_player], dtype=np.int32),
+             max_season=np.array([-1 if s is None else s for s in max_season], dtype=np.int32),
+             match_ratings=result.match_ratings)
+
+def load_checkpoint(table, hashes, K, batch=False, filename=CHECKPOINTS):
+    """
+    Find the first season that changed since the checkpoints were saved,
+    and return a `Checkpoint` to resume from there, or None if everything
+    has to be replayed.
+    """
+    try:
+        saved = np.load(filename)
+    except IOError:
+        return None
+    if saved['k_factor'][0] != K: return None
+    if not 'match_ratings' in saved.keys(): return None # older format
+    saved_batch = bool(saved['batch'][0]) if 'batch' in saved.keys() else False
+    if saved_batch != batch: return None
+
+    keys = table.season_keys.tolist()
+    saved_keys = saved['season_keys'].tolist()
+    saved_hashes = saved['season_hashes'].tolist()
+    first = 0
+    while (first < min(len(keys), len(saved_keys)) and
+           keys[first] == saved_keys[first] and hashes[first] == saved_hashes[first]):
+        first += 1
+    if first == 0: return None
+
+    offsets = saved['offsets'].tolist()
+    ratings = saved['ratings'].tolist()
+    season_ratings = [ratings[offsets[s]:offsets[s+1]] for s in xrange(first)]
+    season_max = zip(saved['max_elo'].tolist()[:first],
+                     [None if p < 0 else p for p in saved['max_player'].tolist()[:first]],
+                     [None if s < 0 else s for s in saved['max_season'].tolist()[:first]])
+    n_matches = table.season_offsets[first]
+    match_ratings = saved['match_ratings'][:n_matches].T.tolist()
+    return Checkpoint(first, season_ratings, season_max, match_ratings)
+
+def reference_elo(squash_data):
+    """
+    Add elo ratings to the squash data dictionary by going through the
+    seasons, players and matches one by one. This is the original
+    implementation, kept to cross-check `run_elo`.
+
+    Returns the highest elo rating, and the player and season where it
+    occurred.
+    """
     ## Set everybody's default elo to the base
     reset = True
     for name in squash_data['players'].keys():
@@ -108,12 +247,143 @@ def main():
 
                 counted_matches[(pname, pname2)] = None
 
+    return max_elo, max_name, max_season
+
+def store_ratings(model, table, result):
+    """
+    Store the output of `run_elo` in a `SquashModel`: the current rating
+    as `last_elo` of each player, and the rating at the end of each season
+    as `elo` of the player's seasons.
+    """
+    ratings = result.ratings.tolist()
+    for player in model.players:
+        if player is None: continue
+        player.last_elo = ratings[player.id] if player.id < table.n_players else BASEELO
+
+    for sidx, season in enumerate(model.seasons):
+        season_ratings = result.season_ratings[sidx].tolist()
+        for pid in season.players:
+            model.players[pid].seasons[season.key].elo = season_ratings[pid]
+
+def get_ratings(squash_data):
+    """Copy of the 'last_elo' and season 'elo' fields of all players"""
+    return dict((name, (pdata.get('last_elo'),
+                        dict((s, sd.get('elo')) for s,sd in pdata['seasons'].iteritems())))
+                for name, pdata in squash_data['players'].iteritems())
 
-    print max_elo, max_name, max_season
+def compare_ratings(squash_data, reference):
+    """Return the players with ratings different from `get_ratings` output"""
+    return sorted(name for name, ratings in get_ratings(squash_data).iteritems()
+                       if ratings != reference[name])
+
+def main():
+    """
+    Go through the squash data dictionary and add elo ratings for each
+    player.
+
+    Adds a 'last_elo' field for the player data, corresponding to the current
+    rating and an 'elo' field to each season for that seasons rating.
+
+    Also prints the highest elo ranking and the player and season where it
+    occurred.
+
+    Writes the new dictionary back to the original json file.
+    """
+    parser = argparse.ArgumentParser(
+        description="Calculate elo ratings for all players")
+    parser.add_argument('-k', '--k-factor', help='K factor of the elo updates',
+                        type=float, default=KFACTOR)
+    parser.add_argument('--check', action="store_true",
+                        help='Compare with the match by match reference implementation')
+    parser.add_argument('--batch', action="store_true",
+                        help=('Rate all matches of a season against the ratings at its start, '
+                              'independent of the order of the matches'))
+    parser.add_argument('--full', action="store_true",
+                        help="Replay all seasons, don't resume from the checkpoints")
+    parser.add_argument('--sqlite', nargs='?', const='squash_data.db', metavar='DBFILE',
+                        help='Also store the ratings in a SQLite database')
+    parser.add_argument('-e', '--engines', default='elo',
+                        help=('Comma separated rating engines to run (%s), '
+                              'the ratings of each are stored under their own keys'
+                              % ', '.join(sorted(ENGINES))))
+    parser.add_argument('--compare', action="store_true",
+                        help='Compare how well the ratings of the engines predict the matches')
+    parser.add_argument('--compact', action="store_true",
+                        help='Write the json file without indentation')
+    parser.add_argument('--gzip', action="store_true",
+                        help='Write the json file gzip-compressed')
+    args = parser.parse_args()
+    if args.check and args.batch:
+        parser.error('--check compares with the match by match ratings, not --batch')
+    names = args.engines.split(',')
+    for name in names:
+        if not name in ENGINES:
+            parser.error('Unknown engine %s' % name)
+
+    model = SquashModel.load('squash_data.json')
+
+    if args.check:
+        # The order of the matches, and hence the ratings, depend on the
+        # iteration order of the dictionaries, which are the same as the
+        # ones the model was built from
+        squash_data = load_data('squash_data.json')
+        reference_max = reference_elo(squash_data)
+        reference = get_ratings(squash_data)
+
+    table = model.match_table()
+    hashes = season_hashes(table)
+    checkpoint = None
+    if not (args.full or args.check):
+        checkpoint = load_checkpoint(table, hashes, args.k_factor, args.batch)
+    if checkpoint:
+        print ('Resuming from the checkpoint of season %s, replaying %d of %d seasons' %
+                  (table.season_keys[checkpoint.season-1],
+                   table.n_seasons-checkpoint.season, table.n_seasons))
+
+    # Elo and the other engines in one pass over the seasons, only Elo
+    # resumes from the checkpoint
+    engines = [EloEngine(args.k_factor, args.batch)]
+    engines.extend(ENGINES[name]() for name in names if name != 'elo')
+    scores = match_scores(table)
+    results = run_engines(table, engines, scores, [checkpoint] + [None]*(len(engines)-1))
+    result = elo_result(table, results[0], checkpoint)
+    store_ratings(model, table, result)
+    save_checkpoints(table, result, hashes, args.k_factor, args.batch)
+    RatingHistory.build(table, result, BASEELO).save()
+    for engine, engine_result in zip(engines, results)[1:]:
+        store_engine_ratings(model, table, engine, engine_result)
+    if args.compare:
+        print_comparison(table, [(engine.NAME, engine_result.win_probability)
+                                 for engine, engine_result in zip(engines, results)],
+                         scores[1])
+
+    max_name, max_season = None, None
+    if result.max_player is not None:
+        max_name = table.player_names[result.max_player]
+        max_season = table.season_keys[result.max_season]
+    print result.max_elo, max_name, max_season
+
+    if args.check:
+        different = compare_ratings(model.to_dict(), reference)
+        print 'Reference implementation:', ' '.join(map(str, reference_max))
+        print '%d players with different ratings' % len(different)
+        if different:
+            print ', '.join(different)
+            return 1
 
     ## Dump to json file
-    with open('squash_data.json', 'w') as ofile:
-        json.dump(squash_data, ofile, indent=2, sort_keys=True)
+    model.save('squash_data.json', compact=args.compact, compress=args.gzip)
+
+    if args.sqlite:
+        # Only the replayed seasons changed, unless the database is out of date
+        db = SquashDB(args.sqlite)
+        first_season = checkpoint.season if checkpoint else 0
+        outdated = set(db.season_keys()).symmetric_difference(table.season_keys.tolist())
+        if outdated:
+            db.store_seasons(model.to_dict(), outdated)
+            first_season = 0
+        db.store_ratings(table, result, first_season)
+        db.close()
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
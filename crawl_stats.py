@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+"""
+Timings and counters of a crawl, per URL and per stage, written as a
+json report by squash_crawl.py.
+"""
+import json
+import time
+import threading
+
+from contextlib import contextmanager
+
+# Stages of the crawl, in order
+STAGES = ['fetch', 'parse', 'extract', 'merge', 'write']
+
+class CrawlStats(object):
+    """
+    Collects the time spent in each stage for each URL, and other numbers
+    per URL (e.g. bytes), from any thread. The stage totals are summed
+    over all threads, so they can add up to more than the wall time.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.urls = {} # url -> {stage: seconds, or other counter: value}
+        self.stages = dict((s, 0.) for s in STAGES)
+        self._lock = threading.Lock()
+
+    def add(self, url, key, value):
+        """
+        Add `value` to a counter of a url. Stages of no particular url
+        (url None) only count for the totals.
+        """
+        with self._lock:
+            if key in self.stages:
+                self.stages[key] += value
+            if url is None: return
+            counters = self.urls.setdefault(url, {})
+            counters[key] = counters.get(key, 0) + value
+
+    def set(self, url, key, value):
+        if url is None: return
+        with self._lock:
+            self.urls.setdefault(url, {})[key] = value
+
+    @contextmanager
+    def timer(self, url, stage):
+        """Time the enclosed block as `stage` of a url"""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(url, stage, time.time()-start)
+
+    def report(self, **extra):
+        """Dictionary with the totals, each url, and any `extra` entries"""
+        with self._lock:
+            report = {'total_time': time.time()-self.start,
+                      'stages': dict(self.stages),
+                      'urls': dict((u, dict(c)) for u,c in self.urls.iteritems())}
+        report.update(extra)
+        return report
+
+    def summary(self):
+        """One line with the total time of each stage"""
+        return 'Time spent: ' + ', '.join('%s %.2fs' % (s, self.stages[s])
+                                          for s in STAGES)
+
+    def write(self, filename, **extra):
+        with open(filename, 'w') as ofile:
+            json.dump(self.report(**extra), ofile, indent=2, sort_keys=True)
@@ -0,0 +1,85 @@
+#! /usr/bin/env python
+import json
+import argparse
+
+from multiprocessing import Pool
+
+from calculate_elo import match_scores, run_elo, KFACTOR
+from rating_engines import season_win_probability, predictive_scores
+from match_table import MatchTable
+from squash_model import SquashModel
+
+# The match table is loaded once before the worker processes are started,
+# which then share it
+TABLE = None
+
+def load_table(filename):
+    """
+    The match table of a squash data file, built as in calculate_elo.py so
+    that the default setting gives the same ratings, or a table saved by
+    match_table.py (.npz)
+    """
+    if filename.endswith('.npz'):
+        return MatchTable.load(filename, lazy=False)
+    return SquashModel.load(filename).match_table()
+
+def evaluate(config):
+    """Log-loss and accuracy of the ratings for one (K, close_win) setting"""
+    K, close_win = config
+    scores = match_scores(TABLE, close_win=close_win)
+    result = run_elo(TABLE, K=K, scores=scores)
+    # Each match predicted with the ratings at the start of its season
+    probability = season_win_probability(TABLE, result.season_ratings)
+    log_loss, accuracy = predictive_scores(TABLE, probability, scores[1])
+    return K, close_win, log_loss, accuracy
+
+def parse_values(text):
+    """'20,30,40' -> [20., 30., 40.], 'default' -> None"""
+    return [None if v == 'default' else float(v) for v in text.split(',')]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Scan the elo K factor and score scaling by predictive log-loss")
+    parser.add_argument('-k', '--k-factors', help='Comma separated K factors to try',
+                        default='10,20,30,40,50,60,80')
+    parser.add_argument('-c', '--close-wins',
+                        help=("Comma separated scores of a 3-2 win to try, "
+                              "'default' for the one in calculate_elo"),
+                        default='default,0.6,0.75,0.9,1.0')
+    parser.add_argument('-i', '--input', default='squash_data.json',
+                        help='Squash data file, or match table (.npz)')
+    parser.add_argument('-j', '--jobs', help='Number of processes', type=int, default=None)
+    parser.add_argument('-o', '--output', help='Store the results in a json file')
+    args = parser.parse_args()
+
+    global TABLE
+    # Read all columns now, so the workers don't each read the file
+    TABLE = load_table(args.input)
+
+    configs = [(float(K), c) for K in args.k_factors.split(',')
+                      for c in parse_values(args.close_wins)]
+    pool = Pool(args.jobs)
+    results = pool.map(evaluate, configs)
+    pool.close()
+    pool.join()
+
+    results.sort(key=lambda r: r[2])
+    header = '    K   | 3-2 win | log-loss | accuracy |'
+    print header
+    print len(header)*'-'
+    for K, close_win, log_loss, accuracy in results:
+        baseline = K == KFACTOR and close_win is None
+        print '{b}{K:6.1f} | {cw:>7} | {ll:8.4f} | {acc:8.2%} |'.format(
+                b='*' if baseline else ' ', K=K,
+                cw='default' if close_win is None else '%.3f' % close_win,
+                ll=log_loss, acc=accuracy)
+    print len(header)*'-'
+    print '* the settings of calculate_elo.py'
+
+    if args.output:
+        with open(args.output, 'w') as ofile:
+            json.dump([dict(zip(['K', 'close_win', 'log_loss', 'accuracy'], r))
+                       for r in results], ofile, indent=2)
+
+if __name__ == '__main__':
+    main()
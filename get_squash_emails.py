@@ -1,54 +1,37 @@
 #! /usr/bin/env python
 import os
 import re
-import urllib2
-import unicodedata
+import sys
+import csv
+import json
+import hashlib
+import urlparse
 import argparse
-import pickle
 
 from bs4 import BeautifulSoup
 from collections import defaultdict
 
-_cachefiles = []
-def cachify(func):
-    """
-    Simple decorator to store the output of a function to cache, then read
-    the cache instead of calling the function again.
-    """
-    global _cachefiles
-    cachefile = '.'+func.__name__+'.cache'
-    _cachefiles.append(cachefile)
-
-    def cached_func(*args):
-        if not os.path.exists(cachefile):
-            value = func(*args)
-            with open(cachefile, 'w') as ofile:
-                pickle.dump(value, ofile, pickle.HIGHEST_PROTOCOL)
-            return value
-        else:
-            with open(cachefile, 'r') as ifile:
-                value = pickle.load(ifile)
-            return value
-
-    return cached_func
+import page_cache
+from squash_io import write_atomic
+from squash_names import clean_contact_name
+
+# Use cached pages as they are, unless asked to refresh them
+PAGE_CACHE = page_cache.PageCache(revalidate=False)
+
+# Parsed divisions and members list, reused while the pages don't change
+CLUBFILE = 'club_contacts.json'
 
 def get_name(text):
     """Clean the text of a player name field"""
-    text = text.strip().lower()
-    text = text.replace('\n', '')
-    text = text.replace('\r', '')
-    # Replace unicode characters by ascii ones
-    text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore')
-    # Remove '#','(',')', and numbers
-    text = re.sub(r'[\#\+0-9\)\(\.]','', text)
-    # Replace double spaces by single spaces
-    text = re.sub(r'\s{2,}',' ', text)
-
-    return text.strip().title()
+    return clean_contact_name(text)
 
 def reduce_name(name):
     return name.lower().replace(' ', '')
 
+def name_tokens(text):
+    """Lower case words of a name or of an e-mail address"""
+    return [t for t in re.split(r'[^a-z]+', text.lower()) if len(t) > 1]
+
 def get_division(text):
     """Extract the division rank from a string like 'Division 5'"""
     div_text = re.sub(r'[\n\r]+','', text)
@@ -59,19 +42,17 @@ def get_division(text):
     rank = int(rank_match.group(1))
     return rank
 
-@cachify
-def load_divisions(url="http://club-squash.web.cern.ch/club-squash/leagues.htm", verbose=False):
+def parse_divisions(html, verbose=False):
     """
-    Extract the players from the squash league table
-    First open the url, then parse the html using BeautifulSoup.
+    Extract the players from the html of the squash league table,
+    using BeautifulSoup.
 
     The code looks for a table that contains a row with 'Division' in it.
     Then looks for rows with players and results.
 
     Returns a dictionary the players for each division
     """
-    page_request = urllib2.urlopen(url)
-    soup = BeautifulSoup(page_request, 'html.parser')
+    soup = BeautifulSoup(html, 'html.parser')
 
     divisions = defaultdict(list) # div rank -> list of player names
 
@@ -110,12 +91,11 @@ def load_divisions(url="http://club-squash.web.cern.ch/club-squash/leagues.htm",
 
     return divisions
 
-@cachify
-def load_emails(url="http://club-squash.web.cern.ch/club-squash/club.html"):
-    page_request = urllib2.urlopen(url)
-    soup = BeautifulSoup(page_request, 'html.parser')
+def parse_contacts(html):
+    """List of (name, e-mail address) from the html of the members list"""
+    soup = BeautifulSoup(html, 'html.parser')
 
-    emails = {}
+    contacts = []
     email_item = soup.find('td', { 'class':'MainContainerCell'}).find_all('p')[1]
     for line in email_item.text.split('\n'):
         line = line.strip()
@@ -126,57 +106,156 @@ def load_emails(url="http://club-squash.web.cern.ch/club-squash/club.html"):
         user,host = re.match(r'([\.\-\w\d]*)AT([\.\-\w\d]*)', emailantispam.strip()).groups()
         email = '%s@%s' % (user.replace('DOT', '.'), host.replace('DOT', '.'))
 
-        emails[reduce_name(name)] = email
+        contacts.append((name.strip(), email))
 
-    return emails
+    return contacts
 
-def get_player_email(name, emails):
-    email = emails.get(reduce_name(name))
-    if not email:
-        firstname, lastname = (x.lower() for x in name.strip().rsplit(' ', 1))
-        matching_keys = [k for k in emails.keys() if lastname in k or firstname in k]
-        if len(matching_keys) == 1:
-            return emails[matching_keys[0]]
-
-        elif len(matching_keys) > 1:
-            less_matching_keys = [k for k in matching_keys if lastname in emails[k]]
-            if len(less_matching_keys) == 1:
-                return emails[less_matching_keys[0]]
-
-            else:
-                return "multiple entries: %s" % ' '.join([emails[n] for n in matching_keys])
-
-    return email if email else 'not found'
+def load_club(site=page_cache.SITEURL, filename=CLUBFILE):
+    """
+    Divisions of the league table and (name, e-mail) of the members list.
+    The parsed pages are kept in `filename`, and only parsed again when
+    the content of either page changed.
+    """
+    pages = [PAGE_CACHE.fetch(urlparse.urljoin(site, page))
+             for page in ('leagues.htm', 'club.html')]
+    source_hash = hashlib.sha1('\0'.join(pages)).hexdigest()
+    if os.path.exists(filename):
+        with open(filename, 'r') as ifile:
+            club = json.load(ifile)
+        if club.get('source_hash') == source_hash:
+            divisions = dict((int(r), ps) for r, ps in club['divisions'].iteritems())
+            return divisions, [tuple(c) for c in club['contacts']]
+
+    divisions, contacts = parse_divisions(pages[0]), parse_contacts(pages[1])
+    write_atomic(filename, json.dumps({'source_hash': source_hash,
+                                       'divisions': divisions,
+                                       'contacts': contacts}))
+    return divisions, contacts
+
+class EmailIndex(object):
+    """
+    E-mail addresses of the club members, by reduced name, and by the
+    tokens of the names and addresses (first, middle and last names)
+    for names that don't match exactly.
+    """
+    def __init__(self, contacts):
+        self.emails = {} # reduced name -> e-mail
+        self.tokens = defaultdict(set) # token -> e-mails
+        self.email_tokens = defaultdict(set) # e-mail -> tokens
+        for name, email in contacts:
+            self.emails[reduce_name(name)] = email
+            for token in name_tokens(name) + name_tokens(email.split('@')[0]):
+                self.tokens[token].add(email)
+                self.email_tokens[email].add(token)
+
+    def candidates(self, name, n=5):
+        """
+        Up to `n` (e-mail, score) of the members sharing tokens with a
+        name, best first. The last name scores 2, the other names 1.
+        """
+        tokens = name_tokens(name)
+        scores = defaultdict(int)
+        for i, token in enumerate(tokens):
+            weight = 2 if i == len(tokens)-1 else 1
+            for email in self.tokens.get(token, ()):
+                scores[email] += weight
+        return sorted(scores.iteritems(), key=lambda (e, s): (-s, e))[:n]
+
+    def lookup(self, name, n=5):
+        """
+        E-mail of a name, or None, and the ranked candidates. Without an
+        exact match, the best candidate is taken if it has the last name
+        and no other candidate scores as high.
+        """
+        email = self.emails.get(reduce_name(name))
+        if email: return email, []
+        candidates = self.candidates(name, n)
+        tokens = name_tokens(name)
+        if (candidates and tokens[-1] in self.email_tokens[candidates[0][0]] and
+            (len(candidates) == 1 or candidates[1][1] < candidates[0][1])):
+            return candidates[0][0], candidates
+        return None, candidates
+
+def format_email(email, candidates):
+    if email: return email
+    if candidates:
+        return 'candidates: %s' % ', '.join('%s (%d)' % c for c in candidates)
+    return 'not found'
+
+def export(divisions, index, n_candidates=5):
+    """
+    Rows of (division, name, e-mail or None, ranked candidates) for all
+    players of the given divisions
+    """
+    rows = []
+    for rank, names in sorted(divisions.iteritems()):
+        for name in names:
+            email, candidates = index.lookup(name, n_candidates)
+            rows.append((rank, name, email, candidates))
+    return rows
+
+def write_csv(rows, ofile):
+    writer = csv.writer(ofile)
+    writer.writerow(['division', 'name', 'email', 'candidates'])
+    for rank, name, email, candidates in rows:
+        writer.writerow([rank, name, email or '',
+                         ' '.join('%s:%d' % c for c in candidates)])
+
+def write_json(rows, ofile):
+    mapping = {} # division -> name -> e-mail and candidates
+    for rank, name, email, candidates in rows:
+        mapping.setdefault(str(rank), {})[name] = {
+            'email': email,
+            'candidates': [{'email': e, 'score': s} for e, s in candidates]}
+    json.dump(mapping, ofile, indent=2, sort_keys=True)
 
 def main():
     parser = argparse.ArgumentParser(
-        description="Crawl the CERN squash club archives and get match data")
+        description="Get the e-mail addresses of the players in the league divisions")
     parser.add_argument('-v', '--verbose', help='Verbose mode', action="store_true")
-    parser.add_argument('-r', '--refresh', help='Reload caches', action="store_true")
-    parser.add_argument('division', help='Division', type=int)
+    parser.add_argument('-r', '--refresh', help='Revalidate cached pages', action="store_true")
+    parser.add_argument('--url', default=page_cache.SITEURL,
+                        help='Root of the club web site, or of a mirror of it')
+    parser.add_argument('division', help='Divisions (default: all)', type=int, nargs='*')
+    parser.add_argument('-f', '--format', choices=['text', 'csv', 'json'], default='text')
+    parser.add_argument('-o', '--output', help='Write to this file instead of stdout')
+    parser.add_argument('-n', '--candidates', type=int, default=5,
+                        help='Number of candidates for names without a unique match')
     args = parser.parse_args()
 
-    divisions = load_divisions()
-    emails = load_emails()
-
-    if args.refresh:
-        print '...removing cachefiles:',
-        for cfile in _cachefiles:
-            print cfile,
-            os.remove(cfile)
-        print ''
-
-    if not args.division in divisions.keys():
-        print "Division %d not found" % args.division
-        return -1
-
-    for name in divisions[args.division]:
-        email = get_player_email(name, emails)
-        print '%-40s : %s' % (name, email)
+    PAGE_CACHE.revalidate = args.refresh
+    site = args.url if args.url.endswith('/') else args.url + '/'
+    divisions, contacts = load_club(site)
+    PAGE_CACHE.save()
+
+    for division in args.division:
+        if not division in divisions.keys():
+            print "Division %d not found" % division
+            return -1
+    if args.division:
+        divisions = dict((d, divisions[d]) for d in args.division)
+    if args.verbose:
+        for divrank,names in sorted(divisions.iteritems()):
+            print '----- Division %d: %s' % (divrank, ', '.join(names))
+
+    rows = export(divisions, EmailIndex(contacts), args.candidates)
+    ofile = open(args.output, 'wb') if args.output else sys.stdout
+    if args.format == 'csv':
+        write_csv(rows, ofile)
+    elif args.format == 'json':
+        write_json(rows, ofile)
+    else:
+        last_rank = None
+        for rank, name, email, candidates in rows:
+            if len(divisions) > 1 and rank != last_rank:
+                print >>ofile, '----- Division %d' % rank
+                last_rank = rank
+            print >>ofile, '%-40s : %s' % (name, format_email(email, candidates))
+    if args.output:
+        ofile.close()
 
     return 0
 
 
 if __name__ == '__main__':
-    main()
-
+    sys.exit(main())
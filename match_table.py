@@ -0,0 +1,160 @@
+#! /usr/bin/env python
+import argparse
+
+import numpy as np
+
+from squash_io import sort_seasons, parse_games, format_games, load_data
+
+TABLEFILE = 'squash_matches.npz'
+
+COLUMNS = ['season', 'date', 'division', 'player1', 'player2', 'games1', 'games2']
+
+class ArrayStore(object):
+    """
+    Named numpy arrays, accessed as attributes and stored in an npz file.
+    """
+    FILENAME = None
+
+    def __init__(self, arrays):
+        self._arrays = arrays
+
+    def __getattr__(self, name):
+        if name.startswith('_'): raise AttributeError(name)
+        try:
+            value = self._arrays[name]
+        except KeyError:
+            raise AttributeError(name)
+        setattr(self, name, value) # only read it once
+        return value
+
+    def save(self, filename=None):
+        """Store all arrays in an (uncompressed) numpy .npz file"""
+        np.savez(filename or self.FILENAME,
+                 **dict((k, getattr(self, k)) for k in self._arrays.keys()))
+
+    @classmethod
+    def load(cls, filename=None, lazy=True):
+        """
+        Load arrays written by `save`. They are read from the file as they
+        are accessed, or all at once if not `lazy`.
+        """
+        arrays = np.load(filename or cls.FILENAME)
+        if not lazy:
+            arrays = dict((k, arrays[k]) for k in arrays.keys())
+        return cls(arrays)
+
+class MatchTable(ArrayStore):
+    """
+    Flat table of all played matches, with one row per match (not per
+    player), stored as numpy arrays:
+     - season: index in `season_keys`, which are sorted by date
+     - date: year*100 + month of the season
+     - division: division rank
+     - player1, player2: index in `player_names`
+     - games1, games2: games won by each player, -1 if not known
+       (for results given as '3' or '0')
+
+    Matches are ordered by season, and within a season in the order of
+    the players and their matches in the data dictionaries. That order
+    depends on how the dictionaries were built, so the table is built from
+    the data as read back from the json file (`from_file`), which gives
+    the same table as calculate_elo.py uses. The players of each season are
+    in `roster_players[roster_offsets[s]:roster_offsets[s+1]]`, and the
+    matches in `season_offsets[s]:season_offsets[s+1]`.
+    """
+    FILENAME = TABLEFILE
+
+    def __len__(self):
+        return len(self.player1)
+
+    @property
+    def n_players(self):
+        return len(self.player_names)
+
+    @property
+    def n_seasons(self):
+        return len(self.season_keys)
+
+    def season_slice(self, sidx):
+        return slice(self.season_offsets[sidx], self.season_offsets[sidx+1])
+
+    def season_players(self, sidx):
+        return self.roster_players[self.roster_offsets[sidx]:self.roster_offsets[sidx+1]]
+
+    def result(self, idx):
+        """Result string of a match, from the point of view of player1"""
+        return format_games(self.games1[idx], self.games2[idx])
+
+    @classmethod
+    def from_file(cls, filename='squash_data.json'):
+        """Build the table from a squash data file"""
+        return cls.build(load_data(filename))
+
+    @classmethod
+    def build(cls, squash_data, seasons=None):
+        """
+        Build the table from the squash data dictionary. `seasons` are the
+        season keys sorted by date (by default from `sort_seasons`).
+        """
+        if seasons is None:
+            seasons = [s for s,_,_ in sort_seasons(squash_data['seasons'])]
+
+        player_ids = {}
+        def player_id(name):
+            return player_ids.setdefault(name, len(player_ids))
+
+        columns = dict((c, []) for c in COLUMNS)
+        roster_offsets, roster_players, season_offsets = [0], [], [0]
+        for sidx, season in enumerate(seasons):
+            sdata = squash_data['seasons'][season]
+            date = 100*sdata['year'] + sdata['month']
+            counted_matches = set()
+            for pname in sdata['players']:
+                roster_players.append(player_id(pname))
+                pdata = squash_data['players'][pname]['seasons'][season]
+                for pname2, result in pdata['matches'].iteritems():
+                    # Avoid double counting
+                    if ((pname, pname2) in counted_matches or
+                        (pname2, pname) in counted_matches): continue
+                    counted_matches.add((pname, pname2))
+                    games1, games2 = parse_games(result)
+                    columns['season'].append(sidx)
+                    columns['date'].append(date)
+                    columns['division'].append(pdata['division'])
+                    columns['player1'].append(player_id(pname))
+                    columns['player2'].append(player_id(pname2))
+                    columns['games1'].append(games1)
+                    columns['games2'].append(games2)
+            roster_offsets.append(len(roster_players))
+            season_offsets.append(len(columns['season']))
+
+        names = sorted(player_ids, key=player_ids.get)
+        dtypes = {'season': np.int16, 'date': np.int32, 'division': np.int8,
+                  'player1': np.int32, 'player2': np.int32,
+                  'games1': np.int8, 'games2': np.int8}
+        arrays = dict((c, np.array(columns[c], dtype=dtypes[c])) for c in COLUMNS)
+        arrays['player_names'] = np.array(names, dtype=np.unicode_)
+        arrays['season_keys'] = np.array(seasons, dtype=np.unicode_)
+        arrays['season_year'] = np.array([squash_data['seasons'][s]['year']
+                                          for s in seasons], dtype=np.int16)
+        arrays['season_month'] = np.array([squash_data['seasons'][s]['month']
+                                           for s in seasons], dtype=np.int8)
+        arrays['season_offsets'] = np.array(season_offsets, dtype=np.int32)
+        arrays['roster_offsets'] = np.array(roster_offsets, dtype=np.int32)
+        arrays['roster_players'] = np.array(roster_players, dtype=np.int32)
+        return cls(arrays)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert the squash data to a columnar match table")
+    parser.add_argument('-i', '--input', help='Input json file', default='squash_data.json')
+    parser.add_argument('-o', '--output', help='Output npz file', default=TABLEFILE)
+    args = parser.parse_args()
+
+    table = MatchTable.from_file(args.input)
+    table.save(args.output)
+    print ('Stored %d matches of %d players in %d seasons in %s' %
+              (len(table), table.n_players, table.n_seasons, args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+#! /usr/bin/env python
+import os
+import json
+import time
+import hashlib
+import threading
+import urllib2
+import urlparse
+
+from squash_io import write_atomic
+
+CACHEDIR = '.page_cache'
+
+# Root of the squash club web site
+SITEURL = 'http://club-squash.web.cern.ch/club-squash/'
+
+class CacheMiss(RuntimeError):
+    """Raised in offline mode for pages that are not in the cache"""
+    pass
+
+def urlopen(request, timeout=30):
+    """Default opener: return the response headers and the page content"""
+    response = urllib2.urlopen(request, timeout=timeout)
+    return response.info(), response.read()
+
+class PageCache(object):
+    """
+    Content-addressed on-disk store of downloaded pages, keyed by URL.
+
+    Page contents are stored under `objects/` named by their sha1 hash,
+    and an index maps each URL to the hash, the ETag and Last-Modified
+    headers of the response, and the times it was fetched and used.
+
+    Cached pages are revalidated with conditional requests, unless
+    `revalidate` is False (use cached pages as they are, only download
+    missing ones) or `offline` is True (never go to the network).
+    Local (file://) pages are always read directly, and not cached.
+
+    When saving, entries older than `max_age` seconds are dropped, then
+    the least recently used ones until the total is below `max_size` bytes.
+    """
+    def __init__(self, cachedir=CACHEDIR, offline=False, revalidate=True,
+                 max_size=200*1024*1024, max_age=None):
+        self.cachedir = cachedir
+        self.offline = offline
+        self.revalidate = revalidate
+        self.max_size = max_size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.downloaded = {} # url -> bytes, of the pages downloaded by `fetch`
+        self._lock = threading.Lock()
+        self.index = {}
+        try:
+            with open(self._index_file(), 'r') as ifile:
+                self.index = json.load(ifile)
+        except (IOError, ValueError):
+            pass
+
+    def _index_file(self):
+        return os.path.join(self.cachedir, 'index.json')
+
+    def _object_file(self, sha1):
+        return os.path.join(self.cachedir, 'objects', sha1[:2], sha1)
+
+    def _read(self, entry):
+        with open(self._object_file(entry['sha1']), 'rb') as ifile:
+            content = ifile.read()
+        with self._lock:
+            entry['accessed'] = time.time()
+            self.hits += 1
+        return content
+
+    def _store(self, url, headers, content):
+        sha1 = hashlib.sha1(content).hexdigest()
+        filename = self._object_file(sha1)
+        if not os.path.exists(filename):
+            if not os.path.isdir(os.path.dirname(filename)):
+                try:
+                    os.makedirs(os.path.dirname(filename))
+                except OSError: # created by another thread in the meantime
+                    pass
+            write_atomic(filename, content)
+        now = time.time()
+        with self._lock:
+            self.index[url] = {'sha1': sha1,
+                               'size': len(content),
+                               'etag': headers.get('ETag'),
+                               'last_modified': headers.get('Last-Modified'),
+                               'fetched': now,
+                               'accessed': now}
+            self.misses += 1
+            self.downloaded[url] = len(content)
+
+    def get(self, url):
+        """Return the cached content for a url, or None"""
+        entry = self.index.get(url)
+        if not entry: return None
+        try:
+            return self._read(entry)
+        except IOError:
+            return None
+
+    def fetch(self, url, opener=urlopen):
+        """
+        Return the content of a page, either from the cache or by
+        downloading it with `opener`, which takes a urllib2.Request and
+        returns the response headers and content.
+        """
+        return self.fetch_status(url, opener)[0]
+
+    def fetch_status(self, url, opener=urlopen):
+        """
+        Same as `fetch`, but return the content and whether it came from
+        the cache (None for local pages, which are not cached)
+        """
+        if urlparse.urlparse(url).scheme == 'file':
+            return opener(urllib2.Request(url))[1], None
+
+        entry = self.index.get(url)
+        if entry and not os.path.exists(self._object_file(entry['sha1'])):
+            entry = None
+        if self.offline or (entry and not self.revalidate):
+            if entry: return self._read(entry), True
+            if self.offline:
+                raise CacheMiss('Page not in cache (offline mode): %s' % url)
+
+        request = urllib2.Request(url)
+        if entry and entry.get('etag'):
+            request.add_header('If-None-Match', entry['etag'])
+        if entry and entry.get('last_modified'):
+            request.add_header('If-Modified-Since', entry['last_modified'])
+        try:
+            headers, content = opener(request)
+        except urllib2.HTTPError, e:
+            if e.code == 304 and entry:
+                return self._read(entry), True
+            raise
+
+        self._store(url, headers, content)
+        return content, False
+
+    def evict(self):
+        """Drop old and least recently used entries, and unused objects"""
+        with self._lock:
+            if self.max_age is not None:
+                oldest = time.time() - self.max_age
+                self.index = {u:e for u,e in self.index.iteritems()
+                                        if e['fetched'] >= oldest}
+            if self.max_size is not None:
+                total = sum(e['size'] for e in self.index.itervalues())
+                by_access = sorted(self.index.iteritems(),
+                                   key=lambda x: x[1]['accessed'])
+                for url, entry in by_access:
+                    if total <= self.max_size: break
+                    total -= entry['size']
+                    del self.index[url]
+
+            in_use = set(e['sha1'] for e in self.index.itervalues())
+            objdir = os.path.join(self.cachedir, 'objects')
+            for dirpath, _, filenames in os.walk(objdir):
+                for filename in filenames:
+                    if not filename in in_use:
+                        os.remove(os.path.join(dirpath, filename))
+
+    def save(self):
+        """Apply the eviction limits and write the index back to disk"""
+        if not os.path.isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        self.evict()
+        with self._lock:
+            write_atomic(self._index_file(), json.dumps(self.index, indent=1))
@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+"""
+Parser backends for the squash archive pages.
+
+A backend turns the html of a page into its tables, each table being a
+sequence of rows. A row is a tuple of three lists:
+ - the text of each direct <td> child, if it consists of a single string
+   (as `Tag.string` in BeautifulSoup), or None otherwise,
+ - the full text of each direct <td> child,
+ - the full text of every <td> in the row, including nested ones.
+
+Tables are yielded in document order (nested tables included), and so
+are the rows of each table.
+"""
+import sys
+import argparse
+
+from bs4 import BeautifulSoup, UnicodeDammit
+
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+class Bs4Backend(object):
+    """Reference backend using BeautifulSoup and the python html.parser"""
+    name = 'bs4'
+
+    def tables(self, html):
+        soup = BeautifulSoup(html, 'html.parser')
+        for table in soup.find_all('table'):
+            yield self._rows(table)
+
+    def _rows(self, table):
+        for row in table.find_all('tr'):
+            cells = row.find_all('td', recursive=False)
+            yield ([td.string for td in cells],
+                   [td.get_text() for td in cells],
+                   [td.get_text() for td in row.find_all('td')])
+
+class LxmlBackend(object):
+    """Fast backend using the libxml2 html parser through lxml"""
+    name = 'lxml'
+
+    def __init__(self):
+        if lxml is None:
+            raise RuntimeError('The lxml parser backend needs the lxml package')
+
+    def tables(self, html):
+        markup = UnicodeDammit(html, is_html=True).unicode_markup
+        doc = lxml.html.document_fromstring(markup)
+        for table in doc.iter('table'):
+            yield self._rows(table)
+
+    def _rows(self, table):
+        for row in table.iter('tr'):
+            cells = row.findall('td')
+            yield ([self._string(td) for td in cells],
+                   [self._text(td) for td in cells],
+                   [self._text(td) for td in row.iter('td')])
+
+    def _string(self, element):
+        """Same as `Tag.string`: the only string inside an element, if any"""
+        children = list(element)
+        if not children:
+            return unicode(element.text) if element.text else None
+        if len(children) > 1 or element.text or children[0].tail:
+            return None
+        if children[0].tag is lxml.etree.Comment:
+            return unicode(children[0].text)
+        return self._string(children[0])
+
+    def _text(self, element):
+        return unicode(element.xpath('string()'))
+
+BACKENDS = {'bs4': Bs4Backend, 'lxml': LxmlBackend}
+
+def get_backend(name):
+    if not name in BACKENDS:
+        raise ValueError('Unknown parser backend %s' % name)
+    return BACKENDS[name]()
+
+def compare_backends(pages, backends=('bs4', 'lxml')):
+    """
+    Parse each page with all backends, and return the list of pages
+    for which the (divisions, matches) differ from the first backend.
+    """
+    import squash_crawl # not at module level, squash_crawl imports this
+    default_parser = squash_crawl.PARSER
+    mismatches = []
+    for page in pages:
+        outputs = []
+        for name in backends:
+            squash_crawl.PARSER = get_backend(name)
+            try:
+                outputs.append(squash_crawl.parse_page(page.html))
+            except (RuntimeError, AssertionError), e:
+                outputs.append(repr(e))
+        if any(out != outputs[0] for out in outputs[1:]):
+            mismatches.append(page.name)
+    squash_crawl.PARSER = default_parser
+    return mismatches
+
+class Page(object):
+    def __init__(self, name, html):
+        self.name = name
+        self.html = html
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that the parser backends give the same output")
+    parser.add_argument('pages', nargs='*',
+                        help='Saved html pages (default: all pages in the page cache)')
+    args = parser.parse_args()
+
+    if args.pages:
+        pages = [Page(f, open(f, 'rb').read()) for f in args.pages]
+    else:
+        import page_cache
+        cache = page_cache.PageCache(offline=True)
+        pages = [Page(url, cache.get(url)) for url in sorted(cache.index)]
+        pages = [p for p in pages if p.html and '<table' in p.html.lower()]
+
+    mismatches = compare_backends(pages)
+    print 40*'='
+    print 'Compared %d pages: %d differences' % (len(pages), len(mismatches))
+    for name in mismatches:
+        print '  %s' % name
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
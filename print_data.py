@@ -1,40 +1,71 @@
 #! /usr/bin/env python
 import sys
+import csv
 import json
+import argparse
 
-def print_player(data, mute=False):
-    message = '{name:<30} | {elo:6.1f} | {tot:4} | {wins:4} | {rate:7.2%} | {seasons:7} |'
-    if not mute:
-        print message.format(
-                     name=name,
-                     tot=data['n_total_matches'],
-                     wins=data['n_total_wins'],
-                     rate=float(data['n_total_wins'])/data['n_total_matches'],
-                     elo=data.get('last_elo', 1000),
-                     seasons=data['n_seasons_played'])
-
-    return float(data['n_total_wins'])/data['n_total_matches'], data.get('last_elo', 1000)
-
-squash_data = None
-with open('squash_data.json', 'r') as ifile:
-    squash_data = json.load(ifile)
-
-winrates = []
-
-# Minimum number of played matches
-try:
-    CUTOFF = int(sys.argv[1])
-except IndexError:
-    CUTOFF = 50
-
-for name, data in squash_data['players'].iteritems():
-    if data['n_total_matches'] < CUTOFF: continue
-    winrates.append((name,print_player(data, mute=True)))
-
-header = "Player name                    | Elo    | Tot  | Win  | Winrate | Seasons |"
-print header
-print len(header)*"-"
-for name,(winrate, elo) in sorted(winrates, key=lambda x: x[1][1], reverse=True):
-    # if not name in squash_data['seasons']['1609']['players']: continue
-    print_player(squash_data['players'][name], mute=False)
-print len(header)*"-"
+from squash_queries import PlayerSummaries, Standing, RANKINGS
+from rating_engines import ENGINES
+
+def print_player(standing):
+    message = '{name:<30} | {elo:6.1f} | {tot:4} | {wins:4} | {rate:7.2%} | {games:+5} | {seasons:7} |'
+    print message.format(
+                 name=standing.name,
+                 tot=standing.played,
+                 wins=standing.won,
+                 rate=standing.winrate,
+                 games=standing.games_diff,
+                 elo=standing.elo if standing.elo is not None else 1000,
+                 seasons=standing.seasons)
+
+def main():
+    parser = argparse.ArgumentParser(description="Print a leaderboard of all players")
+    parser.add_argument('cutoff', nargs='?', type=int, default=50,
+                        help='Minimum number of played matches')
+    parser.add_argument('-s', '--sort', choices=sorted(RANKINGS), default='elo',
+                        help='Rank the players by this')
+    parser.add_argument('-n', type=int, default=None, help='Number of players to print')
+    parser.add_argument('-e', '--engine', choices=sorted(ENGINES), default='elo',
+                        help='Ratings of this rating engine (-s elo ranks by them)')
+    parser.add_argument('--first', help='First season to count (e.g. 1409)')
+    parser.add_argument('--last', help='Last season to count')
+    parser.add_argument('-d', '--division', type=int, help='Only count matches in this division')
+    parser.add_argument('-a', '--active', help='Only players who played in this season')
+    parser.add_argument('-f', '--format', choices=['table', 'csv', 'json'], default='table')
+    parser.add_argument('-i', '--input', help='Input json file', default='squash_data.json')
+    args = parser.parse_args()
+
+    summaries = PlayerSummaries.load(args.input)
+    try:
+        standings = summaries.leaderboard(args.sort, args.n,
+                                          first=args.first, last=args.last,
+                                          division=args.division, active=args.active,
+                                          min_matches=args.cutoff, engine=args.engine)
+    except KeyError, e:
+        print e.args[0]
+        return -1
+
+    if args.format == 'csv':
+        writer = csv.writer(sys.stdout)
+        writer.writerow(Standing._fields)
+        for standing in standings:
+            writer.writerow([v.encode('utf-8') if isinstance(v, unicode) else v
+                             for v in standing])
+        return 0
+
+    if args.format == 'json':
+        json.dump([standing._asdict() for standing in standings], sys.stdout, indent=2)
+        print
+        return 0
+
+    header = "Player name                    | %-6s | Tot  | Win  | Winrate | Games | Seasons |" % (
+                 'Elo' if args.engine == 'elo' else 'Rating')
+    print header
+    print len(header)*"-"
+    for standing in standings:
+        print_player(standing)
+    print len(header)*"-"
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+import sys
+import argparse
+
+from squash_names import AliasStore
+from squash_queries import H2HIndex, Record
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the matches between two players, or all opponents of one")
+    parser.add_argument('players', nargs='+', help='One or two player names')
+    parser.add_argument('-s', '--sort', choices=Record._fields, default='played',
+                        help='Sort the opponents by this field')
+    parser.add_argument('-n', type=int, default=None, help='Number of opponents to print')
+    args = parser.parse_args()
+    if len(args.players) > 2:
+        parser.error('Give at most two player names')
+
+    aliases = AliasStore()
+    names = [aliases.lookup(unicode(n, 'utf-8')) for n in args.players]
+    index = H2HIndex.load()
+    for name in names:
+        if not name in index:
+            print 'Player %s not found' % name
+            return -1
+
+    if len(names) == 2:
+        name1, name2 = names
+        record = index.record(name1, name2)
+        print ('{0} vs. {1}: {r.played} matches, {r.won}-{r.lost} '
+               '(games {r.games_won}-{r.games_lost})'.format(name1, name2, r=record))
+        for season, result in index.head_to_head(name1, name2):
+            print '  %-12s %s' % (season, result)
+        return 0
+
+    name = names[0]
+    header = 'Opponent                       | GP  | Won | Lost | Games   |'
+    print name
+    print header
+    print len(header)*'-'
+    for opponent, r in index.most(name, args.sort, args.n):
+        print '%-30s | %3d | %3d | %4d | %3d-%-3d |' % (opponent, r.played, r.won, r.lost,
+                                                        r.games_won, r.games_lost)
+    print len(header)*'-'
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,35 @@
 #! /usr/bin/env python
 import sys
-import json
+import argparse
 
-from calculate_elo import sort_seasons
-from squash_crawl import get_name
+from squash_model import SquashModel
+from squash_names import AliasStore
+from rating_engines import ENGINES
 
-name = get_name(unicode(sys.argv[1]))
+parser = argparse.ArgumentParser(description="Print the results of a player in each season")
+parser.add_argument('name', help='Player name')
+parser.add_argument('-e', '--engine', choices=sorted(ENGINES), default='elo',
+                    help='Ratings of this rating engine')
+args = parser.parse_args()
+engine = ENGINES[args.engine]
+label = 'Elo' if args.engine == 'elo' else 'Rating'
 
-squash_data = None
-with open('squash_data.json', 'r') as ifile:
-	squash_data = json.load(ifile)
+name = AliasStore().lookup(unicode(args.name, 'utf-8'))
 
-player_data = squash_data['players'].get(name)
-if not player_data:
+# Only decode the data of this player
+model = SquashModel.load(players=[name])
+
+player = model.player(name)
+if not player:
 	print 'Player %s not found' % name
 	sys.exit(-1)
 
-print '{name} ({tot} total games, {wins} wins, {rate:.2%} winrate, Elo {elo:6.1f})'.format(
-				 name=name,
-	             tot=player_data['n_total_matches'],
-	             wins=player_data['n_total_wins'],
-	             rate=float(player_data['n_total_wins'])/player_data['n_total_matches'],
-	             elo=player_data.get('last_elo', 1200))
+print '{name} ({tot} total games, {wins} wins, {rate:.2%} winrate, {label} {elo:6.1f})'.format(
+				 name=name, label=label,
+	             tot=player.n_total_matches,
+	             wins=player.n_total_wins,
+	             rate=float(player.n_total_wins)/player.n_total_matches,
+	             elo=player.get(engine.LAST_KEY, engine.BASE))
 
 # ## Dump to json file
 # oname = 'player_data_%s.json' % name.replace(' ', '').lower()
@@ -39,23 +47,21 @@ print '{name} ({tot} total games, {wins} wins, {rate:.2%} winrate, Elo {elo:6.1f
 # for seas,opp,res in all_matches:
 # 	print '%-12s: %-30s: %s' % (seas, opp, res)
 
-all_seasons = sort_seasons(squash_data['seasons'])
-
 message = ('{seas:12s} {month:>2}/{year:4} | {div:^3} | {nmat:^3} |'
 	       ' {wins:^3} ({rate:6.1%}) | {elo:^6.1f} |')
-header = ' Season              | Div | GP  |  Wins (%)    | Elo    |'
+header = ' Season              | Div | GP  |  Wins (%%)    | %-6s |' % label
 print header
 print len(header)*'-'
-for season,year,month in all_seasons:
-	sdata = player_data['seasons'].get(season, None)
-	if not sdata: continue
-	winrate = float(sdata['n_wins'])/len(sdata['matches']) if len(sdata['matches']) else 0.
+for season in model.seasons:
+	sdata = player.seasons.get(season.key, None)
+	if sdata is None: continue
+	winrate = float(sdata.n_wins)/len(sdata) if len(sdata) else 0.
 	print message.format(
-			seas=season, year=year, month=month,
-			div=sdata['division'],
-			nmat=len(sdata['matches']),
-			wins=sdata['n_wins'],
+			seas=season.key, year=season.year, month=season.month,
+			div=sdata.division,
+			nmat=len(sdata),
+			wins=sdata.n_wins,
 			rate=winrate,
-			elo=sdata.get('elo'))
+			elo=sdata.get(engine.SEASON_KEY))
 			# elo=sdata.get('elo', player_data['last_elo']))
 print len(header)*'-'
@@ -0,0 +1,430 @@
+#! /usr/bin/env python
+"""
+Rating engines: each one rates the players from the matches of the
+`MatchTable`, one season (rating period) at a time, and stores its
+ratings in the squash data under its own keys.
+
+All engines are run in a single pass over the seasons by `run_engines`,
+which also records the win probability each engine gives to every match
+before the season starts, to compare how well they predict the results.
+
+numpy is imported in the functions that use it, so that the print tools
+can look up the keys of the engines without it.
+"""
+import abc
+import sys
+import math
+import argparse
+
+from collections import namedtuple
+
+BASEELO = 1200
+KFACTOR = 40.0
+
+def expected_score(rating_diff):
+    """Elo win probability for a rating difference (a number or an array)"""
+    return 1.0 / (1+10**(-1.0*rating_diff/400.))
+
+def match_scores(table, close_win=None):
+    """
+    Scaled score of player1 for each match of a `MatchTable`, and whether
+    the match counts for the ratings (matches with a zero game difference
+    don't).
+
+    By default the scores are the same as in `calculate_elo`. Otherwise
+    `close_win` is the score of a 3-2 win, and the score of a 3-1 win is
+    halfway between that and 1 (3-0 win). `close_win=1.0` only counts
+    wins and losses.
+    """
+    import numpy as np
+    diff = table.games1.astype(np.int32)
+    known = table.games2 >= 0
+    diff[known] -= table.games2[known]
+    if close_win is None:
+        score = diff.astype(np.float64) / 3.0
+        score -= (score-1.0)/2.0
+    else:
+        margin = np.abs(diff).astype(np.float64)
+        win_score = close_win + (1.0-close_win)*(margin-1.0)/2.0
+        score = np.where(diff > 0, win_score, 1.0-win_score)
+    return score, diff != 0
+
+def batch_elo_update(ratings, player1, player2, score, K=KFACTOR):
+    """
+    Elo ratings (an array by player id) after a batch of matches, all of
+    them evaluated against the ratings before the batch and the changes
+    added up per player. Unlike match by match updates, the result does
+    not depend on the order of the matches.
+    """
+    import numpy as np
+    change = K * (score - expected_score(ratings[player1]-ratings[player2]))
+    new_ratings = ratings.copy()
+    np.add.at(new_ratings, player1, change)
+    np.add.at(new_ratings, player2, -change)
+    return new_ratings
+
+class RatingEngine(object):
+    """
+    Interface of the rating engines. The ratings are stored in the data
+    as `LAST_KEY` of each player and `SEASON_KEY` of each of its seasons,
+    and the rating deviations (for engines that have them) likewise as
+    `DEVIATION_KEYS`. Players start with a rating of `BASE`.
+
+    Engines with `MATCH_RATINGS` also give the ratings of both players
+    after each match from `rate_period`.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    NAME = None
+    LAST_KEY = None
+    SEASON_KEY = None
+    DEVIATION_KEYS = None
+    BASE = None
+    MATCH_RATINGS = False
+
+    @abc.abstractmethod
+    def reset(self, n_players):
+        """Start from scratch for player ids 0..n_players-1"""
+
+    @abc.abstractmethod
+    def win_probability(self, player1, player2):
+        """Probability that player1 beats player2 (arrays of ids)"""
+
+    @abc.abstractmethod
+    def rate_period(self, player1, player2, score, counts, roster):
+        """
+        Update the ratings with the matches of one season, given as arrays
+        of the players, the score of player1 and whether the match counts
+        (see `match_scores`), and the ids of the players of the season.
+        """
+
+    @abc.abstractmethod
+    def ratings(self):
+        """Current rating of each player id"""
+
+    def deviations(self):
+        """Current rating deviation of each player id, or None"""
+        return None
+
+class EloEngine(RatingEngine):
+    """
+    The Elo ratings of calculate_elo.py, updated after each match in the
+    order of the match table, or with `batch` once per season, with all
+    matches against the ratings at its start (see `batch_elo_update`).
+    """
+    NAME = 'elo'
+    LAST_KEY = 'last_elo'
+    SEASON_KEY = 'elo'
+    BASE = BASEELO
+    MATCH_RATINGS = True
+
+    def __init__(self, K=KFACTOR, batch=False):
+        self.K = K
+        self.batch = batch
+
+    def reset(self, n_players):
+        self._ratings = [self.BASE]*n_players
+
+    def restore(self, ratings):
+        """Continue from saved ratings of the player ids 0..len(ratings)-1"""
+        self._ratings[:len(ratings)] = ratings
+
+    def win_probability(self, player1, player2):
+        ratings = self.ratings()
+        return expected_score(ratings[player1]-ratings[player2])
+
+    def rate_period(self, player1, player2, score, counts, roster=None):
+        """
+        Also returns the ratings of both players after each match, as two
+        lists with NaN for the matches that don't count. With `batch`,
+        these are the ratings at the end of the season.
+        """
+        import numpy as np
+        n = len(player1)
+        after1, after2 = [np.nan]*n, [np.nan]*n
+        if self.batch:
+            matches = np.flatnonzero(counts)
+            p1, p2 = player1[matches], player2[matches]
+            new_ratings = batch_elo_update(self.ratings(), p1, p2, score[matches], self.K)
+            self._ratings = new_ratings.tolist()
+            for i, elo1, elo2 in zip(matches.tolist(), new_ratings[p1].tolist(),
+                                     new_ratings[p2].tolist()):
+                after1[i], after2[i] = elo1, elo2
+            return after1, after2
+
+        # Plain lists are much faster than numpy arrays for element access
+        ratings, K = self._ratings, self.K
+        for i, (p1, p2, s, c) in enumerate(zip(player1.tolist(), player2.tolist(),
+                                               score.tolist(), counts.tolist())):
+            if not c: continue
+            elo1, elo2 = ratings[p1], ratings[p2]
+            elo1_new = elo1 + K * (s - 1.0 / (1+10**(-1.0*(elo1-elo2)/400.)))
+            elo2_new = elo2 + K * ((1.0-s) - 1.0 / (1+10**(-1.0*(elo2-elo1)/400.)))
+            ratings[p1] = after1[i] = elo1_new
+            ratings[p2] = after2[i] = elo2_new
+        return after1, after2
+
+    def ratings(self):
+        import numpy as np
+        return np.array(self._ratings, dtype=np.float64)
+
+GLICKO_SCALE = 173.7178
+
+class Glicko2Engine(RatingEngine):
+    """
+    Glicko-2 ratings (Glickman, 'Example of the Glicko-2 system'), with
+    one rating period per season: all matches of a season are rated
+    together against the ratings at its start, for all players at once.
+
+    The rating deviation of players that sit out a season grows with
+    their volatility. Scores are the scaled scores of `match_scores`.
+    """
+    NAME = 'glicko2'
+    LAST_KEY = 'last_glicko2'
+    SEASON_KEY = 'glicko2'
+    DEVIATION_KEYS = ('last_glicko2_rd', 'glicko2_rd')
+    BASE = 1500
+
+    def __init__(self, deviation=350., volatility=0.06, tau=0.5, tolerance=1e-6):
+        self.deviation = deviation
+        self.volatility = volatility
+        self.tau = tau
+        self.tolerance = tolerance
+
+    def reset(self, n_players):
+        import numpy as np
+        self.mu = np.zeros(n_players)
+        self.phi = np.full(n_players, self.deviation/GLICKO_SCALE)
+        self.sigma = np.full(n_players, self.volatility)
+        self.seen = np.zeros(n_players, dtype=bool)
+
+    @staticmethod
+    def _g(phi):
+        import numpy as np
+        return 1.0 / np.sqrt(1.0 + 3.0*phi**2/math.pi**2)
+
+    def win_probability(self, player1, player2):
+        import numpy as np
+        phi = np.sqrt(self.phi[player1]**2 + self.phi[player2]**2)
+        return 1.0 / (1.0 + np.exp(-self._g(phi)*(self.mu[player1]-self.mu[player2])))
+
+    def _volatility(self, delta, phi, v, sigma):
+        """New volatility of each player (step 5, Illinois algorithm)"""
+        import numpy as np
+        tau, a = self.tau, np.log(sigma**2)
+        def f(x, i=slice(None)):
+            ex = np.exp(x)
+            return (ex*(delta[i]**2 - phi[i]**2 - v[i] - ex) /
+                    (2.0*(phi[i]**2 + v[i] + ex)**2) - (x - a[i])/tau**2)
+
+        A = a.copy()
+        B = np.empty_like(a)
+        big = delta**2 > phi**2 + v
+        B[big] = np.log(delta[big]**2 - phi[big]**2 - v[big])
+        k = np.ones_like(a)
+        todo = np.flatnonzero(~big)
+        while len(todo):
+            below = f(a[todo] - k[todo]*tau, todo) < 0
+            k[todo[below]] += 1
+            todo = todo[below]
+        B[~big] = (a - k*tau)[~big]
+
+        fA, fB = f(A), f(B)
+        todo = np.abs(B - A) > self.tolerance
+        for _ in xrange(100):
+            if not todo.any(): break
+            C = A + (A - B)*fA/(fB - fA)
+            fC = f(C)
+            swap = fC*fB <= 0
+            A = np.where(todo & swap, B, A)
+            fA = np.where(todo & swap, fB, np.where(todo, fA/2.0, fA))
+            B = np.where(todo, C, B)
+            fB = np.where(todo, fC, fB)
+            todo &= np.abs(B - A) > self.tolerance
+        return np.exp(A/2.0)
+
+    def rate_period(self, player1, player2, score, counts, roster):
+        import numpy as np
+        self.seen[roster] = True
+        player1, player2, score = player1[counts], player2[counts], score[counts]
+        n = len(self.mu)
+
+        # Each match is an observation for both players
+        players = np.concatenate([player1, player2])
+        opponents = np.concatenate([player2, player1])
+        scores = np.concatenate([score, 1.0-score])
+        g = self._g(self.phi[opponents])
+        E = 1.0 / (1.0 + np.exp(-g*(self.mu[players] - self.mu[opponents])))
+        v_inv = np.bincount(players, weights=g**2*E*(1.0-E), minlength=n)
+        gain = np.bincount(players, weights=g*(scores-E), minlength=n)
+
+        active = v_inv > 0
+        phi, sigma = self.phi[active], self.sigma[active]
+        v = 1.0/v_inv[active]
+        sigma = self._volatility(v*gain[active], phi, v, sigma)
+        phi_star = np.sqrt(phi**2 + sigma**2)
+        phi = 1.0/np.sqrt(1.0/phi_star**2 + 1.0/v)
+
+        idle = self.seen & ~active
+        self.phi[idle] = np.minimum(np.sqrt(self.phi[idle]**2 + self.sigma[idle]**2),
+                                    self.deviation/GLICKO_SCALE)
+        self.mu[active] += phi**2 * gain[active]
+        self.phi[active] = phi
+        self.sigma[active] = sigma
+
+    def ratings(self):
+        return self.BASE + GLICKO_SCALE*self.mu
+
+    def deviations(self):
+        return GLICKO_SCALE*self.phi
+
+ENGINES = dict((engine.NAME, engine) for engine in [EloEngine, Glicko2Engine])
+
+# Output of one engine in `run_engines`: ratings (and deviations, or None)
+# at the end, and at the end of each season (seasons x players), the
+# probability of a win of player1 in each match, before its season, and
+# for engines with `MATCH_RATINGS` the ratings of both players after each
+# match (matches x 2, NaN for matches that don't count), or None
+EngineResult = namedtuple('EngineResult', ['ratings', 'season_ratings', 'deviations',
+                                           'season_deviations', 'win_probability',
+                                           'match_ratings'])
+
+def run_engines(table, engines, scores=None, checkpoints=None):
+    """
+    Rate the matches of a `MatchTable` with each engine, in a single pass
+    over the seasons. Returns an `EngineResult` for each engine.
+
+    `checkpoints` has a `Checkpoint` of calculate_elo.py (or None) for each
+    engine. The seasons before `checkpoint.season` are then not replayed,
+    the engine continues from the ratings stored for them (with `restore`,
+    see `EloEngine`).
+    """
+    import numpy as np
+    if scores is None:
+        scores = match_scores(table)
+    if checkpoints is None:
+        checkpoints = [None]*len(engines)
+    score, counts = scores
+    offsets = table.season_offsets.tolist()
+    shape = (table.n_seasons, table.n_players)
+    season_ratings = [np.empty(shape) for _ in engines]
+    season_deviations = [np.empty(shape) if e.DEVIATION_KEYS else None for e in engines]
+    probabilities = [np.empty(len(table)) for _ in engines]
+    match_ratings = [np.full((len(table), 2), np.nan) if e.MATCH_RATINGS else None
+                     for e in engines]
+    for engine in engines:
+        engine.reset(table.n_players)
+
+    for sidx in xrange(table.n_seasons):
+        matches = slice(offsets[sidx], offsets[sidx+1])
+        player1, player2 = table.player1[matches], table.player2[matches]
+        roster = table.season_players(sidx)
+        for k, (engine, checkpoint) in enumerate(zip(engines, checkpoints)):
+            probabilities[k][matches] = engine.win_probability(player1, player2)
+            if checkpoint is not None and sidx < checkpoint.season:
+                engine.restore(checkpoint.season_ratings[sidx])
+                after = [ratings[matches] for ratings in checkpoint.match_ratings]
+            else:
+                after = engine.rate_period(player1, player2, score[matches],
+                                           counts[matches], roster)
+            season_ratings[k][sidx] = engine.ratings()
+            if season_deviations[k] is not None:
+                season_deviations[k][sidx] = engine.deviations()
+            if match_ratings[k] is not None:
+                match_ratings[k][matches] = np.array(after, dtype=np.float64).T
+
+    return [EngineResult(engine.ratings(), season_ratings[k], engine.deviations(),
+                         season_deviations[k], probabilities[k], match_ratings[k])
+            for k, engine in enumerate(engines)]
+
+def season_win_probability(table, season_ratings):
+    """
+    Elo win probability of player1 in each match, with the ratings at the
+    end of the season before (seasons x players, as from `run_elo`): the
+    `win_probability` of the `EloEngine` in `run_engines`.
+    """
+    import numpy as np
+    previous = table.season.astype(np.int32) - 1
+    rating_diff = (season_ratings[previous, table.player1] -
+                   season_ratings[previous, table.player2])
+    rating_diff[previous < 0] = 0.0 # everybody starts with the same rating
+    return expected_score(rating_diff)
+
+def predictive_scores(table, probability, counts):
+    """
+    Log-loss and fraction of correctly predicted winners of the win
+    probability of player1 in each match (before its season), over all
+    matches that count for the ratings, from the second season on.
+    """
+    import numpy as np
+    start = table.season_offsets[1] if table.n_seasons > 1 else len(table)
+    prob = np.clip(probability[start:], 1e-12, 1.0-1e-12)
+    counts = counts[start:]
+    won = (table.games1[start:] > np.where(table.games2[start:] >= 0,
+                                           table.games2[start:], 0))[counts]
+    prob = prob[counts]
+    if not len(prob):
+        return float('nan'), float('nan')
+    log_loss = -np.mean(np.where(won, np.log(prob), np.log(1.0-prob)))
+    accuracy = np.mean((prob > 0.5) == won)
+    return float(log_loss), float(accuracy)
+
+def store_engine_ratings(model, table, engine, result):
+    """
+    Store the ratings (and deviations) of an `EngineResult` in a
+    `SquashModel`, under the keys of the engine
+    """
+    ratings = [result.ratings.tolist()]
+    season_ratings = [result.season_ratings]
+    keys = [(engine.LAST_KEY, engine.SEASON_KEY)]
+    if engine.DEVIATION_KEYS:
+        ratings.append(result.deviations.tolist())
+        season_ratings.append(result.season_deviations)
+        keys.append(engine.DEVIATION_KEYS)
+
+    for values, per_season, (last_key, season_key) in zip(ratings, season_ratings, keys):
+        for player in model.players:
+            if player is None or player.id >= table.n_players: continue
+            player.set(last_key, values[player.id])
+        for sidx, season in enumerate(model.seasons):
+            season_values = per_season[sidx].tolist()
+            for pid in season.players:
+                model.players[pid].seasons[season.key].set(season_key, season_values[pid])
+
+def print_comparison(table, probabilities, counts):
+    """Scores of a list of (engine name, win probabilities)"""
+    header = ' Engine    | log-loss | accuracy |'
+    print header
+    print len(header)*'-'
+    for name, probability in probabilities:
+        log_loss, accuracy = predictive_scores(table, probability, counts)
+        print ' %-9s | %8.4f | %8.2f%% |' % (name, log_loss, 100*accuracy)
+    print len(header)*'-'
+
+def main():
+    from match_table import MatchTable, TABLEFILE
+    parser = argparse.ArgumentParser(
+        description="Compare how well the rating engines predict the matches")
+    parser.add_argument('-i', '--input', help='Match table', default=TABLEFILE)
+    parser.add_argument('-e', '--engines', default=','.join(sorted(ENGINES)),
+                        help='Comma separated engines (%s)' % ', '.join(sorted(ENGINES)))
+    parser.add_argument('--batch', action="store_true",
+                        help='Update the Elo ratings once per season')
+    args = parser.parse_args()
+
+    try:
+        engines = [ENGINES[name]() for name in args.engines.split(',')]
+    except KeyError, e:
+        parser.error('Unknown engine %s' % e.args[0])
+    for engine in engines:
+        if engine.NAME == 'elo':
+            engine.batch = args.batch
+    table = MatchTable.load(args.input, lazy=False)
+    scores = match_scores(table)
+    results = run_engines(table, engines, scores)
+    print_comparison(table, [(engine.NAME, result.win_probability)
+                             for engine, result in zip(engines, results)], scores[1])
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
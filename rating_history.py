@@ -0,0 +1,155 @@
+#! /usr/bin/env python
+import sys
+import argparse
+
+import numpy as np
+
+from match_table import ArrayStore
+
+HISTORYFILE = 'rating_history.npz'
+
+class RatingHistory(ArrayStore):
+    """
+    Rating of every player after each of their matches, written by
+    calculate_elo.py, with one entry per player and counted match.
+
+    The entries of player id p are `offsets[p]:offsets[p+1]`, in the
+    order in which the matches were played:
+     - match: index of the match in the `MatchTable`
+     - season: index of its season in `season_keys`
+     - elo: rating of the player after the match
+
+    `peak` and `trough` are the indices of the entries with the highest
+    and lowest rating of each player (-1 for players without any counted
+    match), and `base_elo` is the starting rating of all players.
+    """
+    FILENAME = HISTORYFILE
+
+    @classmethod
+    def build(cls, table, result, base_elo):
+        """From a MatchTable and the `EloResult` of calculate_elo.run_elo"""
+        counted = np.flatnonzero(~np.isnan(result.match_ratings[:,0]))
+        players = np.concatenate([table.player1[counted], table.player2[counted]])
+        matches = np.concatenate([counted, counted])
+        elo = np.concatenate([result.match_ratings[counted,0],
+                              result.match_ratings[counted,1]])
+        order = np.lexsort((matches, players))
+        players, matches, elo = players[order], matches[order], elo[order]
+
+        offsets = np.zeros(table.n_players+1, dtype=np.int32)
+        offsets[1:] = np.cumsum(np.bincount(players, minlength=table.n_players))
+        peak = np.full(table.n_players, -1, dtype=np.int32)
+        trough = np.full(table.n_players, -1, dtype=np.int32)
+        for pid, (lo, hi) in enumerate(zip(offsets[:-1].tolist(), offsets[1:].tolist())):
+            if hi == lo: continue
+            peak[pid] = lo + np.argmax(elo[lo:hi])
+            trough[pid] = lo + np.argmin(elo[lo:hi])
+
+        return cls({'offsets': offsets,
+                    'match': matches.astype(np.int32),
+                    'season': table.season[matches],
+                    'elo': elo,
+                    'peak': peak,
+                    'trough': trough,
+                    'base_elo': np.array([base_elo], dtype=np.float64),
+                    'player_names': table.player_names,
+                    'season_keys': table.season_keys})
+
+    def __len__(self):
+        return len(self.elo)
+
+    def player_id(self, name):
+        ids = np.flatnonzero(self.player_names == name)
+        return ids[0] if len(ids) else None
+
+    def player(self, pid):
+        """Season indices and ratings after each match of a player id"""
+        entries = slice(self.offsets[pid], self.offsets[pid+1])
+        return self.season[entries], self.elo[entries]
+
+    def changes(self):
+        """Rating change of each entry"""
+        previous = np.empty_like(self.elo)
+        previous[1:] = self.elo[:-1]
+        starts = self.offsets[:-1][self.offsets[:-1] < self.offsets[1:]]
+        previous[starts] = self.base_elo[0]
+        return self.elo - previous
+
+    def top_peaks(self, n=20, lowest=False):
+        """
+        (player id, rating, season index) of the `n` highest peak ratings,
+        or the lowest troughs
+        """
+        entries = self.trough if lowest else self.peak
+        pids = np.flatnonzero(entries >= 0)
+        elo = self.elo[entries[pids]]
+        best = np.argsort(elo if lowest else -elo, kind='mergesort')[:n]
+        return zip(pids[best].tolist(), elo[best].tolist(),
+                   self.season[entries[pids[best]]].tolist())
+
+    def season_gains(self):
+        """
+        Rating change of each player in each season played, as arrays of
+        player ids, season indices and changes.
+        """
+        players = np.repeat(np.arange(len(self.offsets)-1), np.diff(self.offsets))
+        if not len(players):
+            return players, self.season, self.elo
+        new_group = np.ones(len(players), dtype=bool)
+        new_group[1:] = (players[1:] != players[:-1]) | (self.season[1:] != self.season[:-1])
+        starts = np.flatnonzero(new_group)
+        return players[starts], self.season[starts], np.add.reduceat(self.changes(), starts)
+
+    def top_season_gains(self, n=20, losses=False):
+        """(player id, season index, change) of the `n` largest single-season gains"""
+        players, seasons, gains = self.season_gains()
+        best = np.argsort(gains if losses else -gains, kind='mergesort')[:n]
+        return zip(players[best].tolist(), seasons[best].tolist(), gains[best].tolist())
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the rating history of all players")
+    parser.add_argument('-i', '--input', help='Rating history file', default=HISTORYFILE)
+    subparsers = parser.add_subparsers(dest='command')
+    p_peaks = subparsers.add_parser('peaks', help='Highest peak ratings')
+    p_peaks.add_argument('-n', type=int, default=20)
+    p_peaks.add_argument('--lowest', action='store_true', help='Lowest troughs instead')
+    p_gains = subparsers.add_parser('gains', help='Largest rating gains in a season')
+    p_gains.add_argument('-n', type=int, default=20)
+    p_gains.add_argument('--losses', action='store_true', help='Largest losses instead')
+    p_player = subparsers.add_parser('player', help='Rating after each match of a player')
+    p_player.add_argument('name')
+    args = parser.parse_args()
+
+    history = RatingHistory.load(args.input, lazy=False)
+    names = history.player_names.tolist()
+    seasons = history.season_keys.tolist()
+
+    if args.command == 'peaks':
+        for pid, elo, sidx in history.top_peaks(args.n, args.lowest):
+            print '%-30s | %6.1f | %s' % (names[pid], elo, seasons[sidx])
+
+    elif args.command == 'gains':
+        for pid, sidx, gain in history.top_season_gains(args.n, args.losses):
+            print '%-30s | %+6.1f | %s' % (names[pid], gain, seasons[sidx])
+
+    elif args.command == 'player':
+        from squash_names import AliasStore
+        name = AliasStore().lookup(unicode(args.name, 'utf-8'))
+        pid = history.player_id(name)
+        if pid is None:
+            print 'Player %s not found' % name
+            return -1
+        season, elo = history.player(pid)
+        if not len(elo):
+            print 'No rated matches for %s' % name
+            return 0
+        peak, trough = history.peak[pid], history.trough[pid]
+        print '%s: %d matches, peak %6.1f (%s), lowest %6.1f (%s)' % (
+                    name, len(elo), history.elo[peak], seasons[history.season[peak]],
+                    history.elo[trough], seasons[history.season[trough]])
+        for sidx, rating in zip(season.tolist(), elo.tolist()):
+            print '  %-12s %6.1f' % (seasons[sidx], rating)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
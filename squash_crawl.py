@@ -1,64 +1,119 @@
 #! /usr/bin/env python
+import os
 import sys
 import re
 import json
+import time
+import socket
+import hashlib
+import httplib
 import urllib2
-import unicodedata
+import urlparse
+import threading
+import itertools
+import multiprocessing
 import argparse
+import cProfile
+import pstats
 
 from bs4 import BeautifulSoup
-from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 
-BASEURL = "http://club-squash.web.cern.ch/club-squash/archives/%s"
+import page_cache
+import page_parsers
+from match_table import MatchTable, TABLEFILE
+from squash_names import clean_name, AliasStore, cache_stats
+from squash_db import SquashDB
+from squash_io import load_data, write_data, write_atomic
+from crawl_stats import CrawlStats
+
+BASEURL = page_cache.SITEURL + "archives/%s"
 EMPTYRESULT = None
 
-PNAMES = None
-def get_name_dictionary(filename):
-    global PNAMES
-    if not PNAMES:
-        PNAMES = {}
-        with open(filename, 'r') as ifile:
-            for line in ifile:
-                if not len(line.strip()): continue
-                key,value = tuple(line.strip().split(',', 1))
-                PNAMES[key] = value.strip()
-    return len(PNAMES)
+class HostLimiter(object):
+    """
+    Politeness limits for fetching pages: at most `max_connections`
+    simultaneous requests per host, and at least `delay` seconds between
+    the start of two requests to the same host. Requests time out after
+    `timeout` seconds.
+    """
+    def __init__(self, max_connections=2, delay=0.2, timeout=30):
+        self.max_connections = max_connections
+        self.delay = delay
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._slots = {} # host -> semaphore
+        self._last_request = {} # host -> time of last request
+
+    def _slot(self, host):
+        with self._lock:
+            return self._slots.setdefault(host,
+                          threading.BoundedSemaphore(self.max_connections))
+
+    def _wait_turn(self, host):
+        with self._lock:
+            now = time.time()
+            start = max(now, self._last_request.get(host, 0) + self.delay)
+            self._last_request[host] = start
+        if start > now:
+            time.sleep(start - now)
+
+    def urlopen(self, request):
+        if request.get_type() == 'file': # a local mirror, no need to be polite
+            return page_cache.urlopen(request, timeout=self.timeout)
+        host = urlparse.urlparse(request.get_full_url()).netloc
+        with self._slot(host):
+            self._wait_turn(host)
+            return page_cache.urlopen(request, timeout=self.timeout)
+
+LIMITER = HostLimiter()
+RETRIES = 3
+# Errors of a request that may go away when trying again: connection
+# problems, timeouts and broken responses
+NETWORK_ERRORS = (urllib2.URLError, socket.error, httplib.HTTPException)
+def open_url(request, retries=None, backoff=1.0):
+    """
+    Open a urllib2.Request and return the response headers and content,
+    retrying with an exponential backoff on connection problems and
+    server errors. Client errors (e.g. 404) are raised immediately.
+    """
+    if retries is None: retries = RETRIES
+    for attempt in range(retries+1):
+        try:
+            return LIMITER.urlopen(request)
+        except urllib2.HTTPError, e:
+            if e.code < 500 or attempt == retries: raise
+        except NETWORK_ERRORS, e:
+            if attempt == retries or request.get_type() == 'file': raise
+        time.sleep(backoff * 2**attempt)
+
+PAGE_CACHE = page_cache.PageCache()
+STATS = CrawlStats()
+def fetch_page(url):
+    """Return the content of a page, from the page cache if possible"""
+    content, cache_hit = PAGE_CACHE.fetch_status(url, opener=open_url)
+    STATS.add(url, 'bytes', len(content))
+    if cache_hit is not None: # local pages are neither hits nor misses
+        STATS.set(url, 'cache_hit', cache_hit)
+    return content
+
+ALIASES = None
+def get_name_dictionary(filename, fuzzy_cutoff=None):
+    global ALIASES
+    if not ALIASES:
+        ALIASES = AliasStore(filename, fuzzy_cutoff=fuzzy_cutoff)
+    return len(ALIASES)
 
 def get_name(text):
     """
     Clean the text of a player name field, then look up the name
     in the dictionary, or store it there if it doesn't exist yet.
-
-    FIXME: If the dictionary changes, we should write it back to the file.
     """
-    global PNAMES
-    if not PNAMES: get_name_dictionary('player_names.txt')
-    text = text.strip().lower()
-    text = text.replace('\n', '')
-    text = text.replace('\r', '')
-    # Replace unicode characters by ascii ones
-    text = unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore')
-    # Sometimes there's a 'home' in there (from phone numbers, I assume)
-    text = re.sub(r'home','', text)
-    # Remove the '1st/2nd/3rd/... to finish'
-    text = re.sub(r'(\s?-?\s?\(?(1st|2nd|3rd|[1-9]{1}th)\s+to\s+finish\)?)', '', text)
-    # Remove trailing dashes
-    text = re.sub(r'\s+-$', '', text, re.MULTILINE)
-    # Remove trailing 'out's
-    text = re.sub(r'\s+out$', '', text, re.MULTILINE)
-    # Remove #,(,) and numbers
-    text = re.sub(r'[\#\+0-9\)\(\.]','', text)
-    # Replace double spaces by single spaces
-    text = re.sub(r'\s{2,}',' ', text)
-
-    # Some more custom cleaning
-    text = text.replace('unavailable', '')
-    text = text.replace('out for summer', '')
-    text = text.replace(' ?', '')
-    text = text.strip()
-
+    global ALIASES
+    if not ALIASES: get_name_dictionary('player_names.txt')
+    text = clean_name(text)
     key = text.replace(' ', '')
-    return PNAMES.setdefault(key, text.title())
+    return ALIASES.resolve(key, text.title())
 
 def get_result(text):
     """
@@ -108,57 +163,96 @@ def get_division(text):
     rank = int(rank_match.group(1))
     return rank
 
+def load_page(url):
+    """
+    Return the html of a squash archive page.
+
+    Some seasons use a sub file to store the results, in which case the
+    page has no table but a link to a 'sheetNNN.htm' file, and the html
+    of that file is returned instead.
+    """
+    html = fetch_page(url)
+    if not re.search(r'<table\b', html, re.IGNORECASE):
+        frame = re.search(r'<link\b[^>]*?\bhref\s*=\s*["\']?'
+                          r'([^"\'\s>]*sheet[\d]+?\.htm[^"\'\s>]*)',
+                          html, re.IGNORECASE)
+        if not frame:
+            raise RuntimeError('No results table found in %s' % url)
+        suburl = '%s/%s' % (url.rsplit('/',1)[0], frame.group(1))
+        return load_page(suburl)
+    return html
+
 def process_page(url, printout=False, verbose=False):
     """
     Extract the players and matches from a single squash archive page
-    First open the url, then parse the html using BeautifulSoup.
+    First open the url, then parse the html with `parse_page`.
+    """
+    print '... processing %s' % url
+    return parse_page(load_page(url), printout=printout, verbose=verbose)
+
+DIVISION_RE = re.compile('Division')
+PLAYERLETTER_RE = re.compile(r'\b[A-G]{1}\b')
+def first_match(regex, strings):
+    """Index of the first string matching the regex, or None"""
+    for i,text in enumerate(strings):
+        if text and regex.search(text): return i
+    return None
+
+PARSER = page_parsers.Bs4Backend()
+def parse_page(html, printout=False, verbose=False, url=None):
+    """
+    Extract the players and matches from the html of a squash archive
+    page, using the tables and rows given by the `PARSER` backend.
 
     The code looks for a table that contains a row with 'Division' in it.
     Then looks for rows with players and results.
 
     Returns two dictionaries, one with all the players for each division,
     one with all the results for each match played.
-    """
-    print '... processing %s' % url
-    page_request = urllib2.urlopen(url)
-
-    soup = BeautifulSoup(page_request, 'html.parser')
 
+    The time spent is added to the 'parse' (row scan) and 'extract'
+    (assembling the matches) stages of `url` in the crawl stats.
+    """
+    start = time.time()
     divisions = {} # div rank -> list of player names
     results   = {} # player name -> list of results
     matches   = {} # (name1, name2) -> result
 
-    ## Some seasons use a sub file to store the results
-    if not len(soup.find_all('table')):
-        frame = soup.find('link', href=re.compile(r'sheet[\d]+?\.htm'))
-        suburl = '%s/%s' % (url.rsplit('/',1)[0], frame['href'])
-        return process_page(suburl)
-
-    ## First pass: collect all divisions and players in each division
+    ## Single pass over the rows: collect all divisions and players in each
+    ## division, with the position of each player in the division and the
+    ## raw text of the result fields of their row. Nothing else from the
+    ## page is kept.
     rank = -1
-    player_rows = {} # name -> row
+    positions = {} # (div rank, name) -> position of the player in the division
+    result_fields = {} # name -> text of the result fields in the row
     found_table = False # Break after a valid table is found
-    for table in soup.find_all('table'):
+    for rows in PARSER.tables(html):
         if found_table: break
-        for row in table.find_all('tr'):
+        for strings, texts, all_texts in rows:
             # Check if this starts a new division or not
-            div = row.find('td', text=re.compile('Division'), recursive=False)
-            if div:
-                rank = get_division(div.get_text())
+            div = first_match(DIVISION_RE, strings)
+            if div is not None:
+                rank = get_division(texts[div])
                 found_table = True
 
             # Player rows always start with a field containing A,B,C,...
-            elif row.find('td', text=re.compile(r'\b[A-G]{1}\b'), recursive=False):
+            elif first_match(PLAYERLETTER_RE, strings) is not None:
                 # Player entry is then either the second or third entry in the row
-                player_name = get_name(row.find_all('td')[1].get_text())
-                if re.match(r'\b[A-G]{1}\b', player_name): # There was an empty field first
-                    player_name = get_name(row.find_all('td')[2].get_text())
+                player_name = get_name(all_texts[1])
+                if PLAYERLETTER_RE.match(player_name): # There was an empty field first
+                    player_name = get_name(all_texts[2])
+
+                names = divisions.setdefault(rank,[])
+                positions.setdefault((rank, player_name), len(names))
+                names.append(player_name)
+                # Results start in 3rd position
+                result_fields[player_name] = all_texts[2:]
 
-                divisions.setdefault(rank,[]).append(player_name)
-                player_rows[player_name] = row
+    STATS.add(url, 'parse', time.time()-start)
+    start = time.time()
 
-    ## Second pass: now that we know the number of players in each division,
-    ##              extract the results from the rows.
+    ## Now that we know the number of players in each division,
+    ## assemble the matches from the positions and result fields.
     for divrank, player_names in divisions.iteritems():
         division_size = len(player_names)
 
@@ -166,17 +260,15 @@ def process_page(url, printout=False, verbose=False):
             print 'Division %d with %d players:' % (divrank, len(player_names)),
             print ' %s' % ', '.join(player_names)
 
-        # Go through the rows and extract the match results
         for name1 in player_names:
-            # Results start in 3rd position and we know how many to expect
-            # However we can start at the position of the player+1 to avoid
-            # double counting the matches.
+            # We know how many results to expect, and we can start at the
+            # position of the player+1 to avoid double counting the matches.
             ## FIXME: this breaks when player name is not in second field
-            pos = player_names.index(name1)
-            match_results = player_rows[name1].find_all('td')[2:division_size+2]
+            pos = positions[(divrank, name1)]
+            match_results = result_fields[name1][:division_size]
             for pos2,entry in zip(range(pos+1, division_size), match_results[pos+1:]):
                 name2 = player_names[pos2]
-                result = get_result(entry.get_text())
+                result = get_result(entry)
                 matches[(name1, name2)] = result
                 results.setdefault(name1, []).append(result)
                 results.setdefault(name2, []).append(invert_result(result))
@@ -196,6 +288,7 @@ def process_page(url, printout=False, verbose=False):
     matches = {k:m for k,m in matches.iteritems() if m != EMPTYRESULT}
     # Check that there are no duplicate matches
     assert(set(matches.keys()).isdisjoint(set([(y,x) for x,y in matches.keys()])))
+    STATS.add(url, 'extract', time.time()-start)
 
     print ('  %2d divisions, %3d players, %3d played matches' %
                (len(divisions), len(results), len(matches)))
@@ -230,73 +323,298 @@ def get_season(season_key, filename='seasons.txt'):
                 year, month = tuple(value.strip().split(' '))
                 assert(month in ['%02d'%d for d in range(1,13)])
                 SEASONS[key] = (int(year), int(month))
-        if not season_key in SEASONS:
-            raise RuntimeError("Season key %s not in '%s' file, please add" % (season_key, filename))
     if 'summer' in season_key.lower():
         return (int('20' + season_key.lower().split('summer')[1]), 7)
-    return SEASONS.get(season_key)
+    if not season_key in SEASONS:
+        raise RuntimeError("Season key %s not in '%s' file, please add" % (season_key, filename))
+    return SEASONS[season_key]
 
-def process_archives(url, verbose=False):
+def add_season(squash_data, season, divisions, matches):
     """
-    Extract a list from the archives page and process each season.
-    Then store the data in a dictionary and dump it to a json file.
+    Add the divisions and matches of one season to the data, updating
+    the per-player totals.
+
+    The season is checked first (`get_season` raises a RuntimeError for
+    unknown seasons), so that the data is left unchanged on errors.
+    """
+    if len(matches):
+        year, month = get_season(season)
+    players = squash_data.setdefault('players', {})
+    for div,names in divisions.iteritems():
+        for name1 in names:
+            player_data = players.setdefault(name1, {})
+            player_data['n_seasons_played'] = player_data.get('n_seasons_played', 0) + 1
+
+            sdata = player_data.setdefault('seasons', {}).setdefault(season, {})
+            sdata['matches'] = {}
+            sdata['division'] = div
+            sdata['n_wins'] = 0
+            for name2 in names:
+                if name1 == name2: continue
+                result = matches.get((name1, name2))
+                if not result:
+                    result = invert_result(matches.get((name2,name1)))
+                if result:
+                    sdata['matches'][name2] = result
+                    if parse_result(result) > 0:
+                        sdata['n_wins'] += 1
+
+            player_data['n_total_wins'] = (player_data.get('n_total_wins', 0)
+                                           + sdata['n_wins'])
+            player_data['n_total_matches'] = (player_data.get('n_total_matches', 0)
+                                              + len(sdata['matches']))
+
+    # Store valid seasons
+    if len(matches):
+        season_data = squash_data.setdefault('seasons', {}).setdefault(season, {})
+        season_data['year'] = year
+        season_data['month'] = month
+        season_data['n_divisions'] = len(divisions)
+        n_players = sum([len(n) for n in divisions.values()])
+        season_data['n_players'] = n_players
+        season_data['players'] = [n for ns in divisions.values() for n in ns]
+        season_data['n_matches'] = len(matches)
+        n_expected_matches = sum([len(n)*(len(n)-1)/2 for n in divisions.values()])
+        season_data['completion_rate'] = float(len(matches)) / n_expected_matches
+
+def remove_season(squash_data, season):
+    """
+    Remove one season from the data, subtracting its contribution from
+    the per-player totals. Players without any other season are removed.
+    """
+    players = squash_data.setdefault('players', {})
+    for name in players.keys():
+        player_data = players[name]
+        sdata = player_data.get('seasons', {}).pop(season, None)
+        if sdata is None: continue
+        if not player_data['seasons']:
+            del players[name]
+            continue
+        player_data['n_seasons_played'] -= 1
+        player_data['n_total_wins'] -= sdata['n_wins']
+        player_data['n_total_matches'] -= len(sdata['matches'])
+    squash_data.setdefault('seasons', {}).pop(season, None)
+
+def replace_season(squash_data, season, divisions, matches):
     """
-    page_request = urllib2.urlopen(url)
+    Replace one season of the data with new divisions and matches. The
+    new season is first built on its own, so that on errors (e.g. a season
+    no longer in seasons.txt) the data keeps the existing season.
+    """
+    add_season({'players': {}, 'seasons': {}}, season, divisions, matches)
+    remove_season(squash_data, season)
+    add_season(squash_data, season, divisions, matches)
+
+MANIFEST = 'squash_manifest.json'
+def source_hash(html):
+    return hashlib.sha1(html).hexdigest()
 
-    soup = BeautifulSoup(page_request, 'html.parser')
+def _fetch_site(args):
+    """
+    Fetch stage, run in a pool of threads: load the html of a season page.
+    The html is None if the source is unchanged since the last run, or
+    if fetching it failed.
+    """
+    site, baseurl, verbose, known_hash = args
+    profiler = None
+    if PROFILES is not None: # profile the worker threads too
+        profiler = cProfile.Profile()
+        profiler.enable()
+    url = baseurl % site
+    try:
+        with STATS.timer(url, 'fetch'):
+            html = load_page(url)
+        shash = source_hash(html)
+        if shash == known_hash:
+            html = None
+        return (site, url, html, shash, verbose), None
+    except (RuntimeError, AssertionError) + NETWORK_ERRORS, e:
+        return (site, url, None, None, verbose), e
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            PROFILES.append(profiler)
+
+PARSE_PROCESS = False # True in the parser processes
+def _init_parse_worker():
+    """Parser processes leave unknown names to the main process"""
+    global PARSE_PROCESS
+    PARSE_PROCESS = True
+    ALIASES.defer = True
+
+class ProfileStats(object):
+    """Statistics of a profile taken in a parser process, for `pstats.Stats.add`"""
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def _parse_site(fetched):
+    """
+    Parse stage, run in the main process or in a pool of processes:
+    returns the parsed page, the names it did not know (see
+    `resolve_deferred`), the time spent in the parse stages, the hits and
+    misses of the name caches while parsing it and, when profiling in a
+    parser process, the profile statistics.
+    """
+    site, url, html, shash, verbose = fetched
+    if html is None:
+        return site, shash, None, None, [], {}, {}, None
+    profiler = None
+    if PROFILES is not None and PARSE_PROCESS: # the main process is profiled as a whole
+        profiler = cProfile.Profile()
+        profiler.enable()
+    caches_before = cache_stats()
+    del ALIASES.deferred[:]
+    try:
+        print '... processing %s' % url
+        parsed = parse_page(html, verbose=verbose, url=url)
+        error = None
+    except (RuntimeError, AssertionError), e:
+        parsed, error = None, e
+    timings = dict((stage, seconds) for stage, seconds
+                   in STATS.urls.get(url, {}).iteritems()
+                   if stage in ('parse', 'extract'))
+    caches = dict((name, dict((key, info[key]-caches_before[name][key])
+                              for key in ('hits', 'misses')))
+                  for name, info in cache_stats().iteritems())
+    profile = None
+    if profiler is not None:
+        profiler.disable()
+        profiler.create_stats()
+        profile = profiler.stats
+    return site, shash, parsed, error, list(ALIASES.deferred), timings, caches, profile
+
+def resolve_deferred(parsed, deferred):
+    """
+    Resolve the names that a parser process did not know, in the order
+    in which it met them, and rename the players of the parsed page to
+    the resolved names.
+    """
+    renames = {}
+    for key, name in deferred:
+        resolved = ALIASES.resolve(key, name)
+        if resolved != name: renames[name] = resolved
+    divisions, matches = parsed
+    if not renames: return divisions, matches
+
+    rename = lambda name: renames.get(name, name)
+    divisions = dict((rank, [rename(n) for n in names])
+                     for rank, names in divisions.iteritems())
+    matches = dict(((rename(n1), rename(n2)), result)
+                   for (n1, n2), result in matches.iteritems())
+    return divisions, matches
+
+# cProfile.Profile of each call of _fetch_site, and the `ProfileStats` of
+# each page parsed in a parser process, if profiling
+PROFILES = None
+def process_archives(url, verbose=False, jobs=4, baseurl=BASEURL,
+                     incremental=False, fuzzy_cutoff=None, sqlite=None,
+                     report=None, parse_workers=0, compact=False, compress=False):
+    """
+    Extract a list from the archives page and process each season.
+    Then store the data in a dictionary and dump it to a json file,
+    and write all matches to a flat table (see `match_table.py`).
+
+    The season pages are fetched by a pool of `jobs` threads, and parsed
+    as they come in, by a pool of `parse_workers` processes (or in this
+    process if 0). The parsed pages are merged in the order in which they
+    appear on the archives page, and names unknown to the parser processes
+    are only resolved then, so the output does not depend on the number
+    of workers or the order in which they finish.
+
+    A manifest with the source hash, parse time and number of matches of
+    each season is written next to the data. In `incremental` mode, the
+    existing data is updated instead, and only seasons whose source
+    changed since the last run are parsed again.
+
+    Player names not in player_names.txt are added to the file, as new
+    players, or with a `fuzzy_cutoff` as an alias of the most similar known
+    name if the similarity is above it. New players with a name close to a
+    known one are listed, to check whether they are the same player.
+
+    If `sqlite` is given, the changed seasons are also written to that
+    SQLite database (see `squash_db.py`).
+
+    If `report` is given, the timings of each stage for each page and
+    the cache statistics are written to that json file.
+
+    The json file is replaced atomically, and is written without
+    indentation if `compact`, and gzip-compressed if `compress` (see
+    `squash_io.write_data`).
+    """
+    global STATS
+    STATS = CrawlStats()
+    with STATS.timer(url, 'fetch'):
+        soup = BeautifulSoup(fetch_page(url), 'html.parser')
     hrefs = soup.find_all('a', href=re.compile('archives'))
     sites_to_process = [l['href'].replace('archives/','') for l in hrefs]
 
+    ## DEBUG
+    # sites_to_process = [s for s in sites_to_process if s in [u'05-06.html']]
+
     failed_sites = [] # Keep track if something went wrong
     total_played_matches = 0
-
-    squash_data = defaultdict(dict)
+    n_unchanged = 0
+    changed_seasons = []
+
+    squash_data = {'players': {}, 'seasons': {}}
+    manifest = {} # season -> source hash, parse time, number of matches
+    if incremental and os.path.exists('squash_data.json'):
+        squash_data = load_data('squash_data.json')
+        if os.path.exists(MANIFEST):
+            with open(MANIFEST, 'r') as ifile:
+                manifest = json.load(ifile)
+
+    get_name_dictionary('player_names.txt', fuzzy_cutoff) # load before starting workers
+    parse_pool = None
+    if parse_workers > 0: # fork before starting any threads
+        parse_pool = multiprocessing.Pool(parse_workers, _init_parse_worker)
+    pool = ThreadPool(max(jobs, 1))
+    tasks = []
     for site in sites_to_process:
+        known_hash = manifest.get(site.rsplit('.')[0], {}).get('source_hash')
+        tasks.append((site, baseurl, verbose, known_hash))
+
+    # Fetch errors stay in this process, only the html goes to the parsers
+    fetch_errors = {}
+    def fetched_pages():
+        for fetched, error in pool.imap(_fetch_site, tasks):
+            if error is not None: fetch_errors[fetched[0]] = error
+            yield fetched
+    if parse_pool is not None:
+        parsed_pages = parse_pool.imap(_parse_site, fetched_pages())
+    else:
+        parsed_pages = itertools.imap(_parse_site, fetched_pages())
 
-        ## DEBUG
-        # if not site in [u'05-06.html']: continue
+    worker_caches = {} # hits and misses of the name caches in the parser processes
+    for site, shash, parsed, error, deferred, timings, caches, profile in parsed_pages:
         season = site.rsplit('.')[0] # drop the file ending
+        if parse_pool is not None: # timed, counted and profiled in the parser process
+            for stage, seconds in timings.iteritems():
+                STATS.add(baseurl % site, stage, seconds)
+            for name, counts in caches.iteritems():
+                for key, n in counts.iteritems():
+                    worker_caches.setdefault(name, {'hits': 0, 'misses': 0})[key] += n
+            if profile is not None:
+                PROFILES.append(ProfileStats(profile))
 
         try:
-            divisions, matches = process_page(BASEURL % site, verbose=verbose)
-
-            # Store all result for all players
-            for div,names in divisions.iteritems():
-                for name1 in names:
-                    player_data = squash_data['players'].setdefault(name1, defaultdict(int))
-                    player_data['n_seasons_played'] += 1
-
-                    sdata = player_data.setdefault('seasons', {}).setdefault(season, {})
-                    sdata['matches'] = {}
-                    sdata['division'] = div
-                    sdata['n_wins'] = 0
-                    for name2 in names:
-                        if name1 == name2: continue
-                        result = matches.get((name1, name2))
-                        if not result:
-                            result = invert_result(matches.get((name2,name1)))
-                        if result:
-                            sdata['matches'][name2] = result
-                            if parse_result(result) > 0:
-                                sdata['n_wins'] += 1
-
-
-                    player_data['n_total_wins'] += sdata['n_wins']
-                    player_data['n_total_matches'] += len(sdata['matches'])
-
-            # Store valid seasons
-            if len(matches):
-                season_data = squash_data['seasons'].setdefault(season, {})
-                year, month = get_season(season)
-                season_data['year'] = year
-                season_data['month'] = month
-                season_data['n_divisions'] = len(divisions)
-                n_players = sum([len(n) for n in divisions.values()])
-                season_data['n_players'] = n_players
-                season_data['players'] = [n for ns in divisions.values() for n in ns]
-                season_data['n_matches'] = len(matches)
-                n_expected_matches = sum([len(n)*(len(n)-1)/2 for n in divisions.values()])
-                season_data['completion_rate'] = float(len(matches)) / n_expected_matches
+            error = fetch_errors.pop(site, error)
+            if error is not None: raise error
+            if parsed is None: # Source unchanged since the last run
+                n_unchanged += 1
+                total_played_matches += manifest[season]['n_matches']
+                continue
+
+            with STATS.timer(baseurl % site, 'merge'):
+                divisions, matches = resolve_deferred(parsed, deferred)
+                replace_season(squash_data, season, divisions, matches)
+            changed_seasons.append(season)
+            manifest[season] = {'source_hash': shash,
+                                'parsed': time.time(),
+                                'n_matches': len(matches)}
 
             # Count number of matches
             total_played_matches += len(matches)
@@ -308,30 +626,148 @@ def process_archives(url, verbose=False):
             failed_sites.append(site)
         except AssertionError:       # Some inconsistency after processing the data
             failed_sites.append(site)
-        except urllib2.HTTPError, e: # Something wrong with the url
-            print e
+        except NETWORK_ERRORS, e:   # Something wrong with the url or the server
+            print '%s: %s' % (site, e)
             failed_sites.append(site)
 
+    pool.close()
+    pool.join()
+    if parse_pool is not None:
+        parse_pool.close()
+        parse_pool.join()
+    PAGE_CACHE.save()
+    new_aliases = ALIASES.new_aliases
+    similar_names = ALIASES.similar()
+    n_new_aliases = ALIASES.save()
+
     print 40*'='
     print ('Extracted %d played matches in %d seasons' %
                    (total_played_matches, len(squash_data['seasons'])))
+    if incremental:
+        print '%d seasons unchanged since the last run' % n_unchanged
     print 'Found %d individual players' % len(squash_data['players'])
+    if n_new_aliases:
+        print 'Added %d new names to player_names.txt' % n_new_aliases
+        for key, name, match in new_aliases:
+            if match: print '  %s -> %s (similar to %s)' % (key, name, match)
+    if similar_names:
+        print ('%d new players have a name close to a known one, change their line in '
+               'player_names.txt if they are the same player:' % len(similar_names))
+        for name, other in similar_names:
+            print '  %s (similar to %s)' % (name, other)
+    print ('Page cache: %d pages reused, %d downloaded' %
+                   (PAGE_CACHE.hits, PAGE_CACHE.misses))
     if failed_sites:
         print 'Failed for %d sites:' % len(failed_sites), failed_sites
-    print 40*'='
 
 
     ## Write to json file
-    with open('squash_data.json', 'w') as ofile:
-        json.dump(squash_data, ofile, indent=2, sort_keys=True)
+    with STATS.timer(None, 'write'):
+        write_data(squash_data, 'squash_data.json', compact, compress)
+        write_atomic(MANIFEST, json.dumps(manifest, indent=2, sort_keys=True))
+
+        ## Write the flat match table, from the data as read back from the
+        ## file, so that the order of the matches is the one of calculate_elo
+        MatchTable.from_file('squash_data.json').save(TABLEFILE)
+
+        ## Update the database, also with seasons it doesn't have yet or
+        ## that are no longer in the data
+        if sqlite:
+            db = SquashDB(sqlite)
+            stored = set(db.season_keys())
+            outdated = stored.symmetric_difference(squash_data['seasons'])
+            db.store_seasons(squash_data, set(changed_seasons) | outdated)
+            db.close()
+
+    print STATS.summary()
+    print 40*'='
+
+    if report:
+        name_caches = cache_stats()
+        for name, counts in worker_caches.iteritems():
+            for key, n in counts.iteritems():
+                name_caches[name][key] += n
+        STATS.write(report,
+                    page_cache={'hits': PAGE_CACHE.hits,
+                                'misses': PAGE_CACHE.misses,
+                                'bytes_downloaded': sum(PAGE_CACHE.downloaded.values())},
+                    name_caches=name_caches,
+                    aliases={'known': len(ALIASES), 'new': len(new_aliases),
+                             'fuzzy_matches': sum(1 for _,_,m in new_aliases if m),
+                             'similar': similar_names},
+                    failed_sites=failed_sites)
 
 def main():
     parser = argparse.ArgumentParser(
         description="Crawl the CERN squash club archives and get match data")
     parser.add_argument('-v', '--verbose', help='Verbose mode', action="store_true")
+    parser.add_argument('--url', default=page_cache.SITEURL,
+                        help=('Root of the club web site, or of a mirror of it, '
+                              'e.g. http://localhost:8000/ (see archive_server.py) '
+                              'or file:///path/to/mirror/'))
+    parser.add_argument('-j', '--jobs', help='Number of pages to fetch in parallel',
+                        type=int, default=4)
+    parser.add_argument('-p', '--parse-workers', type=int, default=0,
+                        help='Number of processes to parse pages (0: parse in this process)')
+    parser.add_argument('--retries', help='Number of retries for failed requests',
+                        type=int, default=3)
+    parser.add_argument('--delay', help='Minimum delay (s) between requests to one host',
+                        type=float, default=0.2)
+    parser.add_argument('--offline', help='Only use pages from the page cache',
+                        action="store_true")
+    parser.add_argument('--cached', help="Don't revalidate pages in the page cache",
+                        action="store_true")
+    parser.add_argument('--parser', help='Parser backend for the season pages',
+                        choices=sorted(page_parsers.BACKENDS), default='bs4')
+    parser.add_argument('-i', '--incremental', action="store_true",
+                        help='Update the existing data, only parse changed seasons')
+    parser.add_argument('--fuzzy-names', nargs='?', type=float, const=0.9,
+                        metavar='CUTOFF',
+                        help=('Store unknown player names as aliases of known names '
+                              'with a similarity above CUTOFF (default: 0.9)'))
+    parser.add_argument('--cache-dir', help='Directory of the page cache',
+                        default=page_cache.CACHEDIR)
+    parser.add_argument('--sqlite', nargs='?', const='squash_data.db', metavar='DBFILE',
+                        help='Also store the data in a SQLite database')
+    parser.add_argument('--compact', action="store_true",
+                        help='Write squash_data.json without indentation')
+    parser.add_argument('--gzip', action="store_true",
+                        help='Write squash_data.json gzip-compressed')
+    parser.add_argument('--report', default='crawl_report.json',
+                        help='Write the timings of the crawl to this json file')
+    parser.add_argument('--profile', nargs='?', const='squash_crawl.prof', metavar='FILE',
+                        help='Run under cProfile and dump the statistics to FILE')
     args = parser.parse_args()
 
-    process_archives('http://club-squash.web.cern.ch/club-squash/resultats.html', verbose=args.verbose)
+    global LIMITER, RETRIES, PAGE_CACHE, PARSER, PROFILES
+    PARSER = page_parsers.get_backend(args.parser)
+    LIMITER = HostLimiter(delay=args.delay)
+    RETRIES = args.retries
+    PAGE_CACHE = page_cache.PageCache(args.cache_dir, offline=args.offline,
+                                      revalidate=not args.cached)
+
+    site = args.url if args.url.endswith('/') else args.url + '/'
+    crawl = lambda: process_archives(
+                     urlparse.urljoin(site, 'resultats.html'),
+                     baseurl=urlparse.urljoin(site, 'archives/%s'),
+                     verbose=args.verbose, jobs=args.jobs,
+                     incremental=args.incremental,
+                     fuzzy_cutoff=args.fuzzy_names,
+                     sqlite=args.sqlite, report=args.report,
+                     parse_workers=args.parse_workers,
+                     compact=args.compact, compress=args.gzip)
+    if not args.profile:
+        crawl()
+        return
+
+    PROFILES = []
+    profiler = cProfile.Profile()
+    profiler.runcall(crawl)
+    stats = pstats.Stats(profiler)
+    for worker_profile in PROFILES:
+        stats.add(worker_profile)
+    stats.dump_stats(args.profile)
+    stats.sort_stats('cumulative').print_stats(20)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,292 @@
+#! /usr/bin/env python
+"""
+Optional SQLite store of the squash data, next to squash_data.json.
+
+Seasons are written (or replaced) one at a time in a single transaction,
+so updating a season or the ratings doesn't rewrite the whole data, and
+queries only read the rows they need.
+"""
+import sys
+import sqlite3
+import argparse
+
+from squash_io import SquashData, is_win
+
+DBFILE = 'squash_data.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS players (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    last_elo REAL
+);
+CREATE TABLE IF NOT EXISTS seasons (
+    key TEXT PRIMARY KEY,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    n_divisions INTEGER,
+    n_players INTEGER,
+    n_matches INTEGER,
+    completion_rate REAL
+);
+-- One row per player and season: the division played in, the position
+-- in the division on the page, and the matches played and won
+CREATE TABLE IF NOT EXISTS divisions (
+    season TEXT NOT NULL REFERENCES seasons(key),
+    division INTEGER NOT NULL,
+    player INTEGER NOT NULL REFERENCES players(id),
+    position INTEGER NOT NULL,
+    n_matches INTEGER NOT NULL,
+    n_wins INTEGER NOT NULL,
+    PRIMARY KEY (season, player)
+);
+-- Every match is stored from the point of view of both players, like in
+-- the 'matches' of the players' season data
+CREATE TABLE IF NOT EXISTS matches (
+    season TEXT NOT NULL REFERENCES seasons(key),
+    division INTEGER NOT NULL,
+    player1 INTEGER NOT NULL REFERENCES players(id),
+    player2 INTEGER NOT NULL REFERENCES players(id),
+    result TEXT NOT NULL,
+    PRIMARY KEY (season, player1, player2)
+);
+-- Rating of each player at the end of each season played
+CREATE TABLE IF NOT EXISTS ratings (
+    season TEXT NOT NULL REFERENCES seasons(key),
+    player INTEGER NOT NULL REFERENCES players(id),
+    elo REAL NOT NULL,
+    PRIMARY KEY (season, player)
+);
+CREATE INDEX IF NOT EXISTS divisions_player ON divisions (player);
+CREATE INDEX IF NOT EXISTS divisions_season ON divisions (season, division);
+CREATE INDEX IF NOT EXISTS matches_players ON matches (player1, player2);
+CREATE INDEX IF NOT EXISTS matches_season ON matches (season);
+CREATE INDEX IF NOT EXISTS ratings_player ON ratings (player);
+CREATE INDEX IF NOT EXISTS players_elo ON players (last_elo);
+"""
+
+class SquashDB(object):
+    """
+    Normalized tables of players, seasons, divisions, matches and ratings.
+
+    All writes happen in transactions: a season is either fully replaced
+    or not at all.
+    """
+    def __init__(self, filename=DBFILE):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(SCHEMA)
+        self._load_player_ids()
+
+    def _load_player_ids(self):
+        self._player_ids = dict((name, pid) for pid, name in
+                                self.conn.execute('SELECT id, name FROM players'))
+
+    def close(self):
+        self.conn.close()
+
+    def player_id(self, name):
+        """Id of a player, adding it if needed (inside a transaction)"""
+        pid = self._player_ids.get(name)
+        if pid is None:
+            cursor = self.conn.execute('INSERT INTO players (name) VALUES (?)', (name,))
+            pid = self._player_ids[name] = cursor.lastrowid
+        return pid
+
+    def season_keys(self):
+        return [k for k, in self.conn.execute('SELECT key FROM seasons')]
+
+    def _delete_season(self, season):
+        for table in ['ratings', 'matches', 'divisions']:
+            self.conn.execute('DELETE FROM %s WHERE season = ?' % table, (season,))
+        self.conn.execute('DELETE FROM seasons WHERE key = ?', (season,))
+
+    def _prune_players(self):
+        """Remove players without any season left, and their ratings"""
+        for table, column in [('ratings', 'player'), ('players', 'id')]:
+            self.conn.execute('DELETE FROM %s WHERE %s NOT IN '
+                              '(SELECT DISTINCT player FROM divisions)' % (table, column))
+        self._load_player_ids()
+
+    def store_seasons(self, squash_data, seasons):
+        """
+        Replace the given seasons with their data from the squash data
+        dictionary, in one transaction. Seasons missing from the
+        dictionary are removed.
+        """
+        try:
+            with self.conn:
+                for season in seasons:
+                    self._store_season(squash_data, season)
+                self._prune_players()
+        except sqlite3.Error:
+            # the cached ids may refer to rolled back rows
+            self._prune_players()
+            raise
+
+    def _store_season(self, squash_data, season):
+        self._delete_season(season)
+        sdata = squash_data['seasons'].get(season)
+        if sdata is None: return
+
+        self.conn.execute('INSERT INTO seasons VALUES (?,?,?,?,?,?,?)',
+                          (season, sdata['year'], sdata['month'], sdata['n_divisions'],
+                           sdata['n_players'], sdata['n_matches'],
+                           sdata['completion_rate']))
+        positions = {} # division -> number of players so far
+        division_rows, match_rows = [], []
+        for name in sdata['players']:
+            pdata = squash_data['players'][name]['seasons'][season]
+            div = pdata['division']
+            pid = self.player_id(name)
+            position = positions[div] = positions.get(div, -1) + 1
+            division_rows.append((season, div, pid, position,
+                                  len(pdata['matches']), pdata['n_wins']))
+            for name2, result in pdata['matches'].iteritems():
+                match_rows.append((season, div, pid, self.player_id(name2), result))
+        self.conn.executemany('INSERT INTO divisions VALUES (?,?,?,?,?,?)', division_rows)
+        self.conn.executemany('INSERT INTO matches VALUES (?,?,?,?,?)', match_rows)
+
+    def store_ratings(self, table, result, first_season=0):
+        """
+        Store the output of calculate_elo.run_elo for a match table: the
+        ratings at the end of each season from `first_season` on (earlier
+        ones are unchanged when resuming from a checkpoint), and the
+        current rating of all players.
+
+        Players not in the database yet (e.g. when it was written from an
+        older data file) are added, and seasons it doesn't have are skipped.
+        """
+        names = table.player_names.tolist()
+        seasons = table.season_keys.tolist()
+        stored = set(self.season_keys())
+        try:
+            with self.conn:
+                rows = []
+                for sidx in range(first_season, table.n_seasons):
+                    if not seasons[sidx] in stored: continue
+                    season_ratings = result.season_ratings[sidx].tolist()
+                    for pid in table.season_players(sidx).tolist():
+                        rows.append((seasons[sidx], self.player_id(names[pid]),
+                                     season_ratings[pid]))
+                self.conn.executemany('INSERT OR REPLACE INTO ratings VALUES (?,?,?)', rows)
+                self.conn.executemany('UPDATE players SET last_elo = ? WHERE id = ?',
+                                      [(elo, self.player_id(name)) for name, elo
+                                          in zip(names, result.ratings.tolist())])
+        except sqlite3.Error:
+            # the cached ids may refer to rolled back rows
+            self._load_player_ids()
+            raise
+
+    ## Queries
+    def head_to_head(self, name1, name2):
+        """(season, result) of all matches between two players, by date"""
+        return self.conn.execute(
+            'SELECT m.season, m.result FROM matches m '
+            'JOIN seasons s ON s.key = m.season '
+            'WHERE m.player1 = ? AND m.player2 = ? '
+            'ORDER BY s.year, s.month',
+            (self._player_ids.get(name1), self._player_ids.get(name2))).fetchall()
+
+    def division_table(self, season, division):
+        """
+        (name, matches, wins, elo) of the players in one division of a
+        season, by number of wins
+        """
+        return self.conn.execute(
+            'SELECT p.name, d.n_matches, d.n_wins, r.elo FROM divisions d '
+            'JOIN players p ON p.id = d.player '
+            'LEFT JOIN ratings r ON r.season = d.season AND r.player = d.player '
+            'WHERE d.season = ? AND d.division = ? '
+            'ORDER BY d.n_wins DESC, d.position',
+            (season, division)).fetchall()
+
+    def top_players(self, n=10, min_matches=0):
+        """(name, elo, matches, wins, seasons) of the n highest rated players"""
+        return self.conn.execute(
+            'SELECT p.name, p.last_elo, SUM(d.n_matches), SUM(d.n_wins), COUNT(*) '
+            'FROM players p JOIN divisions d ON d.player = p.id '
+            'GROUP BY p.id HAVING SUM(d.n_matches) >= ? '
+            'ORDER BY p.last_elo DESC LIMIT ?',
+            (min_matches, n)).fetchall()
+
+def import_json(db, filename):
+    """Replace the contents of the database with the data in a json file"""
+    squash_data = SquashData(filename)
+    data = {'seasons': squash_data.seasons(), 'players': dict(squash_data.players())}
+    db.store_seasons(data, set(data['seasons']) | set(db.season_keys()))
+    with db.conn:
+        db.conn.executemany('UPDATE players SET last_elo = ? WHERE id = ?',
+                            [(pdata['last_elo'], db.player_id(name))
+                                 for name, pdata in data['players'].iteritems()
+                                 if 'last_elo' in pdata])
+        db.conn.executemany('INSERT INTO ratings VALUES (?,?,?)',
+                            [(season, db.player_id(name), sdata['elo'])
+                                 for name, pdata in data['players'].iteritems()
+                                 for season, sdata in pdata['seasons'].iteritems()
+                                 if 'elo' in sdata])
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the squash database")
+    parser.add_argument('--db', help='Database file', default=DBFILE)
+    subparsers = parser.add_subparsers(dest='command')
+    p_import = subparsers.add_parser('import', help='Import squash_data.json')
+    p_import.add_argument('input', nargs='?', default='squash_data.json')
+    p_h2h = subparsers.add_parser('h2h', help='Head-to-head record of two players')
+    p_h2h.add_argument('players', nargs=2)
+    p_div = subparsers.add_parser('division', help='Table of one division')
+    p_div.add_argument('season')
+    p_div.add_argument('division', type=int)
+    p_top = subparsers.add_parser('top', help='Highest rated players')
+    p_top.add_argument('n', nargs='?', type=int, default=20)
+    p_top.add_argument('-m', '--min-matches', type=int, default=0)
+    args = parser.parse_args()
+
+    db = SquashDB(args.db)
+    if args.command == 'import':
+        import_json(db, args.input)
+        print 'Imported %d seasons and %d players' % (len(db.season_keys()),
+                                                      len(db._player_ids))
+
+    elif args.command == 'h2h':
+        from squash_names import AliasStore
+        aliases = AliasStore()
+        name1, name2 = [aliases.lookup(unicode(n, 'utf-8')) for n in args.players]
+        matches = db.head_to_head(name1, name2)
+        if not matches:
+            print 'No matches between %s and %s' % (name1, name2)
+            return 1
+        wins = sum(1 for _,result in matches if is_win(result))
+        print '%s vs. %s: %d matches, %d-%d' % (name1, name2, len(matches),
+                                                 wins, len(matches)-wins)
+        for season, result in matches:
+            print '  %-12s %s' % (season, result)
+
+    elif args.command == 'division':
+        rows = db.division_table(args.season, args.division)
+        if not rows:
+            print 'No division %d in season %s' % (args.division, args.season)
+            return 1
+        header = 'Player name                    | GP  | Win | Elo    |'
+        print header
+        print len(header)*'-'
+        for name, n_matches, n_wins, elo in rows:
+            print '%-30s | %3d | %3d | %6.1f |' % (name, n_matches, n_wins,
+                                                   elo if elo is not None else 0)
+        print len(header)*'-'
+
+    elif args.command == 'top':
+        header = "Player name                    | Elo    | Tot  | Win  | Seasons |"
+        print header
+        print len(header)*'-'
+        for name, elo, n_matches, n_wins, n_seasons in db.top_players(args.n,
+                                                                      args.min_matches):
+            print '%-30s | %6.1f | %4d | %4d | %7d |' % (name, elo or 0, n_matches,
+                                                        n_wins, n_seasons)
+        print len(header)*'-'
+
+    db.close()
+
+if __name__ == '__main__':
+    sys.exit(main())
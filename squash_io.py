@@ -0,0 +1,287 @@
+#! /usr/bin/env python
+"""
+Lightweight access to squash_data.json, without importing any of the
+crawler dependencies, and an atomic, streaming writer for it.
+"""
+import os
+import re
+import json
+import gzip
+import tempfile
+
+from json.decoder import scanstring
+from operator import itemgetter
+from contextlib import contextmanager
+
+DATAFILE = 'squash_data.json'
+
+@contextmanager
+def atomic_open(filename, sync=True):
+    """
+    File object to write `filename` through a temporary file, which is
+    renamed to `filename` (after syncing it to disk if `sync`) when the
+    block ends without an error, and removed otherwise.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if os.path.exists(filename):
+        mode = os.stat(filename).st_mode & 0777
+    else:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0666 & ~umask
+    fd, tmpname = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as ofile:
+            yield ofile
+            if sync:
+                ofile.flush()
+                os.fsync(ofile.fileno())
+        os.chmod(tmpname, mode)
+        os.rename(tmpname, filename)
+    except:
+        os.remove(tmpname)
+        raise
+
+def write_atomic(filename, content, sync=False):
+    """Write to a temporary file first, then rename it to `filename`"""
+    with atomic_open(filename, sync=sync) as ofile:
+        ofile.write(content)
+
+GZIP_MAGIC = '\x1f\x8b'
+
+def open_data(filename):
+    """Open a data file for reading, whether it is gzip-compressed or not"""
+    with open(filename, 'rb') as ifile:
+        compressed = ifile.read(2) == GZIP_MAGIC
+    if compressed:
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+def load_data(filename=DATAFILE):
+    with open_data(filename) as ifile:
+        return json.load(ifile)
+
+def _json_chunks(sections, compact, offsets):
+    """
+    Chunks of the json object with the given sections, see `write_sections`.
+    The offsets of the entries in the output are added to `offsets`.
+    """
+    indent = None if compact else 2
+    item_separator, key_separator = (',', ':') if compact else (', ', ': ')
+    def newline(level):
+        return '' if compact else '\n' + level*indent*' '
+    def dumps(value, level):
+        text = json.dumps(value, indent=indent, sort_keys=True,
+                          separators=(item_separator, key_separator))
+        return text if compact else text.replace('\n', newline(level))
+
+    position = [0]
+    def chunk(text):
+        position[0] += len(text)
+        return text
+
+    yield chunk('{')
+    for i, (section, entries) in enumerate(sections):
+        section_offsets = offsets[section] = {}
+        yield chunk((item_separator if i else '') + newline(1) +
+                    json.dumps(section) + key_separator + '{')
+        empty = True
+        for key, value in entries:
+            yield chunk(('' if empty else item_separator) + newline(2) +
+                        json.dumps(key) + key_separator)
+            start = position[0]
+            yield chunk(dumps(value, 2))
+            section_offsets[key] = (start, position[0])
+            empty = False
+        yield chunk('}' if empty else newline(1) + '}')
+    yield chunk(newline(0) + '}' if sections else '}')
+
+def write_sections(filename, sections, compact=False, compress=False):
+    """
+    Write a json object of `sections`, a list of (key, entries), with
+    `entries` an iterable of (key, value) sorted by key, one entry at a
+    time to a temporary file, which replaces `filename` at the end.
+
+    The output is the same as `json.dump(..., indent=2, sort_keys=True)`,
+    or without any whitespace if `compact`, and gzip-compressed if
+    `compress`.
+
+    Returns the offsets of the entries of each section, in the
+    uncompressed output (as in the index of `SquashData`).
+    """
+    offsets = {}
+    with atomic_open(filename) as ofile:
+        output = ofile
+        if compress:
+            output = gzip.GzipFile(os.path.basename(filename), 'wb', 6, ofile)
+        for chunk in _json_chunks(sections, compact, offsets):
+            output.write(chunk)
+        if compress:
+            output.close()
+    return offsets
+
+def write_data(squash_data, filename=DATAFILE, compact=False, compress=False):
+    """
+    Write the squash data dictionary with `write_sections`, and the index
+    of the offsets of its players and seasons for `SquashData`.
+    """
+    sections = [(key, sorted(squash_data[key].iteritems()))
+                for key in sorted(squash_data)]
+    offsets = write_sections(filename, sections, compact, compress)
+    SquashData(filename).write_index(offsets)
+
+def sort_seasons(sdata):
+    """Sort seasons by date"""
+    seasons = [(k, v['year'], v['month']) for k,v in sdata.iteritems()]
+    seasons.sort(key=itemgetter(1,2))
+    return seasons
+
+def parse_games(result):
+    """
+    Games won by each player from a result string, -1 if not known.
+    '3-1' -> (3, 1), '3' -> (3, -1), '0' -> (0, -1)
+    """
+    score = re.match(r'(\d{1})-(\d{1})', result)
+    if score:
+        return int(score.group(1)), int(score.group(2))
+    score = re.match(r'^(\d{1})$', result)
+    if score:
+        return int(score.group(1)), -1
+    return -1, -1
+
+def is_win(result):
+    """'3-1' and '3' are wins, '1-3' and '0' are not"""
+    games1, games2 = parse_games(result)
+    return games1 > max(games2, 0)
+
+def format_games(games1, games2):
+    """Inverse of `parse_games`"""
+    if games2 < 0:
+        return '%d' % games1
+    return '%d-%d' % (games1, games2)
+
+_decoder = json.JSONDecoder()
+_whitespace = ' \t\n\r'
+
+def _skip(text, idx):
+    while text[idx] in _whitespace: idx += 1
+    return idx
+
+def _scan_object(text, idx, depth=1):
+    """
+    Return the byte offsets (start, end) of each value of the json object
+    starting at `idx`, and the end of the object. Up to `depth` levels of
+    nested objects are scanned as well, and returned as dictionaries
+    instead of offsets.
+    """
+    offsets = {}
+    idx = _skip(text, idx)
+    assert text[idx] == '{'
+    idx = _skip(text, idx+1)
+    while text[idx] != '}':
+        key, idx = scanstring(text, idx+1)
+        idx = _skip(text, idx)
+        assert text[idx] == ':'
+        start = _skip(text, idx+1)
+        if depth > 0 and text[start] == '{':
+            offsets[key], idx = _scan_object(text, start, depth-1)
+        else:
+            _, idx = _decoder.raw_decode(text, start)
+            offsets[key] = (start, idx)
+        idx = _skip(text, idx)
+        if text[idx] == ',':
+            idx = _skip(text, idx+1)
+    return offsets, idx+1
+
+class SquashData(object):
+    """
+    Read-only access to the squash data file that only decodes the parts
+    that are asked for.
+
+    The byte offsets of each player and season in the file are stored in
+    a sidecar index file ('squash_data.json.idx'), which is rebuilt when
+    the data file changes.
+    """
+    def __init__(self, filename=DATAFILE):
+        self.filename = filename
+        self._index = None
+        self._seasons = None
+
+    def stamp(self):
+        stat = os.stat(self.filename)
+        return [stat.st_mtime, stat.st_size]
+
+    @property
+    def index(self):
+        if self._index is None:
+            index_file = self.filename + '.idx'
+            try:
+                with open(index_file, 'r') as ifile:
+                    index = json.load(ifile)
+                if index['stamp'] == self.stamp():
+                    self._index = index
+            except (IOError, ValueError, KeyError):
+                pass
+            if self._index is None:
+                self.write_index(self.build_index())
+        return self._index
+
+    def build_index(self):
+        with open_data(self.filename) as ifile:
+            offsets, _ = _scan_object(ifile.read(), 0)
+        return offsets
+
+    def write_index(self, offsets):
+        """
+        Store the offsets of the players and seasons in the data file (from
+        `build_index`, or as returned by `write_sections`) in the index file.
+        """
+        self._index = {'stamp': self.stamp(),
+                       'players': offsets.get('players', {}),
+                       'seasons': offsets.get('seasons', {})}
+        try:
+            write_atomic(self.filename + '.idx', json.dumps(self._index))
+        except (IOError, OSError):
+            pass
+
+    def _read(self, start, end):
+        with open_data(self.filename) as ifile:
+            ifile.seek(start)
+            return json.loads(ifile.read(end-start))
+
+    def player_names(self):
+        return self.index['players'].keys()
+
+    def season_keys(self):
+        return self.index['seasons'].keys()
+
+    def player(self, name):
+        """Data of one player, or None"""
+        offsets = self.index['players'].get(name)
+        if offsets is None: return None
+        return self._read(*offsets)
+
+    def players(self):
+        """Iterate over (name, data) of all players, decoding one at a time"""
+        by_offset = sorted(self.index['players'].iteritems(), key=itemgetter(1))
+        with open_data(self.filename) as ifile:
+            for name, (start, end) in by_offset:
+                ifile.seek(start)
+                yield name, json.loads(ifile.read(end-start))
+
+    def season(self, key):
+        """Data of one season, or None"""
+        offsets = self.index['seasons'].get(key)
+        if offsets is None: return None
+        return self._read(*offsets)
+
+    def seasons(self):
+        """Dictionary of all seasons"""
+        if self._seasons is None:
+            self._seasons = {}
+            by_offset = sorted(self.index['seasons'].iteritems(), key=itemgetter(1))
+            with open_data(self.filename) as ifile:
+                for key, (start, end) in by_offset:
+                    ifile.seek(start)
+                    self._seasons[key] = json.loads(ifile.read(end-start))
+        return self._seasons
@@ -0,0 +1,406 @@
+#! /usr/bin/env python
+"""
+Compact in-memory model of the squash data. Players and seasons are
+objects with __slots__, player names are interned as integer ids, and
+each match is stored once, in the arrays of its season, instead of
+twice in dictionaries keyed by the opponent's name.
+
+    model = SquashModel.load()
+    player = model.player(u'John Doe')
+    for key, pseason in player.seasons.iteritems():
+        for opponent, code in pseason.results():
+            print key, model.names[opponent], model.results.strings[code]
+
+`save` writes the same json as the crawler.
+"""
+import sys
+import argparse
+
+from array import array
+
+from squash_io import (SquashData, DATAFILE, write_sections, sort_seasons,
+                       parse_games, format_games, is_win)
+
+class Results(object):
+    """
+    Vocabulary of result strings ('3-1', '0', ...): each distinct result
+    gets a small integer code, and its games and whether it is a win are
+    worked out once per code.
+    """
+    def __init__(self):
+        self.strings = [] # code -> result string
+        self.codes = {} # result string -> code
+        self.games = [] # code -> (games1, games2), see `parse_games`
+        self.wins = [] # code -> whether it is a win
+
+    def __len__(self):
+        return len(self.strings)
+
+    def code(self, result):
+        code = self.codes.get(result)
+        if code is None:
+            code = self.codes[result] = len(self.strings)
+            self.strings.append(result)
+            self.games.append(parse_games(result))
+            self.wins.append(is_win(result))
+        return code
+
+    def inverse(self, code):
+        """Code of the same result from the other player's side"""
+        games1, games2 = self.games[code]
+        if games2 < 0:
+            return self.code('0' if games1 > 0 else '3')
+        return self.code(format_games(games2, games1))
+
+class Season(object):
+    """
+    One season, with its roster (`players`, player ids in the order of the
+    league table) and its matches: match i was played by `player1[i]` and
+    `player2[i]` in division `division[i]`, with result codes `result1[i]`
+    and `result2[i]` from the side of each player.
+    """
+    __slots__ = ['index', 'key', 'year', 'month', 'n_divisions', 'n_players',
+                 'n_matches', 'completion_rate', 'players',
+                 'player1', 'player2', 'division', 'result1', 'result2']
+
+    def __init__(self, index, key, sdata):
+        self.index = index
+        self.key = key
+        self.year = sdata['year']
+        self.month = sdata['month']
+        self.n_divisions = sdata['n_divisions']
+        self.n_players = sdata['n_players']
+        self.n_matches = sdata['n_matches']
+        self.completion_rate = sdata['completion_rate']
+        self.players = array('i')
+        self.player1 = array('i')
+        self.player2 = array('i')
+        self.division = array('b')
+        self.result1 = array('B')
+        self.result2 = array('B')
+
+    def __len__(self):
+        return len(self.player1)
+
+class DataRecord(object):
+    """
+    Base of the records of the data with fixed `FIELDS`, which are slots,
+    and other fields (e.g. the ratings of other rating engines) in `extra`.
+    """
+    __slots__ = ['extra']
+    FIELDS = ()
+
+    def _set_extra(self, data):
+        self.extra = dict((k, v) for k, v in data.iteritems()
+                          if k not in self.FIELDS) or None
+
+    def get(self, key, default=None):
+        """Value of a field, whether it is a slot or in `extra`"""
+        if key in self.__slots__:
+            value = getattr(self, key)
+        else:
+            value = (self.extra or {}).get(key)
+        return default if value is None else value
+
+    def set(self, key, value):
+        if key in self.__slots__:
+            setattr(self, key, value)
+        else:
+            if self.extra is None: self.extra = {}
+            self.extra[key] = value
+
+class PlayerSeason(DataRecord):
+    """
+    One season of a player. `matches` are the indices of the player's
+    matches in the arrays of the `season` (None for seasons without any
+    played matches, which are not in the season list).
+    """
+    __slots__ = ['player', 'key', 'season', 'division', 'n_wins', 'elo', 'matches']
+    FIELDS = ('division', 'n_wins', 'elo', 'matches')
+
+    def __init__(self, player, key, season, pdata):
+        self.player = player
+        self.key = key
+        self.season = season
+        self.division = pdata['division']
+        self.n_wins = pdata['n_wins']
+        self.elo = pdata.get('elo')
+        self.matches = array('i')
+        self._set_extra(pdata)
+
+    def __len__(self):
+        return len(self.matches)
+
+    def results(self):
+        """Yield (opponent id, result code) of each match, from the player's side"""
+        season = self.season
+        for i in self.matches:
+            if season.player1[i] == self.player:
+                yield season.player2[i], season.result1[i]
+            else:
+                yield season.player1[i], season.result2[i]
+
+class Player(DataRecord):
+    """
+    A player and the totals over all seasons. `seasons` maps the season
+    keys to `PlayerSeason`s.
+    """
+    __slots__ = ['id', 'name', 'seasons', 'last_elo',
+                 'n_seasons_played', 'n_total_matches', 'n_total_wins']
+    FIELDS = ('seasons', 'last_elo', 'n_seasons_played', 'n_total_matches', 'n_total_wins')
+
+    def __init__(self, pid, name, pdata):
+        self.id = pid
+        self.name = name
+        self.seasons = {}
+        self.last_elo = pdata.get('last_elo')
+        self.n_seasons_played = pdata['n_seasons_played']
+        self.n_total_matches = pdata['n_total_matches']
+        self.n_total_wins = pdata['n_total_wins']
+        self._set_extra(pdata)
+
+class SquashModel(object):
+    """
+    All players and seasons. `names[pid]` and `players[pid]` are the name
+    and `Player` of each player id, `seasons` are sorted by date.
+
+    Player ids are given in order of appearance in the seasons, as in the
+    `MatchTable`. When only some players are loaded, the others only have
+    an id and a name, and `players[pid]` is None.
+    """
+    def __init__(self):
+        self.names = []
+        self.ids = {} # name -> player id
+        self.players = []
+        self.seasons = []
+        self.season_ids = {} # key -> index in seasons
+        self.results = Results()
+
+    def intern(self, name):
+        """Id of a player name, adding it if it is new"""
+        pid = self.ids.get(name)
+        if pid is None:
+            pid = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.players.append(None)
+        return pid
+
+    def player(self, name):
+        pid = self.ids.get(name)
+        return self.players[pid] if pid is not None else None
+
+    def season(self, key):
+        sidx = self.season_ids.get(key)
+        return self.seasons[sidx] if sidx is not None else None
+
+    @classmethod
+    def build(cls, seasons, players):
+        """
+        Build the model from the seasons of the squash data (a dictionary
+        of key -> season data) and an iterable of (name, player data),
+        which may only have some of the players.
+
+        Each player is turned into records as it comes, with its matches
+        kept as small arrays of name numbers and result codes until all
+        players are read, so the player data can be decoded one player at
+        a time. The matches of each season are then put in the same order
+        as in `MatchTable.build`, which is the order of the Elo calculation.
+        """
+        model = cls()
+        results = model.results
+        # Names numbered in the order they are read, until the ids are known
+        numbers, read_names = {}, []
+        def number(name):
+            num = numbers.get(name)
+            if num is None:
+                num = numbers[name] = len(read_names)
+                read_names.append(name)
+            return num
+
+        read_players = []
+        pending = {} # (name number, season key) -> opponent numbers, result codes, division
+        for name, pdata in players:
+            player = Player(None, name, pdata)
+            num = number(name)
+            pseasons = []
+            for key, pseason in pdata['seasons'].iteritems():
+                pseasons.append(PlayerSeason(None, key, None, pseason))
+                opponents, codes = array('i'), array('B')
+                for name2, result in pseason['matches'].iteritems():
+                    opponents.append(number(name2))
+                    codes.append(results.code(result))
+                pending[num, key] = opponents, codes, pseason['division']
+            read_players.append((player, pseasons))
+
+        no_matches = ((), (), None)
+        for sidx, (key, _, _) in enumerate(sort_seasons(seasons)):
+            sdata = seasons[key]
+            season = Season(sidx, key, sdata)
+            model.seasons.append(season)
+            model.season_ids[key] = sidx
+            counted_matches = set()
+            for name in sdata['players']:
+                pid = model.intern(name)
+                season.players.append(pid)
+                num = numbers.get(name)
+                if (num, key) not in pending: continue
+                opponents, codes, division = pending[num, key]
+                for num2, code in zip(opponents, codes):
+                    # Avoid double counting
+                    if ((num, num2) in counted_matches or
+                        (num2, num) in counted_matches): continue
+                    counted_matches.add((num, num2))
+                    opponents2, codes2, _ = pending.get((num2, key), no_matches)
+                    season.player1.append(pid)
+                    season.player2.append(model.intern(read_names[num2]))
+                    season.division.append(division)
+                    season.result1.append(code)
+                    season.result2.append(codes2[opponents2.index(num)] if num in opponents2
+                                          else results.inverse(code))
+
+        for player, pseasons in read_players:
+            pid = player.id = model.intern(player.name)
+            model.players[pid] = player
+            for pseason in pseasons:
+                season = model.season(pseason.key)
+                if season is not None: pseason.key = season.key # share the strings
+                pseason.player, pseason.season = pid, season
+                player.seasons[pseason.key] = pseason
+
+        for season in model.seasons:
+            for i, (pid1, pid2) in enumerate(zip(season.player1, season.player2)):
+                for pid in (pid1, pid2):
+                    player = model.players[pid]
+                    if player is not None and season.key in player.seasons:
+                        player.seasons[season.key].matches.append(i)
+        return model
+
+    @classmethod
+    def from_dict(cls, squash_data):
+        return cls.build(squash_data['seasons'], squash_data['players'].iteritems())
+
+    @classmethod
+    def load(cls, filename=DATAFILE, players=None):
+        """
+        Load the model from a squash data file, optionally only with the
+        data of the given player names. The players are decoded one at a
+        time through `SquashData`, never as one dictionary of all players.
+        """
+        squash_data = SquashData(filename)
+        if players is None:
+            return cls.build(squash_data.seasons(), squash_data.players())
+
+        pdata = []
+        for name in players:
+            data = squash_data.player(name)
+            if data is not None: pdata.append((name, data))
+        return cls.build(squash_data.seasons(), pdata)
+
+    def season_data(self, season):
+        """Data of a season as in the squash data dictionary"""
+        return {'year': season.year,
+                'month': season.month,
+                'n_divisions': season.n_divisions,
+                'n_players': season.n_players,
+                'players': [self.names[pid] for pid in season.players],
+                'n_matches': season.n_matches,
+                'completion_rate': season.completion_rate}
+
+    def player_data(self, player):
+        """Data of a player as in the squash data dictionary"""
+        names, strings = self.names, self.results.strings
+        pdata = {'n_seasons_played': player.n_seasons_played,
+                 'n_total_matches': player.n_total_matches,
+                 'n_total_wins': player.n_total_wins,
+                 'seasons': {}}
+        if player.last_elo is not None:
+            pdata['last_elo'] = player.last_elo
+        pdata.update(player.extra or {})
+        for key, pseason in player.seasons.iteritems():
+            sdata = pdata['seasons'][key] = {
+                'division': pseason.division,
+                'n_wins': pseason.n_wins,
+                'matches': dict((names[opponent], strings[code])
+                                for opponent, code in pseason.results())}
+            if pseason.elo is not None:
+                sdata['elo'] = pseason.elo
+            sdata.update(pseason.extra or {})
+        return pdata
+
+    def to_dict(self):
+        """The squash data dictionary, as written by the crawler"""
+        return {'players': dict((p.name, self.player_data(p))
+                                for p in self.players if p is not None),
+                'seasons': dict((s.key, self.season_data(s)) for s in self.seasons)}
+
+    def save(self, filename=DATAFILE, compact=False, compress=False):
+        """
+        Write the data file (see `squash_io.write_sections`), converting one
+        player or season at a time, and its index for `SquashData`.
+        """
+        players = sorted((p for p in self.players if p is not None),
+                         key=lambda p: p.name)
+        seasons = sorted(self.seasons, key=lambda s: s.key)
+        offsets = write_sections(filename,
+                                 [('players', ((p.name, self.player_data(p)) for p in players)),
+                                  ('seasons', ((s.key, self.season_data(s)) for s in seasons))],
+                                 compact, compress)
+        SquashData(filename).write_index(offsets)
+
+    def match_table(self):
+        """The `MatchTable` of all matches, the same as `MatchTable.build`"""
+        # Not at module level, the print tools use the model without numpy
+        import numpy as np
+        from match_table import MatchTable, COLUMNS
+        n_players = 1 + max([-1] + [max(s.players) for s in self.seasons if s.players])
+        games = np.array(self.results.games or [(-1, -1)], dtype=np.int8)
+        columns = dict((c, []) for c in COLUMNS)
+        roster_offsets, roster_players, season_offsets = [0], [], [0]
+        for season in self.seasons:
+            n = len(season)
+            result1 = np.array(season.result1, dtype=np.intp)
+            columns['season'].append(np.full(n, season.index, dtype=np.int16))
+            columns['date'].append(np.full(n, 100*season.year + season.month, dtype=np.int32))
+            columns['division'].append(np.array(season.division, dtype=np.int8))
+            columns['player1'].append(np.array(season.player1, dtype=np.int32))
+            columns['player2'].append(np.array(season.player2, dtype=np.int32))
+            columns['games1'].append(games[result1, 0])
+            columns['games2'].append(games[result1, 1])
+            roster_players.extend(season.players)
+            roster_offsets.append(len(roster_players))
+            season_offsets.append(season_offsets[-1] + n)
+
+        dtypes = {'season': np.int16, 'date': np.int32, 'division': np.int8,
+                  'player1': np.int32, 'player2': np.int32,
+                  'games1': np.int8, 'games2': np.int8}
+        arrays = dict((c, np.concatenate(columns[c]).astype(dtypes[c]) if columns[c]
+                          else np.array([], dtype=dtypes[c])) for c in COLUMNS)
+        arrays['player_names'] = np.array(self.names[:n_players], dtype=np.unicode_)
+        arrays['season_keys'] = np.array([s.key for s in self.seasons], dtype=np.unicode_)
+        arrays['season_year'] = np.array([s.year for s in self.seasons], dtype=np.int16)
+        arrays['season_month'] = np.array([s.month for s in self.seasons], dtype=np.int8)
+        arrays['season_offsets'] = np.array(season_offsets, dtype=np.int32)
+        arrays['roster_offsets'] = np.array(roster_offsets, dtype=np.int32)
+        arrays['roster_players'] = np.array(roster_players, dtype=np.int32)
+        return MatchTable(arrays)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load the squash data into the compact model and check it")
+    parser.add_argument('-i', '--input', help='Input json file', default=DATAFILE)
+    parser.add_argument('-o', '--output', help='Write the model back to this json file')
+    parser.add_argument('--compact', action="store_true", help='Write the json without indentation')
+    parser.add_argument('--gzip', action="store_true", help='Write the json gzip-compressed')
+    args = parser.parse_args()
+
+    model = SquashModel.load(args.input)
+    n_matches = sum(len(s) for s in model.seasons)
+    print ('%d players, %d seasons, %d matches, %d distinct results' %
+              (sum(1 for p in model.players if p is not None), len(model.seasons),
+               n_matches, len(model.results)))
+    if args.output:
+        model.save(args.output, compact=args.compact, compress=args.gzip)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,297 @@
+#! /usr/bin/env python
+import os
+import re
+import marshal
+import difflib
+import threading
+import unicodedata
+
+from collections import OrderedDict, defaultdict
+
+from squash_io import write_atomic
+
+class LRUCache(object):
+    """
+    Dictionary with a maximum size, dropping the least recently used
+    entries first. Counts the hits and misses of `get`.
+    """
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value # move to the end
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._data), 'maxsize': self.maxsize}
+
+_missing = object()
+def memoize(maxsize=10000):
+    """
+    Decorator to remember the output of a function of one argument.
+    The cache is available as the `cache` attribute of the function.
+    """
+    def decorator(func):
+        cache = LRUCache(maxsize)
+        def memoized_func(text):
+            value = cache.get(text, _missing)
+            if value is _missing:
+                value = func(text)
+                cache.put(text, value)
+            return value
+        memoized_func.cache = cache
+        memoized_func.__name__ = func.__name__
+        memoized_func.__doc__ = func.__doc__
+        return memoized_func
+    return decorator
+
+_NEWLINES = re.compile(r'[\n\r]')
+_HOME = re.compile(r'home')
+_TO_FINISH = re.compile(r'(\s?-?\s?\(?(1st|2nd|3rd|[1-9]{1}th)\s+to\s+finish\)?)')
+_TRAILING_DASH = re.compile(r'\s+-$')
+_TRAILING_OUT = re.compile(r'\s+out$')
+_NUMBERS = re.compile(r'[\#\+0-9\)\(\.]')
+_SPACES = re.compile(r'\s{2,}')
+
+def _to_ascii(text):
+    """Lower case, no line breaks, and unicode characters replaced by ascii ones"""
+    text = _NEWLINES.sub('', text.strip().lower())
+    return unicodedata.normalize('NFKD', text).encode('ASCII', 'ignore')
+
+@memoize()
+def clean_name(text):
+    """
+    Clean the text of a player name field from the league tables,
+    removing annotations like '(1st to finish)', 'out for summer', etc.
+    """
+    text = _to_ascii(text)
+    # Sometimes there's a 'home' in there (from phone numbers, I assume)
+    text = _HOME.sub('', text)
+    # Remove the '1st/2nd/3rd/... to finish'
+    text = _TO_FINISH.sub('', text)
+    # Remove trailing dashes
+    text = _TRAILING_DASH.sub('', text)
+    # Remove trailing 'out's
+    text = _TRAILING_OUT.sub('', text)
+    # Remove #,(,) and numbers
+    text = _NUMBERS.sub('', text)
+    # Replace double spaces by single spaces
+    text = _SPACES.sub(' ', text)
+
+    # Some more custom cleaning
+    text = text.replace('unavailable', '')
+    text = text.replace('out for summer', '')
+    text = text.replace(' ?', '')
+    return text.strip()
+
+@memoize()
+def clean_contact_name(text):
+    """Clean the text of a name field of the club members list"""
+    text = _to_ascii(text)
+    # Remove '#','(',')', and numbers
+    text = _NUMBERS.sub('', text)
+    # Replace double spaces by single spaces
+    text = _SPACES.sub(' ', text)
+    return text.strip().title()
+
+# Similarity of two keys above which they are reported as possibly the
+# same player (see `AliasStore.closest`)
+SIMILAR_CUTOFF = 0.9
+
+def trigrams(key):
+    padded = '  %s ' % key
+    return set(padded[i:i+3] for i in range(len(padded)-2))
+
+class AliasStore(object):
+    """
+    Dictionary of player names: maps the reduced name (lower case, no
+    spaces) of every known spelling to the name under which the player
+    is stored, read from lines of 'key, Name' in a text file.
+
+    The parsed dictionary is kept in a marshal snapshot next to the text
+    file, which is used as long as the text file is not modified.
+    Aliases added during a run are appended to the text file by `save`.
+
+    Unknown keys are new players, unless a `fuzzy_cutoff` is given: then
+    they are stored as an alias of the most similar known key (through a
+    trigram index) if the similarity is above it. This merges players
+    with similar names (e.g. 'Martin' and 'Martina'), so it is off by
+    default; `similar` lists the new names that are close to known ones,
+    to add them to the text file by hand where they are the same player.
+
+    With `defer` set (e.g. in parser processes), unknown keys are not
+    added but collected in `deferred` as (key, name), and `name` is
+    returned as is; they can be resolved later in the main process.
+    """
+    def __init__(self, filename='player_names.txt', fuzzy_cutoff=None):
+        self.filename = filename
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.aliases = {}
+        self.new_aliases = [] # (key, name, matched key or None)
+        self.defer = False
+        self.deferred = [] # (key, name) of unknown keys, if deferring
+        self._index = defaultdict(set) # trigram -> keys
+        self._lock = threading.Lock()
+        self.load()
+
+    def _snapshot_file(self):
+        dirname, basename = os.path.split(self.filename)
+        return os.path.join(dirname, '.%s.cache' % basename)
+
+    def _stamp(self):
+        stat = os.stat(self.filename)
+        return [stat.st_mtime, stat.st_size]
+
+    def load(self):
+        self.aliases = None
+        if not os.path.exists(self.filename):
+            self.aliases = {}
+            return
+        try:
+            with open(self._snapshot_file(), 'rb') as ifile:
+                stamp, aliases = marshal.load(ifile)
+            if stamp == self._stamp():
+                self.aliases = aliases
+        except (IOError, EOFError, ValueError, TypeError):
+            pass
+
+        if self.aliases is None:
+            self.aliases = {}
+            with open(self.filename, 'r') as ifile:
+                for line in ifile:
+                    if not len(line.strip()): continue
+                    key,value = tuple(line.strip().split(',', 1))
+                    self.aliases[key] = value.strip()
+            self._write_snapshot()
+
+        self._index.clear()
+        for key in self.aliases:
+            for trigram in trigrams(key):
+                self._index[trigram].add(key)
+
+    def _write_snapshot(self):
+        try:
+            write_atomic(self._snapshot_file(),
+                         marshal.dumps([self._stamp(), self.aliases]))
+        except (IOError, OSError):
+            pass
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def closest(self, key, n_candidates=5, cutoff=None):
+        """
+        Most similar other known key, or None if below the cutoff (by
+        default `fuzzy_cutoff`, or `SIMILAR_CUTOFF` if that is not set)
+        """
+        if cutoff is None:
+            cutoff = self.fuzzy_cutoff if self.fuzzy_cutoff is not None else SIMILAR_CUTOFF
+        shared = defaultdict(int)
+        for trigram in trigrams(key):
+            for other in self._index.get(trigram, ()):
+                shared[other] += 1
+        shared.pop(key, None)
+        candidates = sorted(shared, key=shared.get, reverse=True)[:n_candidates]
+        best, best_ratio = None, cutoff
+        for other in candidates:
+            ratio = difflib.SequenceMatcher(None, key, other).ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = other, ratio
+        return best
+
+    def resolve(self, key, name):
+        """
+        Return the stored name for a key. Unknown keys are added as a new
+        alias, either of the closest known key, or of `name`.
+        """
+        stored = self.aliases.get(key)
+        if stored is not None: return stored
+        if self.defer:
+            self.deferred.append((key, name))
+            return name
+
+        with self._lock:
+            if key in self.aliases: return self.aliases[key]
+            match = None
+            if len(key) and self.fuzzy_cutoff is not None:
+                match = self.closest(key)
+            if match:
+                name = self.aliases[match]
+            self.aliases[key] = name
+            self.new_aliases.append((key, name, match))
+            for trigram in trigrams(key):
+                self._index[trigram].add(key)
+            return name
+
+    def lookup(self, text):
+        """
+        Stored name for the text of a player name field (or the closest
+        known one), without adding it to the dictionary.
+        """
+        text = clean_name(text)
+        key = text.replace(' ', '')
+        stored = self.aliases.get(key)
+        if stored is None and len(key):
+            match = self.closest(key)
+            if match: stored = self.aliases[match]
+        return stored if stored is not None else text.title()
+
+    def similar(self):
+        """
+        (name, similar known name) of the new aliases that are not an
+        alias of a known key, but close to one with a different name
+        """
+        pairs = []
+        for key, name, match in self.new_aliases:
+            if match or not len(key): continue
+            other = self.closest(key)
+            if other is not None and name != self.aliases[other]:
+                pairs.append((name, self.aliases[other]))
+        return pairs
+
+    def save(self):
+        """Append the new aliases to the text file"""
+        with self._lock:
+            new_lines = ['%s, %s' % (key, name) for key,name,_ in self.new_aliases
+                                                  if len(key)]
+            if not new_lines: return 0
+            content = ''
+            if os.path.exists(self.filename):
+                with open(self.filename, 'r') as ifile:
+                    content = ifile.read()
+            if len(content) and not content.endswith('\n'):
+                content += '\n'
+            content += '\n'.join(new_lines)
+            write_atomic(self.filename, content)
+            self._write_snapshot()
+            self.new_aliases = []
+            return len(new_lines)
+
+def cache_stats():
+    """Hits and misses of the name cleaning caches"""
+    return {'clean_name': clean_name.cache.info(),
+            'clean_contact_name': clean_contact_name.cache.info()}
@@ -0,0 +1,242 @@
+#! /usr/bin/env python
+"""
+Precomputed indexes of the squash data, for head-to-head records and
+leaderboards, built once from squash_data.json and cached next to it.
+"""
+import abc
+import heapq
+import cPickle as pickle
+
+from collections import namedtuple
+
+from squash_io import SquashData, DATAFILE, sort_seasons, parse_games, write_atomic
+from squash_model import SquashModel
+from rating_engines import ENGINES
+
+# Record of one player against one opponent
+Record = namedtuple('Record', ['played', 'won', 'lost', 'games_won', 'games_lost'])
+
+def add_record(record, result):
+    """Add one result (from the player's point of view) to a Record"""
+    games1, games2 = parse_games(result)
+    won = games1 > max(games2, 0)
+    return Record(record.played+1, record.won+won, record.lost+(not won),
+                  record.games_won+max(games1, 0), record.games_lost+max(games2, 0))
+
+EMPTYRECORD = Record(0, 0, 0, 0, 0)
+
+class CachedIndex(object):
+    """
+    Base class of indexes that are built from a data file and pickled
+    next to it (with the file name + `SUFFIX`). Subclasses implement
+    `build` as a classmethod and increase `VERSION` when their contents
+    change.
+    """
+    __metaclass__ = abc.ABCMeta
+
+    VERSION = 1
+    SUFFIX = None
+
+    stamp = None
+
+    @abc.abstractmethod
+    def build(cls, squash_data):
+        """Build the index from a SquashData object"""
+
+    @classmethod
+    def cache_file(cls, filename):
+        return filename + cls.SUFFIX
+
+    @classmethod
+    def load(cls, filename=DATAFILE):
+        """
+        Return the index of a data file, from the cache next to it if it is
+        still up to date, or build it and update the cache.
+        """
+        squash_data = SquashData(filename)
+        stamp = squash_data.stamp()
+        try:
+            with open(cls.cache_file(filename), 'rb') as ifile:
+                version, index = pickle.load(ifile)
+            if version == cls.VERSION and index.stamp == stamp:
+                return index
+        except (IOError, EOFError, ValueError, AttributeError, pickle.UnpicklingError):
+            pass
+
+        index = cls.build(squash_data)
+        index.stamp = stamp
+        try:
+            write_atomic(cls.cache_file(filename),
+                         pickle.dumps((cls.VERSION, index), pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            pass
+        return index
+
+class H2HIndex(CachedIndex):
+    """
+    Inverted index of all matches:
+     - `matches[name1][name2]`: list of (season, result) of all matches
+       between two players, by date, with results from name1's side
+     - `records[name1][name2]`: aggregated Record of name1 against name2
+
+    Use `H2HIndex.load()` to get the index of the data file, which is
+    only built when the data changed since it was last cached.
+    """
+    SUFFIX = '.h2h'
+
+    def __init__(self, matches, records, seasons):
+        self.matches = matches
+        self.records = records
+        self.seasons = seasons # season keys by date
+
+    @classmethod
+    def build(cls, squash_data):
+        """Build the index from a SquashData object"""
+        seasons = [s for s,_,_ in sort_seasons(squash_data.seasons())]
+        season_order = dict((s, i) for i,s in enumerate(seasons))
+        matches, records = {}, {}
+        for name, pdata in squash_data.players():
+            pmatches = matches[name] = {}
+            precords = records[name] = {}
+            for season in sorted(pdata['seasons'], key=lambda s: season_order.get(s, -1)):
+                for name2, result in pdata['seasons'][season]['matches'].iteritems():
+                    pmatches.setdefault(name2, []).append((season, result))
+                    precords[name2] = add_record(precords.get(name2, EMPTYRECORD), result)
+        return cls(matches, records, seasons)
+
+    def __contains__(self, name):
+        return name in self.matches
+
+    def head_to_head(self, name1, name2):
+        """(season, result) of all matches between two players, by date"""
+        return self.matches.get(name1, {}).get(name2, [])
+
+    def record(self, name1, name2):
+        """Record of name1 against name2"""
+        return self.records.get(name1, {}).get(name2, EMPTYRECORD)
+
+    def opponents(self, name):
+        """Dictionary of opponent -> Record of a player"""
+        return self.records.get(name, {})
+
+    def most(self, name, field='won', n=None):
+        """
+        Opponents of a player with the highest value of a Record field,
+        e.g. most('X', 'won') for the players X has beaten most.
+        Returns a list of (opponent, Record).
+        """
+        ranked = sorted(self.opponents(name).iteritems(),
+                        key=lambda x: (-getattr(x[1], field), x[0]))
+        return ranked[:n]
+
+# Summary of one season of a player. `season` is the index of the season
+# by date, or None for seasons without any played matches, and `ratings`
+# the rating of each rating engine at the end of the season.
+SeasonSummary = namedtuple('SeasonSummary', ['season', 'division', 'played', 'won',
+                                             'games_won', 'games_lost', 'ratings'])
+
+# One line of the leaderboard, `elo` is the rating of the chosen engine
+Standing = namedtuple('Standing', ['name', 'elo', 'played', 'won', 'winrate',
+                                   'games_diff', 'seasons'])
+
+RANKINGS = {'elo': lambda s: s.elo,
+            'winrate': lambda s: s.winrate,
+            'games': lambda s: s.games_diff,
+            'seasons': lambda s: s.seasons}
+
+class PlayerSummaries(CachedIndex):
+    """
+    Per-season summaries of all players, from which leaderboards over any
+    range of seasons are computed without reading the data again:
+     - `players[name]`: list of SeasonSummary, by date
+     - `last_ratings[name]`: current rating of each player, by engine
+       (see `rating_engines.py`)
+    """
+    VERSION = 2
+    SUFFIX = '.summary'
+
+    def __init__(self, players, last_ratings, seasons):
+        self.players = players
+        self.last_ratings = last_ratings
+        self.seasons = seasons # season keys by date
+
+    @classmethod
+    def build(cls, squash_data):
+        """Build the summaries from the `SquashModel` of a SquashData file"""
+        model = SquashModel.load(squash_data.filename)
+        games = model.results.games
+        players, last_ratings = {}, {}
+        # By name, as in the file, so that ties keep the same order
+        players_by_name = sorted((p for p in model.players if p is not None),
+                                 key=lambda p: p.name)
+        for player in players_by_name:
+            summaries = []
+            for pseason in player.seasons.itervalues():
+                games_won, games_lost = 0, 0
+                for _, code in pseason.results():
+                    games1, games2 = games[code]
+                    games_won += max(games1, 0)
+                    games_lost += max(games2, 0)
+                season = pseason.season.index if pseason.season is not None else None
+                ratings = dict((name, pseason.get(engine.SEASON_KEY))
+                               for name, engine in ENGINES.iteritems())
+                summaries.append(SeasonSummary(season, pseason.division,
+                                               len(pseason), pseason.n_wins,
+                                               games_won, games_lost, ratings))
+            summaries.sort(key=lambda s: -1 if s.season is None else s.season)
+            players[player.name] = summaries
+            last_ratings[player.name] = dict((name, player.get(engine.LAST_KEY))
+                                             for name, engine in ENGINES.iteritems())
+        return cls(players, last_ratings, [s.key for s in model.seasons])
+
+    def season_index(self, season):
+        try:
+            return self.seasons.index(season)
+        except ValueError:
+            raise KeyError('Unknown season %s' % season)
+
+    def standings(self, first=None, last=None, division=None, active=None,
+                  min_matches=0, engine='elo'):
+        """
+        Yield the Standing of each player over the seasons from `first`
+        to `last` (season keys, inclusive), counting only the seasons
+        played in `division` if given, for players that played in the
+        `active` season and at least `min_matches` matches.
+
+        The rating of a player (of the rating `engine`) is the current one,
+        or the one at the end of the last counted season when a season
+        range or division is given.
+        """
+        lo = self.season_index(first) if first else None
+        hi = self.season_index(last) if last else None
+        active = self.season_index(active) if active else None
+        filtered = lo is not None or hi is not None or division is not None
+
+        for name, summaries in self.players.iteritems():
+            if active is not None and not any(s.season == active for s in summaries):
+                continue
+            if filtered:
+                summaries = [s for s in summaries if s.season is not None and
+                                 (lo is None or s.season >= lo) and
+                                 (hi is None or s.season <= hi) and
+                                 (division is None or s.division == division)]
+            played = sum(s.played for s in summaries)
+            if not played or played < min_matches: continue
+            won = sum(s.won for s in summaries)
+            games_diff = sum(s.games_won-s.games_lost for s in summaries)
+            elo = self.last_ratings[name].get(engine)
+            if filtered:
+                elo = summaries[-1].ratings.get(engine)
+            yield Standing(name, elo, played, won, float(won)/played,
+                           games_diff, len(summaries))
+
+    def leaderboard(self, rank='elo', n=None, **filters):
+        """
+        The `n` best Standings by `rank` (one of RANKINGS), or all of them
+        sorted if n is None. The keyword arguments go to `standings`.
+        """
+        key = RANKINGS[rank]
+        standings = self.standings(**filters)
+        if n is not None:
+            return heapq.nlargest(n, standings, key=key)
+        return sorted(standings, key=key, reverse=True)
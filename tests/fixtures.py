@@ -0,0 +1,41 @@
+"""
+Data shared by the tests: the season dates of seasons.txt, and squash
+data of a few seasons with random divisions and results.
+"""
+import os
+import sys
+import random
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import squash_crawl
+
+SEASONS = ['1409', '1410', '1411', '1412-1501', '1502']
+RESULTS = ['3-0', '3-1', '3-2', '2-3', '1-3', '0-3', '3', None]
+
+def load_seasons():
+    """
+    Read the season dates from the seasons.txt of the repository, so that
+    `squash_crawl.get_season` works in any working directory
+    """
+    squash_crawl.SEASONS = None
+    squash_crawl.get_season(SEASONS[0], os.path.join(ROOT, 'seasons.txt'))
+
+def random_data(seed=1, n_players=40):
+    """Squash data of a few seasons with random divisions and results"""
+    load_seasons()
+    rng = random.Random(seed)
+    names = ['Player %s' % (chr(ord('A')+i%26) * (1+i//26)) for i in range(n_players)]
+    squash_data = {'players': {}, 'seasons': {}}
+    for season in SEASONS:
+        pool = rng.sample(names, 24)
+        divisions = dict((d+1, pool[6*d:6*(d+1)]) for d in range(4))
+        matches = {}
+        for players in divisions.itervalues():
+            for i, name1 in enumerate(players):
+                for name2 in players[i+1:]:
+                    result = rng.choice(RESULTS)
+                    if result: matches[(name1, name2)] = result
+        squash_crawl.add_season(squash_data, season, divisions, matches)
+    return squash_data
@@ -0,0 +1,269 @@
+"""
+Concurrent fetching of squash_crawl.py against a local HTTP server:
+retries, the per-host connection limit, sites that keep failing, and the
+same output for any number of parser processes.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+import BaseHTTPServer
+import SocketServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import page_cache
+import squash_crawl
+from squash_names import clean_name
+from match_table import MatchTable
+from fixtures import load_seasons
+
+PLAYERS = ['Anna Meyer', 'Bruno Rossi', 'Carla Dupont', 'David Smith']
+RESULTS = [['X', '3-1', '3-2', '0-3'],
+           ['1-3', 'X', '3', '2-3'],
+           ['2-3', '0', 'X', '3-0'],
+           ['3-0', '3-2', '0-3', 'X']]
+
+def season_page(players=PLAYERS):
+    rows = ['<tr><td colspan="6">Division 1</td></tr>']
+    for i, name in enumerate(players):
+        rows.append('<tr><td>%s</td><td>%s</td>%s</tr>' %
+                    ('ABCD'[i], name, ''.join('<td>%s</td>' % r for r in RESULTS[i])))
+    return '<html><body><table>%s</table></body></html>' % '\n'.join(rows)
+
+class ArchiveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves the pages of `server.pages`. Pages in `server.unavailable` get
+    a 503 response that many times first, pages in `server.slow` are sent
+    after that many seconds, and for pages in `server.broken` the
+    connection is closed without a response.
+    """
+    def do_GET(self):
+        server = self.server
+        path = self.path.lstrip('/')
+        with server.lock:
+            server.requests.append(path)
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        try:
+            if path in server.broken:
+                return
+            time.sleep(server.slow.get(path, 0))
+            with server.lock:
+                unavailable = server.unavailable.get(path, 0)
+                server.unavailable[path] = unavailable - 1
+            if unavailable > 0:
+                self.send_error(503)
+            elif path in server.pages:
+                self.send_response(200)
+                self.end_headers()
+                self.wfile.write(server.pages[path])
+            else:
+                self.send_error(404)
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+class ArchiveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass # clients that timed out
+
+class CrawlTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ArchiveServer(('127.0.0.1', 0), ArchiveHandler)
+        self.server.pages, self.server.requests = {}, []
+        self.server.unavailable, self.server.slow, self.server.broken = {}, {}, set()
+        self.server.lock = threading.Lock()
+        self.server.active = self.server.max_active = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+
+        self.saved = (squash_crawl.LIMITER, squash_crawl.RETRIES,
+                      squash_crawl.PAGE_CACHE, squash_crawl.ALIASES)
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        shutil.copy(os.path.join(ROOT, 'seasons.txt'), self.tmpdir)
+        os.chdir(self.tmpdir)
+        squash_crawl.LIMITER = squash_crawl.HostLimiter(delay=0, timeout=0.5)
+        squash_crawl.PAGE_CACHE = page_cache.PageCache('cache')
+        squash_crawl.ALIASES = None
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+        (squash_crawl.LIMITER, squash_crawl.RETRIES,
+         squash_crawl.PAGE_CACHE, squash_crawl.ALIASES) = self.saved
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_retry(self):
+        self.server.pages['page.html'] = 'content'
+        self.server.unavailable['page.html'] = 2
+        _, content = squash_crawl.open_url(urllib2.Request(self.url + 'page.html'),
+                                           retries=2, backoff=0.01)
+        self.assertEqual(content, 'content')
+        self.assertEqual(self.server.requests, ['page.html']*3)
+
+    def test_retries_exhausted(self):
+        self.server.pages['page.html'] = 'content'
+        self.server.unavailable['page.html'] = 3
+        with self.assertRaises(urllib2.HTTPError):
+            squash_crawl.open_url(urllib2.Request(self.url + 'page.html'),
+                                  retries=2, backoff=0.01)
+
+    def test_no_retry_on_client_error(self):
+        with self.assertRaises(urllib2.HTTPError):
+            squash_crawl.open_url(urllib2.Request(self.url + 'missing.html'),
+                                  retries=2, backoff=0.01)
+        self.assertEqual(self.server.requests, ['missing.html'])
+
+    def test_cache_hit(self):
+        self.server.pages['page.html'] = 'content'
+        with open('local.html', 'w') as ofile:
+            ofile.write('content')
+        local_url = 'file://' + os.path.join(self.tmpdir, 'local.html')
+        squash_crawl.STATS = squash_crawl.CrawlStats()
+        for url in [self.url + 'page.html', self.url + 'page.html', local_url]:
+            squash_crawl.fetch_page(url)
+        self.assertEqual(squash_crawl.STATS.urls[self.url + 'page.html']['cache_hit'], False)
+        squash_crawl.PAGE_CACHE.revalidate = False
+        squash_crawl.fetch_page(self.url + 'page.html')
+        self.assertEqual(squash_crawl.STATS.urls[self.url + 'page.html']['cache_hit'], True)
+        self.assertFalse('cache_hit' in squash_crawl.STATS.urls[local_url])
+
+    def test_host_limit(self):
+        limiter = squash_crawl.HostLimiter(max_connections=2, delay=0)
+        for i in range(6):
+            self.server.pages['%d.html' % i] = 'content'
+            self.server.slow['%d.html' % i] = 0.1
+        threads = [threading.Thread(target=limiter.urlopen,
+                                    args=(urllib2.Request(self.url + '%d.html' % i),))
+                   for i in range(6)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(self.server.max_active, 2)
+
+    def test_failing_sites(self):
+        sites = ['1409.html', '1410.html', '1411.html', '1412-1501.html']
+        self.server.pages['resultats.html'] = ''.join(
+            '<a href="archives/%s">%s</a>' % (site, site) for site in sites)
+        for site in sites:
+            self.server.pages['archives/' + site] = season_page()
+        self.server.unavailable['archives/1410.html'] = 1 # recovers on retry
+        self.server.slow['archives/1411.html'] = 2 # times out
+        self.server.broken.add('archives/1412-1501.html')
+        squash_crawl.RETRIES = 1
+
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            squash_crawl.process_archives(self.url + 'resultats.html',
+                                          baseurl=self.url + 'archives/%s',
+                                          report='crawl_report.json')
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+
+        with open('crawl_report.json', 'r') as ifile:
+            report = json.load(ifile)
+        self.assertEqual(report['failed_sites'], ['1411.html', '1412-1501.html'])
+        with open('squash_data.json', 'r') as ifile:
+            squash_data = json.load(ifile)
+        self.assertEqual(sorted(squash_data['seasons']), ['1409', '1410'])
+        self.assertEqual(squash_data['players']['Anna Meyer']['n_total_matches'], 6)
+
+    def crawl(self, dirname, parse_workers):
+        """Crawl the local archive in a fresh directory, return the data and report"""
+        os.mkdir(dirname)
+        shutil.copy('seasons.txt', dirname)
+        os.chdir(dirname)
+        squash_crawl.PAGE_CACHE = page_cache.PageCache('cache')
+        squash_crawl.ALIASES = None
+        clean_name.cache.clear()
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            squash_crawl.process_archives(self.url + 'resultats.html',
+                                          baseurl=self.url + 'archives/%s',
+                                          report='crawl_report.json',
+                                          parse_workers=parse_workers)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+            os.chdir(self.tmpdir)
+        with open(os.path.join(dirname, 'squash_data.json'), 'rb') as ifile:
+            data = ifile.read()
+        with open(os.path.join(dirname, 'crawl_report.json'), 'r') as ifile:
+            return data, json.load(ifile)
+
+    def test_parse_workers(self):
+        names = ['Anna Meyer', 'Bruno Rossi (1st to finish)', 'Carla Dupont', 'David Smith',
+                 'Eva Lind - 2nd to finish', 'anna  meyer', 'Bruno Rossi', 'Fred Olsen']
+        sites = ['1409.html', '1410.html', '1411.html', '1412-1501.html', '1502.html']
+        self.server.pages['resultats.html'] = ''.join(
+            '<a href="archives/%s">%s</a>' % (site, site) for site in sites)
+        for i, site in enumerate(sites):
+            self.server.pages['archives/' + site] = season_page(names[i:i+4])
+
+        data, report = self.crawl('serial', parse_workers=0)
+        parallel_data, parallel_report = self.crawl('parallel', parse_workers=2)
+        self.assertEqual(parallel_data, data)
+        self.assertEqual(json.loads(data)['players']['Anna Meyer']['n_seasons_played'], 4)
+
+        # Each name is cleaned once per page, in whichever process parses it
+        lookups = lambda r: r['name_caches']['clean_name']['hits'] + \
+                            r['name_caches']['clean_name']['misses']
+        self.assertEqual(lookups(parallel_report), lookups(report))
+        self.assertEqual(lookups(report), 4*len(sites))
+
+class AddSeasonTest(unittest.TestCase):
+    def setUp(self):
+        load_seasons()
+        self.divisions = {1: PLAYERS[:2], 2: PLAYERS[2:]}
+        self.matches = {(PLAYERS[0], PLAYERS[1]): '3-1', (PLAYERS[2], PLAYERS[3]): '3-2'}
+
+    def test_unknown_season(self):
+        squash_data = {'players': {}, 'seasons': {}}
+        squash_crawl.add_season(squash_data, '1409', self.divisions, self.matches)
+        before = json.dumps(squash_data, sort_keys=True)
+        with self.assertRaises(RuntimeError):
+            squash_crawl.add_season(squash_data, '9999', self.divisions, self.matches)
+        self.assertEqual(json.dumps(squash_data, sort_keys=True), before)
+        self.assertEqual(len(MatchTable.build(squash_data)), 2)
+
+    def test_replace_unknown_season(self):
+        # seasons.txt no longer has a season of the data
+        squash_data = {'players': {}, 'seasons': {}}
+        squash_crawl.add_season(squash_data, '1409', self.divisions, self.matches)
+        before = json.dumps(squash_data, sort_keys=True)
+        del squash_crawl.SEASONS['1409']
+        with self.assertRaises(RuntimeError):
+            squash_crawl.replace_season(squash_data, '1409', self.divisions, self.matches)
+        self.assertEqual(json.dumps(squash_data, sort_keys=True), before)
+
+    def test_totals(self):
+        squash_data = {'players': {}, 'seasons': {}}
+        for season in ['1409', '1410']:
+            squash_crawl.add_season(squash_data, season, self.divisions, self.matches)
+        squash_crawl.remove_season(squash_data, '1409')
+        anna = squash_data['players'][PLAYERS[0]]
+        self.assertEqual((anna['n_seasons_played'], anna['n_total_matches'],
+                          anna['n_total_wins']), (1, 1, 1))
+        self.assertEqual(sorted(squash_data['seasons']), ['1410'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+The ratings of calculate_elo.py stored in the SQLite database, also when
+the database was written from older data.
+"""
+import os
+import sys
+import copy
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import squash_crawl
+from calculate_elo import run_elo
+from match_table import MatchTable
+from squash_db import SquashDB
+from fixtures import random_data, SEASONS
+
+class StoreRatingsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = SquashDB(os.path.join(self.tmpdir, 'squash_data.db'))
+        self.squash_data = random_data(seed=6, n_players=60)
+        self.table = MatchTable.build(self.squash_data)
+        self.result = run_elo(self.table)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def rating(self, season, name):
+        row = self.db.conn.execute(
+            'SELECT r.elo FROM ratings r JOIN players p ON p.id = r.player '
+            'WHERE r.season = ? AND p.name = ?', (season, name)).fetchone()
+        return row and row[0]
+
+    def test_store_ratings(self):
+        self.db.store_seasons(self.squash_data, SEASONS)
+        self.db.store_ratings(self.table, self.result)
+        names = self.table.player_names.tolist()
+        for sidx, season in enumerate(SEASONS):
+            for pid in self.table.season_players(sidx).tolist():
+                self.assertEqual(self.rating(season, names[pid]),
+                                 self.result.season_ratings[sidx, pid])
+
+    def test_missing_player(self):
+        # The database has the data of the seasons before the last one
+        older = copy.deepcopy(self.squash_data)
+        squash_crawl.remove_season(older, SEASONS[-1])
+        self.db.store_seasons(older, SEASONS[:-1])
+        missing = set(self.squash_data['players']) - set(older['players'])
+        self.assertTrue(missing)
+
+        self.db.store_ratings(self.table, self.result)
+        names = self.table.player_names.tolist()
+        for name in missing:
+            last_elo, = self.db.conn.execute('SELECT last_elo FROM players WHERE name = ?',
+                                             (name,)).fetchone()
+            self.assertEqual(last_elo, self.result.ratings[names.index(name)])
+            self.assertEqual(self.rating(SEASONS[-1], name), None)
+
+        # Once the season is stored, they have a rating for it
+        self.db.store_seasons(self.squash_data, SEASONS[-1:])
+        self.db.store_ratings(self.table, self.result, first_season=len(SEASONS)-1)
+        for name in missing:
+            self.assertEqual(self.rating(SEASONS[-1], name),
+                             self.result.season_ratings[-1, names.index(name)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+"""
+The default setting of the parameter sweep reproduces the ratings of
+calculate_elo.py, from the data file or from the crawler's match table.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import calculate_elo
+import elo_sweep
+import rating_engines
+from squash_io import write_data
+from squash_model import SquashModel
+from match_table import MatchTable
+from fixtures import random_data
+
+class EloSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        write_data(random_data(seed=2), 'squash_data.json')
+        MatchTable.from_file('squash_data.json').save('squash_matches.npz')
+
+        # Rate the data with calculate_elo.py
+        argv, stdout = sys.argv, sys.stdout
+        sys.argv, sys.stdout = ['calculate_elo.py', '--full'], open(os.devnull, 'w')
+        try:
+            calculate_elo.main()
+        finally:
+            sys.stdout.close()
+            sys.argv, sys.stdout = argv, stdout
+        self.model = SquashModel.load('squash_data.json')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+        elo_sweep.TABLE = None
+
+    def check_baseline(self, filename):
+        elo_sweep.TABLE = table = elo_sweep.load_table(filename)
+        result = elo_sweep.run_elo(table)
+        for pid, name in enumerate(table.player_names.tolist()):
+            self.assertEqual(result.ratings[pid], self.model.player(name).last_elo)
+            for sidx, season in enumerate(table.season_keys.tolist()):
+                pseason = self.model.player(name).seasons.get(season)
+                if pseason is not None:
+                    self.assertEqual(result.season_ratings[sidx, pid], pseason.elo)
+
+        K, close_win, log_loss, accuracy = elo_sweep.evaluate((calculate_elo.KFACTOR, None))
+        model_table = self.model.match_table()
+        expected = rating_engines.predictive_scores(
+            model_table, rating_engines.season_win_probability(
+                model_table, calculate_elo.run_elo(model_table).season_ratings),
+            calculate_elo.match_scores(model_table)[1])
+        self.assertEqual((log_loss, accuracy), expected)
+
+    def test_data_file(self):
+        self.check_baseline('squash_data.json')
+
+    def test_match_table(self):
+        self.check_baseline('squash_matches.npz')
+
+if __name__ == '__main__':
+    unittest.main()
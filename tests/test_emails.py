@@ -0,0 +1,43 @@
+"""
+Matching of the league players to the e-mails of the members list in
+get_squash_emails.py.
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from get_squash_emails import EmailIndex
+
+CONTACTS = [('Andy Buckley', 'andydotbuckley@example.org'),
+            ('Maria Garcia Lopez', 'mgarcia@example.org'),
+            ('Peter Jones', 'peter.jones@example.org'),
+            ('Paul Jones', 'pjones@example.org')]
+
+class EmailIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = EmailIndex(CONTACTS)
+
+    def test_exact(self):
+        self.assertEqual(self.index.lookup('Andy  Buckley'),
+                         ('andydotbuckley@example.org', []))
+
+    def test_last_name(self):
+        email, candidates = self.index.lookup('Maria Garcia')
+        self.assertEqual(email, 'mgarcia@example.org')
+
+    def test_other_last_name(self):
+        email, candidates = self.index.lookup('Andy Buckley-Smith')
+        self.assertEqual(email, None)
+        self.assertEqual(candidates, [('andydotbuckley@example.org', 2)])
+
+    def test_ambiguous(self):
+        email, candidates = self.index.lookup('P. Jones')
+        self.assertEqual(email, None)
+        self.assertEqual(candidates, [('peter.jones@example.org', 2),
+                                      ('pjones@example.org', 2)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+The streaming, atomic writer of squash_io.py, reading its plain, compact
+and gzip-compressed output back, and the `SquashData` reader with its
+index file.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from squash_io import (SquashData, atomic_open, open_data, load_data, write_sections,
+                       write_data)
+from fixtures import random_data
+
+def sections(squash_data):
+    return [(key, sorted(squash_data[key].iteritems())) for key in sorted(squash_data)]
+
+class WriteSectionsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'squash_data.json')
+        self.squash_data = random_data(seed=5)
+        self.squash_data['players'][u'Zo\xeb M\xfcller'] = {'seasons': {}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_same_as_json_dump(self):
+        write_sections(self.filename, sections(self.squash_data))
+        with open(self.filename, 'rb') as ifile:
+            text = ifile.read()
+        self.assertEqual(json.loads(text), self.squash_data)
+        self.assertEqual(text, json.dumps(self.squash_data, indent=2, sort_keys=True))
+
+    def test_empty_sections(self):
+        write_sections(self.filename, [('players', []), ('seasons', [])])
+        self.assertEqual(load_data(self.filename), {'players': {}, 'seasons': {}})
+        write_sections(self.filename, [])
+        self.assertEqual(load_data(self.filename), {})
+
+    def test_failed_write(self):
+        write_data(self.squash_data, self.filename)
+        with open(self.filename, 'rb') as ifile:
+            before = ifile.read()
+
+        def players():
+            for i, entry in enumerate(sorted(self.squash_data['players'].iteritems())):
+                if i == 10: raise RuntimeError('interrupted')
+                yield entry
+        with self.assertRaises(RuntimeError):
+            write_sections(self.filename, [('players', players())])
+        with self.assertRaises(RuntimeError):
+            with atomic_open(self.filename) as ofile:
+                ofile.write('{}')
+                raise RuntimeError('interrupted')
+
+        with open(self.filename, 'rb') as ifile:
+            self.assertEqual(ifile.read(), before)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         ['squash_data.json', 'squash_data.json.idx'])
+
+    def check_round_trip(self, **kwargs):
+        write_data(self.squash_data, self.filename, **kwargs)
+        with open_data(self.filename) as ifile:
+            self.assertEqual(json.load(ifile), self.squash_data)
+        self.assertEqual(load_data(self.filename), self.squash_data)
+
+    def test_compact(self):
+        self.check_round_trip(compact=True)
+        with open(self.filename, 'rb') as ifile:
+            self.assertEqual(ifile.read(), json.dumps(self.squash_data, sort_keys=True,
+                                                      separators=(',', ':')))
+
+    def test_gzip(self):
+        self.check_round_trip(compress=True)
+        with open(self.filename, 'rb') as ifile:
+            self.assertEqual(ifile.read(2), '\x1f\x8b')
+
+    def test_compact_gzip(self):
+        self.check_round_trip(compact=True, compress=True)
+
+class SquashDataTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'squash_data.json')
+        write_data(random_data(seed=6), self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_records(self):
+        squash_data = load_data(self.filename)
+        reader = SquashData(self.filename)
+        self.assertEqual(sorted(reader.player_names()), sorted(squash_data['players']))
+        self.assertEqual(sorted(reader.season_keys()), sorted(squash_data['seasons']))
+        for name, pdata in squash_data['players'].iteritems():
+            self.assertEqual(reader.player(name), pdata)
+        self.assertEqual(dict(reader.players()), squash_data['players'])
+        for key, sdata in squash_data['seasons'].iteritems():
+            self.assertEqual(reader.season(key), sdata)
+        self.assertEqual(reader.seasons(), squash_data['seasons'])
+        self.assertEqual(reader.player('Nobody'), None)
+        self.assertEqual(reader.season('0000'), None)
+
+    def test_records(self):
+        self.check_records()
+
+    def test_compressed(self):
+        write_data(load_data(self.filename), self.filename, compact=True, compress=True)
+        self.check_records()
+
+    def test_missing_index(self):
+        os.remove(self.filename + '.idx')
+        self.check_records()
+        self.assertTrue(os.path.exists(self.filename + '.idx'))
+
+    def test_stale_index(self):
+        SquashData(self.filename).index
+        # Rewritten without updating the index, with the players in other places
+        squash_data = load_data(self.filename)
+        del squash_data['players'][sorted(squash_data['players'])[0]]
+        with open(self.filename, 'wb') as ofile:
+            json.dump(squash_data, ofile, indent=2, sort_keys=True)
+        self.check_records()
+
+        with open(self.filename + '.idx', 'rb') as ifile:
+            index = json.load(ifile)
+        self.assertEqual(index['stamp'], SquashData(self.filename).stamp())
+        self.assertEqual(sorted(index['players']), sorted(squash_data['players']))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+"""
+The match table written by the crawler is the one calculate_elo.py
+rates: built from the data file, with the same order of the matches and
+the same player ids as `SquashModel.match_table`.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+from squash_io import write_data
+from squash_model import SquashModel
+from match_table import MatchTable
+from fixtures import random_data
+
+def assert_same_table(test, table1, table2):
+    test.assertEqual(sorted(table1._arrays.keys()), sorted(table2._arrays.keys()))
+    for name in table1._arrays.keys():
+        test.assertTrue(np.array_equal(getattr(table1, name), getattr(table2, name)), name)
+
+class MatchTableTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'squash_data.json')
+        write_data(random_data(), self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_same_as_model(self):
+        assert_same_table(self, MatchTable.from_file(self.filename),
+                          SquashModel.load(self.filename).match_table())
+
+    def test_saved_table(self):
+        tablefile = os.path.join(self.tmpdir, 'squash_matches.npz')
+        MatchTable.from_file(self.filename).save(tablefile)
+        assert_same_table(self, MatchTable.load(tablefile, lazy=False),
+                          SquashModel.load(self.filename).match_table())
+
+    def test_after_rating(self):
+        # calculate_elo.py writes the data back with the ratings
+        model = SquashModel.load(self.filename)
+        table = model.match_table()
+        for player in model.players:
+            player.last_elo = 1200.0 + player.id
+        model.save(self.filename, compact=True)
+        assert_same_table(self, MatchTable.from_file(self.filename), table)
+        assert_same_table(self, SquashModel.load(self.filename).match_table(), table)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+"""
+The name normalizers of squash_names.py against a pinned table.
+
+data/clean_names.json has the names of player_names.txt, as they are
+and as they appear in the league tables (annotations like '(1st to
+finish)' or 'out', phone numbers, accents, other cases), with the output
+of the original name cleaning code of squash_crawl.get_name and
+get_squash_emails.get_name for each: [raw text, name, contact name].
+"""
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from squash_names import clean_name, clean_contact_name, LRUCache, AliasStore
+
+def load_table():
+    with io.open(os.path.join(ROOT, 'tests', 'data', 'clean_names.json'),
+                 encoding='utf-8') as ifile:
+        return json.load(ifile)
+
+class CleanNameTest(unittest.TestCase):
+    def setUp(self):
+        self.table = load_table()
+        clean_name.cache.clear()
+        clean_contact_name.cache.clear()
+
+    def test_clean_name(self):
+        for raw, name, _ in self.table:
+            self.assertEqual(clean_name(raw), name, repr(raw))
+
+    def test_clean_contact_name(self):
+        for raw, _, contact_name in self.table:
+            self.assertEqual(clean_contact_name(raw), contact_name, repr(raw))
+
+    def test_memoized(self):
+        first = [clean_name(raw) for raw, _, _ in self.table]
+        second = [clean_name(raw) for raw, _, _ in self.table]
+        self.assertEqual(first, second)
+        info = clean_name.cache.info()
+        self.assertEqual(info['misses'], len(self.table))
+        self.assertEqual(info['hits'], len(self.table))
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1) # 'b' is now the oldest
+        cache.put('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(cache.info(), {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2})
+
+class AliasStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'player_names.txt')
+        with open(self.filename, 'w') as ofile:
+            ofile.write('martinschmidt, Martin Schmidt\n'
+                        'ahmadzein-assi, Ahmad Zein-Assi\n'
+                        'jean-christophemartin, Jean-Christophe Martin\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_new_names_are_new_players(self):
+        aliases = AliasStore(self.filename)
+        self.assertEqual(aliases.resolve('martinaschmidt', 'Martina Schmidt'),
+                         'Martina Schmidt')
+        self.assertEqual(aliases.similar(), [('Martina Schmidt', 'Martin Schmidt')])
+        self.assertEqual(aliases.save(), 1)
+        self.assertEqual(AliasStore(self.filename).aliases['martinaschmidt'],
+                         'Martina Schmidt')
+
+    def test_same_name(self):
+        # Keys that differ by a dash, for the same name, are no new player
+        aliases = AliasStore(self.filename)
+        self.assertEqual(aliases.resolve('jeanchristophe-martin', 'Jean-Christophe Martin'),
+                         'Jean-Christophe Martin')
+        self.assertEqual(aliases.similar(), [])
+
+    def test_fuzzy_cutoff(self):
+        aliases = AliasStore(self.filename, fuzzy_cutoff=0.9)
+        self.assertEqual(aliases.resolve('ahmadzeinassi', 'Ahmadzeinassi'),
+                         'Ahmad Zein-Assi')
+        self.assertEqual(aliases.new_aliases,
+                         [('ahmadzeinassi', 'Ahmad Zein-Assi', 'ahmadzein-assi')])
+        self.assertEqual(aliases.similar(), [])
+
+    def test_lookup(self):
+        aliases = AliasStore(self.filename)
+        self.assertEqual(aliases.lookup(u'Ahmad Zeinassi'), 'Ahmad Zein-Assi')
+        self.assertEqual(aliases.lookup(u'John Doe'), 'John Doe')
+        self.assertEqual(aliases.new_aliases, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+Revalidation, offline mode and eviction of page_cache.py, with a stub
+opener instead of the network.
+"""
+import os
+import sys
+import shutil
+import urllib2
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from page_cache import PageCache, CacheMiss
+
+URL = 'http://example.org/squash/league.html'
+
+class StubOpener(object):
+    """
+    Opener that serves `pages` (url -> content, ETag) and answers 304 to
+    requests with the current ETag, recording the requests it gets
+    """
+    def __init__(self, pages):
+        self.pages = pages
+        self.requests = []
+
+    def __call__(self, request):
+        self.requests.append(request)
+        url = request.get_full_url()
+        content, etag = self.pages[url]
+        if request.get_header('If-none-match') == etag:
+            raise urllib2.HTTPError(url, 304, 'Not Modified', {}, None)
+        return {'ETag': etag}, content
+
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+        self.opener = StubOpener({URL: ('<html>league</html>', '"v1"')})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def cached(self):
+        """A cache with the page of URL, saved to disk"""
+        cache = PageCache(self.cachedir)
+        cache.fetch(URL, self.opener)
+        cache.save()
+        return cache
+
+    def test_download(self):
+        cache = PageCache(self.cachedir)
+        self.assertEqual(cache.fetch_status(URL, self.opener), ('<html>league</html>', False))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(cache.downloaded, {URL: len('<html>league</html>')})
+        self.assertEqual(self.opener.requests[0].get_header('If-none-match'), None)
+        self.assertEqual(cache.get(URL), '<html>league</html>')
+
+    def test_not_modified(self):
+        self.cached()
+        cache = PageCache(self.cachedir)
+        self.assertEqual(cache.fetch_status(URL, self.opener), ('<html>league</html>', True))
+        self.assertEqual(len(self.opener.requests), 2)
+        self.assertEqual(self.opener.requests[1].get_header('If-none-match'), '"v1"')
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertEqual(cache.downloaded, {})
+
+    def test_modified(self):
+        self.cached()
+        self.opener.pages[URL] = ('<html>new league</html>', '"v2"')
+        cache = PageCache(self.cachedir)
+        self.assertEqual(cache.fetch_status(URL, self.opener),
+                         ('<html>new league</html>', False))
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(cache.index[URL]['etag'], '"v2"')
+
+    def test_no_revalidate(self):
+        self.cached()
+        cache = PageCache(self.cachedir, revalidate=False)
+        self.assertEqual(cache.fetch_status(URL, self.opener), ('<html>league</html>', True))
+        self.assertEqual(len(self.opener.requests), 1)
+
+    def test_offline(self):
+        self.cached()
+        cache = PageCache(self.cachedir, offline=True)
+        self.assertEqual(cache.fetch_status(URL, self.opener), ('<html>league</html>', True))
+        self.assertRaises(CacheMiss, cache.fetch, URL + '?page=2', self.opener)
+        self.assertEqual(len(self.opener.requests), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_evict(self):
+        cache = self.cached()
+        other = 'http://example.org/squash/other.html'
+        self.opener.pages[other] = ('<html>other page</html>', '"v1"')
+        cache.fetch(other, self.opener)
+        cache.index[URL]['accessed'] -= 10
+        cache.max_size = len('<html>other page</html>')
+        cache.save()
+
+        cache = PageCache(self.cachedir, offline=True)
+        self.assertEqual(cache.get(URL), None)
+        self.assertEqual(cache.fetch(other), '<html>other page</html>')
+        objects = [f for _, _, files in os.walk(os.path.join(self.cachedir, 'objects'))
+                   for f in files]
+        self.assertEqual(objects, [cache.index[other]['sha1']])
+
+if __name__ == '__main__':
+    unittest.main()
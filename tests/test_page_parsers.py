@@ -0,0 +1,71 @@
+"""
+The parser backends give the golden output of the benchmark corpus:
+the divisions and matches of each page in bench_corpus/, and the pages
+the parser rejects.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import page_cache
+import page_parsers
+import squash_crawl
+import benchmark
+from squash_names import AliasStore
+
+CORPUS = os.path.join(ROOT, benchmark.CORPUS)
+
+class GoldenOutputTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with open(os.path.join(CORPUS, 'golden.json'), 'r') as ifile:
+            cls.golden = json.load(ifile)
+
+    def setUp(self):
+        self.saved = (squash_crawl.PARSER, squash_crawl.PAGE_CACHE, squash_crawl.ALIASES)
+        self.tmpdir = tempfile.mkdtemp()
+        shutil.copy(os.path.join(CORPUS, 'player_names.txt'), self.tmpdir)
+        squash_crawl.PAGE_CACHE = page_cache.PageCache(os.path.join(CORPUS, 'pages'),
+                                                       offline=True, max_size=None)
+
+    def tearDown(self):
+        (squash_crawl.PARSER, squash_crawl.PAGE_CACHE, squash_crawl.ALIASES) = self.saved
+        shutil.rmtree(self.tmpdir)
+
+    def parse_corpus(self, backend):
+        """Parsed pages and errors of the corpus, as in benchmark.py"""
+        squash_crawl.PARSER = page_parsers.get_backend(backend)
+        squash_crawl.ALIASES = AliasStore(os.path.join(self.tmpdir, 'player_names.txt'))
+        urls = sorted(u for u in squash_crawl.PAGE_CACHE.index if u.endswith('.html'))
+        pages, errors = {}, {}
+        with benchmark.Quiet():
+            for url in urls:
+                try:
+                    html = squash_crawl.load_page(url)
+                    pages[url] = benchmark.serialize_page(*squash_crawl.parse_page(html))
+                except (RuntimeError, AssertionError), e:
+                    errors[url] = '%s: %s' % (type(e).__name__, e)
+        return json.loads(json.dumps({'pages': pages, 'errors': errors}))
+
+    def check_backend(self, backend):
+        output = self.parse_corpus(backend)
+        self.assertEqual(sorted(output['pages']), sorted(self.golden['pages']))
+        for url in sorted(output['pages']):
+            self.assertEqual(output['pages'][url], self.golden['pages'][url], url)
+        self.assertEqual(output['errors'], self.golden['errors'])
+
+    def test_bs4(self):
+        self.check_backend('bs4')
+
+    @unittest.skipIf(page_parsers.lxml is None, 'lxml is not installed')
+    def test_lxml(self):
+        self.check_backend('lxml')
+
+if __name__ == '__main__':
+    unittest.main()
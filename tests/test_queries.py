@@ -0,0 +1,186 @@
+"""
+The cached indexes of squash_queries.py give the same answers as a scan
+of the squash data, and are rebuilt when the data file changes.
+"""
+import os
+import sys
+import random
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from squash_io import load_data, write_data, sort_seasons, parse_games
+from squash_queries import (CachedIndex, H2HIndex, PlayerSummaries, Record, Standing,
+                            EMPTYRECORD, RANKINGS)
+from rating_engines import ENGINES
+from fixtures import random_data
+
+def scan_matches(squash_data, name1, name2):
+    """(season, result) of the matches of name1 against name2, by date"""
+    matches = []
+    for season, _, _ in sort_seasons(squash_data['seasons']):
+        pseason = squash_data['players'][name1]['seasons'].get(season, {})
+        result = pseason.get('matches', {}).get(name2)
+        if result is not None: matches.append((season, result))
+    return matches
+
+def scan_record(squash_data, name1, name2):
+    played = won = games_won = games_lost = 0
+    for _, result in scan_matches(squash_data, name1, name2):
+        games1, games2 = parse_games(result)
+        played += 1
+        won += games1 > max(games2, 0)
+        games_won += max(games1, 0)
+        games_lost += max(games2, 0)
+    return Record(played, won, played-won, games_won, games_lost)
+
+class H2HIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'squash_data.json')
+        write_data(random_data(seed=7, n_players=30), self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_index(self, index):
+        squash_data = load_data(self.filename)
+        names = sorted(squash_data['players'])
+        for name1 in names:
+            self.assertIn(name1, index)
+            for name2 in names:
+                self.assertEqual(index.head_to_head(name1, name2),
+                                 scan_matches(squash_data, name1, name2))
+                self.assertEqual(index.record(name1, name2),
+                                 scan_record(squash_data, name1, name2))
+            opponents = set(name2 for name2 in names
+                            if scan_matches(squash_data, name1, name2))
+            self.assertEqual(set(index.opponents(name1)), opponents)
+        self.assertNotIn('Nobody', index)
+        self.assertEqual(index.record('Nobody', names[0]), EMPTYRECORD)
+
+    def test_brute_force(self):
+        self.check_index(H2HIndex.load(self.filename))
+
+    def test_most(self):
+        index = H2HIndex.load(self.filename)
+        for name in index.matches:
+            most = index.most(name, 'won', n=3)
+            wins = sorted(((-r.won, n) for n, r in index.opponents(name).iteritems()))[:3]
+            self.assertEqual([(n, index.record(name, n)) for _, n in wins], most)
+
+    def test_cache(self):
+        H2HIndex.load(self.filename)
+        self.assertTrue(os.path.exists(self.filename + '.h2h'))
+
+        # Up to date: the index comes from the cache
+        build = H2HIndex.__dict__['build']
+        def fail(cls, squash_data):
+            raise AssertionError('index rebuilt')
+        H2HIndex.build = classmethod(fail)
+        try:
+            self.check_index(H2HIndex.load(self.filename))
+        finally:
+            H2HIndex.build = build
+
+        # Changed data: the index is rebuilt
+        squash_data = load_data(self.filename)
+        name1 = sorted(squash_data['players'])[0]
+        pdata = squash_data['players'][name1]
+        season = sorted(pdata['seasons'])[-1]
+        matches = pdata['seasons'][season]['matches']
+        for name2 in matches:
+            matches[name2] = '3-0'
+            squash_data['players'][name2]['seasons'][season]['matches'][name1] = '0-3'
+        write_data(squash_data, self.filename)
+        self.check_index(H2HIndex.load(self.filename))
+
+    def test_abstract(self):
+        class Index(CachedIndex):
+            SUFFIX = '.test'
+        self.assertRaises(TypeError, Index)
+
+def scan_standings(squash_data, first=None, last=None, division=None, active=None,
+                   min_matches=0, engine='elo'):
+    """The Standings of `PlayerSummaries.standings` from the squash data"""
+    seasons = [key for key, _, _ in sort_seasons(squash_data['seasons'])]
+    lo = seasons.index(first) if first else 0
+    hi = seasons.index(last) if last else len(seasons)-1
+    filtered = first or last or division is not None
+    engine = ENGINES[engine]
+    standings = []
+    for name, pdata in squash_data['players'].iteritems():
+        if active and active not in pdata['seasons']: continue
+        counted = [key for key in seasons[lo:hi+1] if key in pdata['seasons'] and
+                   division in (None, pdata['seasons'][key]['division'])]
+        played = won = games_diff = 0
+        for key in counted:
+            for result in pdata['seasons'][key]['matches'].itervalues():
+                games1, games2 = parse_games(result)
+                played += 1
+                won += games1 > max(games2, 0)
+                games_diff += max(games1, 0) - max(games2, 0)
+        if not played or played < min_matches: continue
+        if filtered:
+            elo = pdata['seasons'][counted[-1]][engine.SEASON_KEY]
+        else:
+            elo = pdata[engine.LAST_KEY]
+        standings.append(Standing(name, elo, played, won, float(won)/played,
+                                  games_diff, len(counted)))
+    return standings
+
+class LeaderboardTest(unittest.TestCase):
+    FILTERS = [{},
+               {'min_matches': 8},
+               {'first': '1410'},
+               {'last': '1412-1501', 'engine': 'glicko2'},
+               {'first': '1410', 'last': '1411', 'min_matches': 3},
+               {'division': 2},
+               {'division': 1, 'first': '1411', 'engine': 'glicko2'},
+               {'active': '1502'},
+               {'active': '1409', 'last': '1411', 'division': 3}]
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'squash_data.json')
+        # Random ratings of each engine, as calculate_elo.py stores them
+        rng = random.Random(8)
+        self.squash_data = random_data(seed=8, n_players=30)
+        for pdata in self.squash_data['players'].itervalues():
+            for engine in ENGINES.itervalues():
+                pdata[engine.LAST_KEY] = rng.uniform(900, 1600)
+                for pseason in pdata['seasons'].itervalues():
+                    pseason[engine.SEASON_KEY] = rng.uniform(900, 1600)
+        write_data(self.squash_data, self.filename)
+        self.summaries = PlayerSummaries.load(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_standings(self):
+        for filters in self.FILTERS:
+            expected = scan_standings(self.squash_data, **filters)
+            self.assertTrue(expected, filters)
+            self.assertEqual(sorted(self.summaries.standings(**filters)), sorted(expected),
+                             filters)
+
+    def test_leaderboard(self):
+        for filters in self.FILTERS:
+            expected = scan_standings(self.squash_data, **filters)
+            for rank, key in RANKINGS.iteritems():
+                values = sorted(map(key, expected), reverse=True)
+                leaderboard = self.summaries.leaderboard(rank, **filters)
+                self.assertEqual(sorted(leaderboard), sorted(expected))
+                self.assertEqual(map(key, leaderboard), values)
+                top = self.summaries.leaderboard(rank, n=5, **filters)
+                self.assertEqual(map(key, top), values[:5])
+                self.assertEqual(top, leaderboard[:5])
+
+    def test_unknown_season(self):
+        self.assertRaises(KeyError, self.summaries.leaderboard, first='0000')
+
+if __name__ == '__main__':
+    unittest.main()
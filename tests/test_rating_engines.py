@@ -0,0 +1,143 @@
+"""
+`calculate_elo.run_elo` gives the ratings of the original match by match
+implementation, `rating_engines.run_engines` gives the same Elo ratings
+and win probabilities, the batch ratings don't depend on the order of the
+matches within a season, and the print tools look up the rating engines
+without importing numpy.
+"""
+import os
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+
+import calculate_elo
+import rating_engines
+from squash_io import load_data, write_data
+from squash_model import SquashModel
+from match_table import MatchTable, COLUMNS
+from fixtures import random_data
+
+class ReferenceEloTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'squash_data.json')
+        write_data(random_data(seed=4, n_players=50), self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_same_ratings(self):
+        # Both read the data file, so the matches come in the same order
+        squash_data = load_data(self.filename)
+        reference_max = calculate_elo.reference_elo(squash_data)
+        table = SquashModel.load(self.filename).match_table()
+        result = calculate_elo.run_elo(table)
+
+        names = table.player_names.tolist()
+        for sidx, season in enumerate(table.season_keys.tolist()):
+            for pid in table.season_players(sidx).tolist():
+                pseason = squash_data['players'][names[pid]]['seasons'][season]
+                self.assertAlmostEqual(result.season_ratings[sidx, pid], pseason['elo'],
+                                       delta=1e-9, msg='%s %s' % (names[pid], season))
+        for pid, name in enumerate(names):
+            self.assertAlmostEqual(result.ratings[pid],
+                                   squash_data['players'][name]['last_elo'], delta=1e-9)
+        self.assertAlmostEqual(result.max_elo, reference_max[0], delta=1e-9)
+        self.assertEqual((names[result.max_player], table.season_keys[result.max_season]),
+                         reference_max[1:])
+
+class EloEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.table = MatchTable.build(random_data(seed=3))
+
+    def check_engine(self, batch):
+        result = calculate_elo.run_elo(self.table, batch=batch)
+        engine_result, = rating_engines.run_engines(
+            self.table, [rating_engines.EloEngine(batch=batch)])
+        self.assertTrue(np.array_equal(result.ratings, engine_result.ratings))
+        self.assertTrue(np.array_equal(result.season_ratings, engine_result.season_ratings))
+        probability = rating_engines.season_win_probability(self.table, result.season_ratings)
+        self.assertTrue(np.array_equal(probability, engine_result.win_probability))
+
+    def test_match_by_match(self):
+        self.check_engine(batch=False)
+
+    def test_batch(self):
+        self.check_engine(batch=True)
+
+    def shuffled_table(self, seed):
+        """The match table with the matches of each season in random order"""
+        rng = np.random.RandomState(seed)
+        order = np.arange(len(self.table))
+        for sidx in xrange(self.table.n_seasons):
+            rng.shuffle(order[self.table.season_slice(sidx)])
+        arrays = dict(self.table._arrays)
+        for column in COLUMNS:
+            arrays[column] = arrays[column][order]
+        return MatchTable(arrays)
+
+    def test_batch_order(self):
+        result = calculate_elo.run_elo(self.table, batch=True)
+        for seed in xrange(3):
+            table = self.shuffled_table(seed)
+            shuffled = calculate_elo.run_elo(table, batch=True)
+            # Only the order of the floating point sums changes
+            np.testing.assert_array_max_ulp(shuffled.season_ratings, result.season_ratings, 4)
+            np.testing.assert_array_max_ulp(shuffled.ratings, result.ratings, 4)
+            engine_result, = rating_engines.run_engines(
+                table, [rating_engines.EloEngine(batch=True)])
+            np.testing.assert_array_max_ulp(engine_result.season_ratings,
+                                            result.season_ratings, 4)
+
+        # Match by match, the order matters
+        result = calculate_elo.run_elo(self.table)
+        shuffled = calculate_elo.run_elo(self.shuffled_table(0))
+        self.assertTrue(np.abs(shuffled.ratings - result.ratings).max() > 1e-3)
+
+    def test_checkpoint(self):
+        result = calculate_elo.run_elo(self.table)
+        n_seen = calculate_elo.players_seen(self.table)
+        n_kept = self.table.season_offsets[3]
+        checkpoint = calculate_elo.Checkpoint(
+            3, [result.season_ratings[s].tolist()[:n_seen[s]] for s in xrange(3)],
+            result.season_max[:3], result.match_ratings[:n_kept].T.tolist())
+        resumed = calculate_elo.run_elo(self.table, checkpoint=checkpoint)
+        self.assertTrue(np.array_equal(result.season_ratings, resumed.season_ratings))
+        self.assertEqual(result.season_max, resumed.season_max)
+        same = ((result.match_ratings == resumed.match_ratings) |
+                (np.isnan(result.match_ratings) & np.isnan(resumed.match_ratings)))
+        self.assertTrue(same.all())
+
+        # In one pass with another engine, as in calculate_elo.py
+        engines = [rating_engines.EloEngine(), rating_engines.Glicko2Engine()]
+        elo, glicko2 = rating_engines.run_engines(self.table, engines,
+                                                  checkpoints=[checkpoint, None])
+        combined = calculate_elo.elo_result(self.table, elo, checkpoint)
+        self.assertTrue(np.array_equal(result.season_ratings, combined.season_ratings))
+        self.assertEqual(result.season_max, combined.season_max)
+        glicko2_alone, = rating_engines.run_engines(self.table, [rating_engines.Glicko2Engine()])
+        self.assertTrue(np.array_equal(glicko2.season_ratings, glicko2_alone.season_ratings))
+        self.assertTrue(np.array_equal(elo.win_probability, rating_engines.season_win_probability(
+            self.table, result.season_ratings)))
+
+    def test_abstract(self):
+        class Engine(rating_engines.RatingEngine):
+            def reset(self, n_players): pass
+        self.assertRaises(TypeError, Engine)
+
+class LazyNumpyTest(unittest.TestCase):
+    def test_print_tools(self):
+        code = ('import sys, print_data, squash_queries, print_h2h\n'
+                'print sorted(m for m in ["numpy", "match_table"] if m in sys.modules)')
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+        self.assertEqual(output.strip(), '[]')
+
+if __name__ == '__main__':
+    unittest.main()